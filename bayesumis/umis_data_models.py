@@ -4,7 +4,7 @@ mathematical models
 """
 
 import sys
-from typing import Dict
+from typing import Callable, Dict, Sequence
 
 
 class Uncertainty():
@@ -226,6 +226,9 @@ class Material():
         self.is_separator = is_separator
 
     def __eq__(self, material_b: 'Material'):
+        if self is material_b:
+            return True
+
         assert(isinstance(material_b, Material))
         return self.stafdb_id == material_b.stafdb_id
 
@@ -263,6 +266,9 @@ class Timeframe():
         self.end_time = end_time
 
     def __eq__(self, timeframe_b: 'Timeframe'):
+        if self is timeframe_b:
+            return True
+
         assert isinstance(timeframe_b, Timeframe)
 
         return (self.start_time == timeframe_b.start_time and
@@ -640,6 +646,9 @@ class UmisProcess():
         return "{}_{}".format(process_stafdb_id, space.stafdb_id)
 
     def __eq__(self, process_b):
+        if self is process_b:
+            return True
+
         return self.diagram_id == process_b.diagram_id
 
     def __hash__(self):
@@ -743,9 +752,240 @@ class Flow(Staf):
         return super().__hash__()
 
     def __eq__(self, flow_b):
+        if self is flow_b:
+            return True
+
         return self.stafdb_id == flow_b.stafdb_id
 
 
+class LazyMaterialValues():
+    """
+    Material values of a stock or flow that are only loaded when a material
+    that was not prefetched, or every material, is asked for
+    """
+
+    def __init__(
+            self,
+            loader: Callable[[], Dict[Material, Value]],
+            prefetched_values: Dict[Material, Value] = {}):
+        """
+        Args
+        ----
+        loader (callable): Loads the value of every material of the stock or
+            flow
+        prefetched_values (dict(Material, Value)): Values known before
+            loading, a value of None if the material is known to have none
+        """
+        self.__loader = loader
+        self.__values = dict(prefetched_values)
+        self.is_loaded = False
+
+    def get(self, material: Material):
+        """ Gets the value of a material, loading every value if needed """
+        if material not in self.__values:
+            self.__load()
+
+        return self.__values.get(material)
+
+    def keys(self):
+        """ Gets every material with a value, loading them if needed """
+        self.__load()
+        return self.__values.keys()
+
+    def __load(self):
+        if self.is_loaded:
+            return
+
+        self.__values = self.__loader()
+        self.is_loaded = True
+
+    def __getstate__(self):
+        # The loader is bound to a database, so the values are loaded before
+        # being sent to another process
+        self.__load()
+
+        state = self.__dict__.copy()
+        state['_LazyMaterialValues__loader'] = None
+        return state
+
+
+class LazyValue(Value):
+    """
+    Value whose uncertainty is only built when it is first read, from its
+    row of the uncertainties of a table
+    """
+
+    def __init__(
+            self,
+            stafdb_id: str,
+            quantity: float,
+            uncertainties: Sequence[Uncertainty],
+            row_ind: int,
+            unit: str):
+        """
+        Args
+        ----
+        stafdb_id: Id of timeframe in Stafdb
+        quantity (float): Amount of material, if None then amount is unknown
+        uncertainties (sequence(Uncertainty)): Uncertainties of the rows of
+            a table, built when indexed
+        row_ind (int): Row of the value in uncertainties
+        unit (str): The unit of the material
+        """
+        assert isinstance(stafdb_id, str)
+        assert isinstance(unit, str)
+
+        self.stafdb_id = stafdb_id
+        self.quantity = float(quantity)
+        self.unit = unit
+
+        self.__uncertainties = uncertainties
+        self.__row_ind = row_ind
+
+    @property
+    def uncertainty(self) -> Uncertainty:
+        return self.__uncertainties[self.__row_ind]
+
+    def __reduce__(self):
+        # Pickled as a plain value rather than with every row of the table
+        return (Value,
+                (self.stafdb_id, self.quantity, self.uncertainty, self.unit))
+
+
+class LazyStockValue(LazyValue, StockValue):
+    """
+    Stock value whose uncertainty is only built when it is first read
+    """
+
+    def __init__(
+            self,
+            stafdb_id: str,
+            quantity: float,
+            uncertainties: Sequence[Uncertainty],
+            row_ind: int,
+            unit: str,
+            stock_type: str):
+        """
+        Args
+        ----
+        stafdb_id: Id of timeframe in Stafdb
+        quantity (float): Amount of material, if None then amount is unknown
+        uncertainties (sequence(Uncertainty)): Uncertainties of the rows of
+            a table, built when indexed
+        row_ind (int): Row of the value in uncertainties
+        unit (str): The unit of the material
+        stock_type (str): The type of stock being stored (net or total)
+        """
+        super(LazyStockValue, self).__init__(
+            stafdb_id, quantity, uncertainties, row_ind, unit)
+
+        if not (stock_type == 'Total' or stock_type == 'Net'):
+            raise ValueError(("Invalid stock type for data with id: {}, "
+                             "expected 'Total or 'Net', received {} instead")
+                             .format(stafdb_id, stock_type))
+
+        self.stock_type = stock_type
+
+    def __reduce__(self):
+        return (StockValue,
+                (self.stafdb_id,
+                 self.quantity,
+                 self.uncertainty,
+                 self.unit,
+                 self.stock_type))
+
+
+class LazyFlow(Flow):
+    """
+    Flow whose material values are loaded on first access, other than those
+    prefetched
+    """
+
+    def __init__(
+            self,
+            stafdb_id: str,
+            name: str,
+            staf_reference: StafReference,
+            origin_process: UmisProcess,
+            destination_process: UmisProcess,
+            material_values: LazyMaterialValues):
+        """
+        Args
+        ----
+        stafdb_id (str): ID for the flow in STAFDB
+        name (str): Name of flow
+        staf_reference (StafReference): Reference material and time for
+            flow
+        origin_process (UmisProcess): Process flow starts at
+        destination_process (UmisProcess): Process flow finishes at
+        material_values (LazyMaterialValues): Values of the flow for each
+            material
+        """
+        super(LazyFlow, self).__init__(
+            stafdb_id,
+            name,
+            staf_reference,
+            origin_process,
+            destination_process,
+            {})
+
+        self.__material_values = material_values
+
+    def get_value(self, material: Material):
+        assert isinstance(material, Material)
+        value = self.__material_values.get(material)
+        assert isinstance(value, Value) or value is None
+        return value
+
+    def get_materials(self):
+        return self.__material_values.keys()
+
+
+class LazyStock(Stock):
+    """
+    Stock whose material values are loaded on first access, other than those
+    prefetched
+    """
+
+    def __init__(
+            self,
+            stafdb_id: str,
+            name: str,
+            staf_reference: StafReference,
+            origin_process: UmisProcess,
+            destination_process: UmisProcess,
+            material_values: LazyMaterialValues):
+        """
+        Args
+        ----
+        stafdb_id (str): STAFDB id for the stock
+        name (str): Name of the stock
+        staf_reference (StafReference): Attributes the stock is about
+        origin_process (UmisProcess): Process material is being stored from
+        destination_process (UmisProcess): Process that is storing the stock
+        material_values (LazyMaterialValues): Values of the stock for each
+            material
+        """
+        super(LazyStock, self).__init__(
+            stafdb_id,
+            name,
+            staf_reference,
+            origin_process,
+            destination_process,
+            {})
+
+        self.__material_values = material_values
+
+    def get_value(self, material: Material):
+        assert isinstance(material, Material)
+        value = self.__material_values.get(material)
+        assert isinstance(value, StockValue) or value is None
+        return value
+
+    def get_materials(self):
+        return self.__material_values.keys()
+
+
 class ProcessOutputs():
     """
     Outflows of a process in a UmisDiagram
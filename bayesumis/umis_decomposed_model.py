@@ -0,0 +1,243 @@
+"""
+Math model of a diagram made of disconnected subsystems
+
+Subsystems that share no stocks or flows are independent given their
+observations, so each is built and sampled as its own UmisMathModel. Their
+samples are merged back into the index space of the math model of the whole
+diagram, so they can be read with get_staf_inds and get_input_inds as if the
+diagram had been sampled as one model.
+"""
+
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import (
+    Material,
+    Staf,
+    Timeframe,
+    Uncertainty)
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_inference_runner import InferenceJob, InferenceRunner
+from bayesumis.umis_math_model import UmisMathModel
+
+
+class DecomposedUmisMathModel():
+    """
+    Builds one math model per connected subsystem of a diagram and merges
+    their samples
+
+    Attributes
+    ----------
+    subsystems (list(UmisDiagram)): Diagram of each subsystem
+    math_models (list(UmisMathModel)): Math model of each subsystem, without
+        its pm model until it is sampled in this process
+    """
+    INPUT_VAR_NAME = UmisMathModel.INPUT_VAR_NAME
+    INPUT_CC_VAR_NAME = UmisMathModel.INPUT_CC_VAR_NAME
+    STAF_VAR_NAME = UmisMathModel.STAF_VAR_NAME
+    STAF_CC_VAR_NAME = UmisMathModel.STAF_CC_VAR_NAME
+    TC_VAR_NAME = UmisMathModel.TC_VAR_NAME
+
+    MATRIX_FILL_VALUES = {
+        INPUT_VAR_NAME: 0,
+        INPUT_CC_VAR_NAME: 1,
+        STAF_VAR_NAME: 0,
+        STAF_CC_VAR_NAME: 1,
+        TC_VAR_NAME: 0}
+    """ Value of the entries of each matrix outside every subsystem """
+
+    def __init__(
+            self,
+            umis_diagram: UmisDiagram,
+            reference_material: Material,
+            reference_time: Timeframe,
+            material_reconc_table: Dict[Material, Uncertainty] = {},
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            **model_kwargs):
+        """
+        Args
+        ----
+        umis_diagram (UmisDiagram): Diagram being reconciled
+        reference_material (Material): The material being balanced
+        reference_time (Timeframe): The timeframe over which the stocks and
+            flows are modeled
+        material_reconc_table (dict(Material, Uncertainty)): Maps a material
+            to its concentration coefficient
+        tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
+            origin process id to a dictionary mapping the destination process
+            id to its transfer coefficient
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+        """
+        self.subsystems = umis_diagram.get_subsystems()
+
+        self.__jobs = [
+            InferenceJob(
+                subsystem,
+                reference_material,
+                reference_time,
+                material_reconc_table,
+                tc_observation_table,
+                **model_kwargs)
+            for subsystem in self.subsystems]
+
+        self.math_models = [
+            job.build_math_model(build_pm_model=False)
+            for job in self.__jobs]
+
+        # Index space of the merged samples
+        self.__full_model = InferenceJob(
+            umis_diagram,
+            reference_material,
+            reference_time,
+            material_reconc_table,
+            tc_observation_table,
+            **model_kwargs).build_math_model(build_pm_model=False)
+
+        full_process_ids = self.__full_model.get_process_ids()
+        full_process_inds = {
+            process_id: process_ind
+            for process_ind, process_id in enumerate(full_process_ids)}
+
+        self.__num_processes = len(full_process_ids)
+
+        self.__subsystem_process_inds: List[np.ndarray] = [
+            np.array(
+                [full_process_inds[process_id]
+                 for process_id in math_model.get_process_ids()],
+                dtype=np.int64)
+            for math_model in self.math_models]
+        """ Index in the merged matrices of each process of a subsystem """
+
+    def sample(
+            self,
+            runner: InferenceRunner = None,
+            **sample_kwargs) -> Dict[str, np.ndarray]:
+        """
+        Samples every subsystem and merges their samples
+
+        Args
+        ----
+        runner (InferenceRunner): Runner sampling the subsystems in parallel,
+            if None they are sampled one after another in this process
+        sample_kwargs (dict): Keyword arguments of pm.sample, only used
+            without a runner
+
+        Returns
+        -------
+        dict(str, np.ndarray): Merged samples of each variable
+        """
+        if runner is not None:
+            results = runner.run(self.__jobs)
+
+            for subsystem_ind, result in enumerate(results):
+                if not result.succeeded:
+                    raise ValueError(
+                        "Sampling subsystem {} failed:\n{}".format(
+                            subsystem_ind,
+                            "\n".join(result.chain_errors.values())))
+
+            return self.merge_samples(results)
+
+        traces = []
+        for math_model in self.math_models:
+            if math_model.pm_model is None:
+                math_model.create_pm_model()
+
+            with math_model.pm_model:
+                traces.append(pm.sample(
+                    step=math_model.get_nuts_step(), **sample_kwargs))
+
+        return self.merge_samples(traces)
+
+    def merge_samples(self, subsystem_traces: list) -> Dict[str, np.ndarray]:
+        """
+        Merges the samples of each subsystem into the index space of the whole
+        diagram. Matrix variables are scattered into matrices over every
+        process, other variables are named after their processes and are
+        kept as they are, except the observation equations that every
+        subsystem names the same way
+
+        Args
+        ----
+        subsystem_traces (list): Trace or InferenceResult of each subsystem
+
+        Returns
+        -------
+        dict(str, np.ndarray): Merged samples of each variable
+        """
+        if len(subsystem_traces) != len(self.math_models):
+            raise ValueError("Expected samples of {} subsystems, received {}"
+                             .format(len(self.math_models),
+                                     len(subsystem_traces)))
+
+        merged_samples = {}
+        varname_counts = {}
+        for subsystem_ind, trace in enumerate(subsystem_traces):
+            process_inds = self.__subsystem_process_inds[subsystem_ind]
+
+            for varname in trace.varnames:
+                samples = trace[varname]
+
+                if varname not in self.MATRIX_FILL_VALUES:
+                    varname_counts[varname] = \
+                        varname_counts.get(varname, 0) + 1
+                    merged_samples[varname] = samples
+                    continue
+
+                if varname not in merged_samples:
+                    merged_samples[varname] = self.__create_merged_matrix(
+                        varname, samples)
+
+                merged_matrix = merged_samples[varname]
+                if merged_matrix.shape[0] != samples.shape[0]:
+                    raise ValueError(
+                        "Subsystems have different numbers of samples")
+
+                if varname in (self.INPUT_VAR_NAME, self.INPUT_CC_VAR_NAME):
+                    merged_matrix[..., process_inds, :] = samples
+                else:
+                    merged_matrix[(Ellipsis,) + np.ix_(
+                        process_inds, process_inds)] = samples
+
+        for varname, count in varname_counts.items():
+            if count > 1:
+                del merged_samples[varname]
+
+        return merged_samples
+
+    def get_input_inds(self, staf: Staf):
+        """ Gets the process index of the destination of the staf """
+        return self.__full_model.get_input_inds(staf)
+
+    def get_process_ind(self, process_id: str):
+        """ Gets the process index from process id """
+        return self.__full_model.get_process_ind(process_id)
+
+    def get_staf_inds(self, staf: Staf):
+        """ Gets the indices of a non input staf """
+        return self.__full_model.get_staf_inds(staf)
+
+    def __create_merged_matrix(
+            self,
+            varname: str,
+            samples: np.ndarray) -> np.ndarray:
+        """
+        Creates the merged samples of a matrix variable, shaped like the
+        samples of a subsystem with every process of the diagram
+        """
+        if varname in (self.INPUT_VAR_NAME, self.INPUT_CC_VAR_NAME):
+            matrix_shape = (self.__num_processes, samples.shape[-1])
+        else:
+            matrix_shape = (self.__num_processes, self.__num_processes)
+
+        return np.full(
+            samples.shape[:-2] + matrix_shape,
+            self.MATRIX_FILL_VALUES[varname],
+            dtype=samples.dtype)
+
+
+if __name__ == '__main__':
+    sys.exit(1)
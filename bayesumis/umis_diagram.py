@@ -1,6 +1,6 @@
 """Classes for a graph of processes and flows"""
 import sys
-from typing import Dict, Set
+from typing import Dict, List, Set
 
 from .umis_data_models import (
     DiagramReference,
@@ -221,6 +221,101 @@ class UmisDiagram():
 
         return self.__external_outflows
 
+    def get_subsystems(self) -> List['UmisDiagram']:
+        """
+        Splits the diagram into its connected subsystems. Processes are
+        connected by internal stocks and flows, an external flow belongs to
+        the subsystem of the process it enters or leaves, so subsystems that
+        only share an outside process are independent
+
+        Returns
+        -------
+        list(UmisDiagram): Diagram of each subsystem, ordered by the smallest
+            process diagram id in each
+        """
+        subsystem_parents: Dict[UmisProcess, UmisProcess] = {}
+
+        # Origins of external outflows may have no other stafs, so are not
+        # always in the process stafs dict
+        subsystem_processes = list(self.__process_stafs_dict)
+        for flow in self.__external_outflows:
+            if flow.origin_process not in self.__process_stafs_dict:
+                subsystem_processes.append(flow.origin_process)
+
+        internal_stafs: List[Staf] = []
+        for process in subsystem_processes:
+            self.__find_subsystem_root(subsystem_parents, process)
+
+            process_outputs = self.__process_stafs_dict.get(process)
+            if process_outputs is None:
+                continue
+
+            internal_stafs += list(process_outputs.flows)
+            if process_outputs.stock is not None:
+                internal_stafs.append(process_outputs.stock)
+
+        for staf in internal_stafs:
+            origin_root = self.__find_subsystem_root(
+                subsystem_parents, staf.origin_process)
+            dest_root = self.__find_subsystem_root(
+                subsystem_parents, staf.destination_process)
+
+            if origin_root is not dest_root:
+                subsystem_parents[dest_root] = origin_root
+
+        # Maps the root process of a subsystem to its inflows, internal
+        # stafs and outflows
+        subsystem_stafs: Dict[UmisProcess, tuple] = {}
+        for process in subsystem_processes:
+            root = self.__find_subsystem_root(subsystem_parents, process)
+            subsystem_stafs.setdefault(root, (set(), set(), set()))
+
+        for flow in self.__external_inflows:
+            root = self.__find_subsystem_root(
+                subsystem_parents, flow.destination_process)
+            subsystem_stafs[root][0].add(flow)
+
+        for staf in internal_stafs:
+            root = self.__find_subsystem_root(
+                subsystem_parents, staf.origin_process)
+            subsystem_stafs[root][1].add(staf)
+
+        for flow in self.__external_outflows:
+            root = self.__find_subsystem_root(
+                subsystem_parents, flow.origin_process)
+            subsystem_stafs[root][2].add(flow)
+
+        subsystem_process_ids: Dict[UmisProcess, str] = {}
+        for process in subsystem_processes:
+            root = self.__find_subsystem_root(subsystem_parents, process)
+            process_id = subsystem_process_ids.get(root, process.diagram_id)
+            subsystem_process_ids[root] = min(process_id, process.diagram_id)
+
+        roots = sorted(
+            subsystem_stafs, key=lambda root: subsystem_process_ids[root])
+
+        return [
+            UmisDiagram(*subsystem_stafs[root])
+            for root in roots]
+
+    @staticmethod
+    def __find_subsystem_root(
+            subsystem_parents: Dict[UmisProcess, UmisProcess],
+            process: UmisProcess) -> UmisProcess:
+        """
+        Finds the process representing the subsystem of a process, adding the
+        process as its own subsystem if it has not been seen
+        """
+        subsystem_parents.setdefault(process, process)
+
+        while subsystem_parents[process] is not process:
+            # Points the process at its grandparent to keep the paths short
+            subsystem_parents[process] = \
+                subsystem_parents[subsystem_parents[process]]
+            process = subsystem_parents[process]
+
+        return process
+
 
 if __name__ == '__main__':
     sys.exit(1)
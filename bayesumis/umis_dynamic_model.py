@@ -0,0 +1,343 @@
+"""
+Math model of a diagram over a series of timeframes
+
+Every timeframe of the series is a scenario of one batched UmisMathModel, so
+the transfer coefficients, inputs and stafs of all years are stacked along a
+leading year axis and the throughputs of every year are solved in one
+vectorised solve. Stocks link consecutive years: the net change of each
+storage process is accumulated over the years from its initial stock, and
+observations of stock levels constrain the series as a whole. The whole
+series is compiled and sampled once.
+"""
+
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pymc3 as pm
+import theano.tensor as T
+
+from bayesumis.umis_data_models import (
+    Constant,
+    Material,
+    NormalUncertainty,
+    Timeframe,
+    Uncertainty)
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import ADVI_METHOD, GAUSSIAN_METHOD, UmisFitResult
+from bayesumis.umis_math_model import (
+    MathStorageProcess,
+    ParamPrior,
+    UmisMathModel)
+
+
+class DynamicUmisMathModel():
+    """
+    Builds one math model over a series of timeframes, with the stock levels
+    of the storage processes carried over from one timeframe to the next
+
+    Attributes
+    ----------
+    reference_times (list(Timeframe)): Timeframe of each year of the series,
+        in order
+    math_model (UmisMathModel): Model with one scenario per timeframe, the
+        year axis of its variables
+    storage_ids (list(str)): Diagram id of each storage process, in the
+        order of the last axis of the stock variables
+    """
+    STOCK_CHANGE_VAR_NAME = 'Net stock changes'
+    STOCK_LEVEL_VAR_NAME = 'Stock levels'
+
+    def __init__(
+            self,
+            umis_diagrams: List[UmisDiagram],
+            reference_material: Material,
+            reference_times: List[Timeframe],
+            material_reconc_table: Dict[Material, Uncertainty] = {},
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            initial_stocks: Dict[str, Uncertainty] = {},
+            stock_level_observations:
+                Dict[str, Dict[int, NormalUncertainty]] = {},
+            build_pm_model: bool = True,
+            **model_kwargs):
+        """
+        Args
+        ----
+        umis_diagrams (list(UmisDiagram)): Diagram of each timeframe, or a
+            single diagram holding the stafs of every timeframe. Every
+            timeframe must give a model of the same structure
+        reference_material (Material): The material being balanced
+        reference_times (list(Timeframe)): Timeframe of each year of the
+            series, in order
+        material_reconc_table (dict(Material, Uncertainty)): Maps a material
+            to its concentration coefficient
+        tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
+            origin process id to a dictionary mapping the destination process
+            id to its transfer coefficient
+        initial_stocks (dict(str, Uncertainty)): Maps a storage process id to
+            its stock before the first timeframe, 0 if not given
+        stock_level_observations (dict(str, dict(int, NormalUncertainty))):
+            Maps a storage process id to a dictionary mapping the index of a
+            timeframe to the observed stock at its end
+        build_pm_model (bool): If False pm_model is built by create_pm_model
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+        """
+        if len(reference_times) == 0:
+            raise ValueError("Dynamic model needs at least one timeframe")
+
+        if len(umis_diagrams) not in (1, len(reference_times)):
+            raise ValueError("Expected 1 or {} diagrams, received {}"
+                             .format(len(reference_times),
+                                     len(umis_diagrams)))
+
+        if 'n_scenarios' in model_kwargs:
+            raise ValueError("The scenarios of a dynamic model are its "
+                             + "timeframes, n_scenarios cannot be set")
+
+        if len(umis_diagrams) == 1:
+            umis_diagrams = umis_diagrams * len(reference_times)
+
+        self.reference_times = list(reference_times)
+
+        model_args = [
+            (umis_diagram.get_external_inflows(),
+             umis_diagram.get_process_stafs_dict(),
+             umis_diagram.get_external_outflows(),
+             reference_material,
+             reference_time,
+             material_reconc_table,
+             tc_observation_table)
+            for umis_diagram, reference_time
+            in zip(umis_diagrams, reference_times)]
+
+        year_models = [
+            UmisMathModel(*args, build_pm_model=False, **model_kwargs)
+            for args in model_args]
+
+        fingerprint = year_models[0].get_structure_fingerprint()
+        for year, year_model in enumerate(year_models):
+            if year_model.get_structure_fingerprint() != fingerprint:
+                raise ValueError(
+                    "Model of timeframe {} has a different structure than "
+                    .format(reference_times[year])
+                    + "the model of timeframe {}"
+                    .format(reference_times[0]))
+
+        self.math_model = UmisMathModel(
+            *model_args[0],
+            build_pm_model=False,
+            n_scenarios=len(reference_times),
+            **model_kwargs)
+
+        for year, year_model in enumerate(year_models):
+            observations = year_model.get_observations()
+            self.math_model.update_observations(
+                staf_observations=observations['staf'],
+                cc_observations=observations['cc'],
+                tc_observations=observations['tc'],
+                scenario=year)
+
+        storage_ids = set(
+            math_process.process_id
+            for math_process in self.math_model.get_math_processes()
+            if isinstance(math_process, MathStorageProcess))
+
+        stock_inputs_dict = \
+            self.math_model.get_input_priors().stock_inputs_dict
+
+        storage_ids.update(
+            stock_input.staf_prior.origin_id
+            for stock_input in stock_inputs_dict.values())
+
+        self.storage_ids: List[str] = sorted(storage_ids)
+
+        self.__initial_stock_priors = self.__create_initial_stock_priors(
+            initial_stocks)
+
+        self.__stock_level_obs = self.__create_stock_level_obs(
+            stock_level_observations)
+
+        if build_pm_model:
+            self.create_pm_model()
+
+    @property
+    def pm_model(self) -> pm.Model:
+        """ Model of the series, None until create_pm_model is called """
+        return self.math_model.pm_model
+
+    def create_pm_model(self):
+        """
+        Builds the model of every timeframe and the stock levels linking
+        them
+        """
+        self.math_model.create_pm_model()
+
+        pm_model = self.math_model.pm_model
+        with pm_model:
+            stock_changes = pm.Deterministic(
+                self.STOCK_CHANGE_VAR_NAME,
+                self.__create_stock_changes(
+                    pm_model[UmisMathModel.STAF_VAR_NAME],
+                    pm_model[UmisMathModel.INPUT_VAR_NAME],
+                    pm_model[UmisMathModel.INPUT_CC_VAR_NAME]))
+
+            if len(self.__initial_stock_priors) > 0:
+                initial_stocks = T.stack(
+                    [prior.create_param_rv(self.math_model.parameterisation)
+                     for prior in self.__initial_stock_priors])
+            else:
+                initial_stocks = T.zeros((0,))
+
+            stock_levels = pm.Deterministic(
+                self.STOCK_LEVEL_VAR_NAME,
+                initial_stocks + T.cumsum(stock_changes, axis=0))
+
+            year_inds, storage_inds, means, sds = self.__stock_level_obs
+            if len(year_inds) > 0:
+                pm.Normal(
+                    'stock_level_priors',
+                    mu=means,
+                    sd=sds,
+                    observed=stock_levels[year_inds, storage_inds])
+
+    def fit(
+            self,
+            method: str = ADVI_METHOD,
+            **fit_kwargs) -> UmisFitResult:
+        """
+        Fits the posterior of the whole series, takes the arguments of
+        UmisMathModel.fit. Every variable has a leading year axis
+
+        Returns
+        -------
+        UmisFitResult: Samples of every variable and convergence diagnostics
+        """
+        if method == GAUSSIAN_METHOD:
+            raise ValueError("Stock levels of a dynamic model cannot be "
+                             + "reconciled in closed form")
+
+        if self.pm_model is None:
+            self.create_pm_model()
+
+        return self.math_model.fit(method=method, **fit_kwargs)
+
+    def get_nuts_step(self):
+        """ Gets a NUTS step method over pm_model """
+        return self.math_model.get_nuts_step()
+
+    def get_year_samples(self, trace, year: int) -> Dict[str, np.ndarray]:
+        """
+        Gets the samples of every variable for one timeframe, in the layout
+        of an unbatched trace so they can be indexed by the math model
+
+        Args
+        ----
+        trace (pm.backends.base.MultiTrace): Trace sampled from pm_model
+        year (int): Index of the timeframe in reference_times
+        """
+        return self.math_model.get_scenario_samples(trace, year)
+
+    def get_storage_ind(self, storage_id: str) -> int:
+        """ Gets the index of a storage process in the stock variables """
+        if storage_id not in self.storage_ids:
+            raise ValueError("Process with id: {} ".format(storage_id)
+                             + "is not a storage process of this model")
+
+        return self.storage_ids.index(storage_id)
+
+    def __create_initial_stock_priors(
+            self,
+            initial_stocks: Dict[str, Uncertainty]) -> List[ParamPrior]:
+        """ Creates the prior of the initial stock of each storage process """
+        for storage_id in initial_stocks:
+            self.get_storage_ind(storage_id)
+
+        return [
+            ParamPrior(
+                'Initial Stock',
+                storage_id,
+                storage_id,
+                initial_stocks.get(storage_id, Constant(0)))
+            for storage_id in self.storage_ids]
+
+    def __create_stock_level_obs(
+            self,
+            stock_level_observations: Dict[str, Dict[int, Uncertainty]]):
+        """
+        Creates the year and storage index, mean and standard deviation of
+        each stock level observation
+        """
+        year_inds = []
+        storage_inds = []
+        means = []
+        sds = []
+
+        for storage_id, year_observations in \
+                sorted(stock_level_observations.items()):
+            storage_ind = self.get_storage_ind(storage_id)
+
+            for year, uncertainty in sorted(year_observations.items()):
+                if not 0 <= year < len(self.reference_times):
+                    raise ValueError("Model has no timeframe {}".format(year))
+
+                if not isinstance(uncertainty, NormalUncertainty):
+                    raise ValueError(
+                        "Stock level observation must be NormalUncertainty, "
+                        + "received {}".format(type(uncertainty).__name__))
+
+                year_inds.append(year)
+                storage_inds.append(storage_ind)
+                means.append(uncertainty.mean)
+                sds.append(uncertainty.standard_deviation)
+
+        return (
+            np.array(year_inds, dtype=np.int64),
+            np.array(storage_inds, dtype=np.int64),
+            np.array(means),
+            np.array(sds))
+
+    def __create_stock_changes(
+            self,
+            stafs: T.Variable,
+            inputs: T.Variable,
+            input_ccs: T.Variable) -> T.Variable:
+        """
+        Net change of each storage process in each year, the stafs into it
+        less the inputs drawn from its stock
+
+        Returns
+        -------
+        T.Variable: Matrix of years x storage processes
+        """
+        stock_inputs_dict = \
+            self.math_model.get_input_priors().stock_inputs_dict
+
+        num_years = len(self.reference_times)
+        process_ids = self.math_model.get_process_ids()
+
+        storage_changes = []
+        for storage_id in self.storage_ids:
+            storage_change = T.zeros((num_years,))
+
+            if storage_id in process_ids:
+                storage_ind = self.math_model.get_process_ind(storage_id)
+                storage_change += T.sum(stafs[:, :, storage_ind], axis=-1)
+
+            for dest_id, stock_input in sorted(stock_inputs_dict.items()):
+                if stock_input.staf_prior.origin_id != storage_id:
+                    continue
+
+                dest_ind = self.math_model.get_process_ind(dest_id)
+                storage_change -= (
+                    inputs[:, dest_ind, 1] * input_ccs[:, dest_ind, 1])
+
+            storage_changes.append(storage_change)
+
+        if len(storage_changes) == 0:
+            return T.zeros((num_years, 0))
+
+        return T.stack(storage_changes, axis=-1)
+
+
+if __name__ == '__main__':
+    sys.exit(1)
@@ -0,0 +1,347 @@
+"""
+Fits the posterior of a math model by variational inference or NUTS
+
+Variational inference gives an approximate posterior in a fraction of the
+time of NUTS. Its convergence is checked, and NUTS can be warm started from
+the variational solution, either on request or as a fallback when the
+approximation has not converged. Models with only normal observations and
+known coefficients can instead be reconciled in closed form.
+"""
+
+import sys
+from typing import Dict
+
+import numpy as np
+import pymc3 as pm
+from pymc3.step_methods.hmc import quadpotential
+from pymc3.variational.callbacks import CheckParametersConvergence
+
+ADVI_METHOD = 'advi'
+FULLRANK_ADVI_METHOD = 'fullrank_advi'
+NUTS_METHOD = 'nuts'
+GAUSSIAN_METHOD = 'gaussian'
+
+VARIATIONAL_METHODS = (ADVI_METHOD, FULLRANK_ADVI_METHOD)
+FIT_METHODS = VARIATIONAL_METHODS + (NUTS_METHOD, GAUSSIAN_METHOD)
+
+CONVERGENCE_CHECK_EVERY = 100
+""" Number of variational iterations between convergence checks """
+
+
+class ParameterChangeCheck(CheckParametersConvergence):
+    """
+    Stops a variational fit once its parameters converge, keeping the
+    relative change of the parameters at the last check
+
+    Attributes
+    ----------
+    parameter_change (float): Norm of the relative change of the
+        parameters at the last check, None before the first check
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.parameter_change = None
+
+    def __call__(self, approx, loss_hist, i):
+        # Same condition and norm as the check of the parent class, which
+        # does not keep them
+        if (self.prev is not None
+                and not (i % self.every or i < self.every)):
+            current = self.flatten_shared(approx.params)
+            delta = np.abs(self._diff(current, self.prev))
+            self.parameter_change = float(np.linalg.norm(delta, self.ord))
+
+        super().__call__(approx, loss_hist, i)
+
+
+class UmisFitResult():
+    """
+    Posterior samples of a math model and diagnostics of the fit. Indexing by
+    a variable name gives its samples, as with a pymc3 trace
+
+    Attributes
+    ----------
+    method (str): Method that produced the samples, 'nuts' if a variational
+        or closed form fit fell back to NUTS
+    trace (pm.backends.base.MultiTrace): Posterior samples, a dict of samples
+        for closed form fits
+    approximation (pm.Approximation): Variational approximation, None if no
+        variational fit was run
+    elbo_history (np.ndarray): ELBO at each iteration of the variational
+        fit, None if no variational fit was run
+    converged (bool): Whether the variational fit converged, or for NUTS
+        whether every Gelman-Rubin statistic is below 1.1
+    diagnostics (dict(str, object)): Convergence statistics of the samples,
+        'gelman_rubin', 'effective_n' and 'n_divergences' for NUTS, the exact
+        'estimates' and 'standard_deviations' for closed form fits, the last
+        relative 'parameter_change' and the 'elbo_tail' of the iterations
+        since the previous check for variational fits
+    """
+
+    def __init__(
+            self,
+            method: str,
+            trace,
+            approximation=None,
+            converged: bool = None,
+            diagnostics: Dict[str, object] = None):
+        self.method = method
+        self.trace = trace
+        self.approximation = approximation
+        self.converged = converged
+
+        if diagnostics is None:
+            diagnostics = {}
+        self.diagnostics = diagnostics
+
+        if approximation is not None:
+            self.elbo_history = -np.asarray(approximation.hist)
+        else:
+            self.elbo_history = None
+
+    def __getitem__(self, varname: str) -> np.ndarray:
+        return self.trace[varname]
+
+    @property
+    def varnames(self):
+        if isinstance(self.trace, dict):
+            return list(self.trace.keys())
+
+        return self.trace.varnames
+
+
+def fit_model(
+        pm_model: pm.Model,
+        method: str = ADVI_METHOD,
+        draws: int = 1000,
+        n_iterations: int = 20000,
+        tolerance: float = 1e-3,
+        warm_start: bool = False,
+        fallback: bool = False,
+        tune: int = 1000,
+        chains: int = 2,
+        random_seed: int = None,
+        **sample_kwargs) -> UmisFitResult:
+    """
+    Fits the posterior of a pm model
+
+    Args
+    ----
+    pm_model (pm.Model): Model to fit
+    method (str): One of FIT_METHODS
+    draws (int): Number of posterior samples, per chain for NUTS
+    n_iterations (int): Maximum number of variational iterations
+    tolerance (float): Relative change of the variational parameters below
+        which the fit has converged
+    warm_start (bool): For NUTS, starts the chains from an ADVI fit and
+        scales the mass matrix by its variances
+    fallback (bool): For variational methods, samples with NUTS warm
+        started from the approximation if it has not converged
+    tune (int): Number of NUTS tuning steps per chain
+    chains (int): Number of NUTS chains
+    random_seed (int): Seed of the fit
+    sample_kwargs (dict): Other keyword arguments of pm.sample
+
+    Returns
+    -------
+    UmisFitResult: Posterior samples and diagnostics
+    """
+    if method not in FIT_METHODS:
+        raise ValueError("Fit method must be one of {}, received {}"
+                         .format(FIT_METHODS, method))
+
+    if method == GAUSSIAN_METHOD:
+        raise ValueError("Closed form fits need the math model, use "
+                         + "UmisMathModel.fit")
+
+    if method == NUTS_METHOD:
+        approximation = None
+        if warm_start:
+            approximation, _, _ = fit_variational(
+                pm_model,
+                ADVI_METHOD,
+                n_iterations,
+                tolerance,
+                random_seed)
+
+        return sample_nuts(
+            pm_model,
+            draws,
+            tune,
+            chains,
+            random_seed,
+            approximation,
+            **sample_kwargs)
+
+    approximation, converged, diagnostics = fit_variational(
+        pm_model,
+        method,
+        n_iterations,
+        tolerance,
+        random_seed)
+
+    if not converged and fallback:
+        return sample_nuts(
+            pm_model,
+            draws,
+            tune,
+            chains,
+            random_seed,
+            approximation,
+            **sample_kwargs)
+
+    trace = approximation.sample(draws)
+
+    return UmisFitResult(
+        method,
+        trace,
+        approximation=approximation,
+        converged=converged,
+        diagnostics=diagnostics)
+
+
+def fit_gaussian(
+        gaussian_engine,
+        draws: int,
+        random_seed: int = None) -> UmisFitResult:
+    """
+    Reconciles a model in closed form and draws samples of its posterior
+
+    Args
+    ----
+    gaussian_engine (GaussianReconciliationEngine): Engine of a qualifying
+        model
+    draws (int): Number of posterior samples
+    random_seed (int): Seed of the samples
+
+    Returns
+    -------
+    UmisFitResult: Samples with the exact posterior means and standard
+        deviations as diagnostics
+    """
+    reconciliation = gaussian_engine.reconcile()
+
+    diagnostics = {
+        'estimates': reconciliation.estimates,
+        'standard_deviations': reconciliation.standard_deviations}
+
+    return UmisFitResult(
+        GAUSSIAN_METHOD,
+        reconciliation.sample(draws, random_seed),
+        converged=True,
+        diagnostics=diagnostics)
+
+
+def fit_variational(
+        pm_model: pm.Model,
+        method: str,
+        n_iterations: int,
+        tolerance: float,
+        random_seed: int = None):
+    """
+    Runs a variational fit, stopping early once its parameters converge
+
+    Returns
+    -------
+    approximation, converged, diagnostics (tuple(pm.Approximation, bool,
+        dict(str, object))): Fitted approximation, whether it stopped before
+        n_iterations, the last relative 'parameter_change', None if it was
+        never checked, and the 'elbo_tail' since the previous check
+    """
+    if method not in VARIATIONAL_METHODS:
+        raise ValueError("Variational method must be one of {}, received {}"
+                         .format(VARIATIONAL_METHODS, method))
+
+    convergence = ParameterChangeCheck(
+        every=CONVERGENCE_CHECK_EVERY, tolerance=tolerance, diff='relative')
+
+    with pm_model:
+        approximation = pm.fit(
+            n=n_iterations,
+            method=method,
+            callbacks=[convergence],
+            random_seed=random_seed,
+            progressbar=False)
+
+    converged = len(approximation.hist) < n_iterations
+
+    elbo_history = -np.asarray(approximation.hist)
+    diagnostics = {
+        'parameter_change': convergence.parameter_change,
+        'elbo_tail': elbo_history[-CONVERGENCE_CHECK_EVERY:]}
+
+    return approximation, converged, diagnostics
+
+
+def sample_nuts(
+        pm_model: pm.Model,
+        draws: int,
+        tune: int,
+        chains: int,
+        random_seed: int = None,
+        approximation=None,
+        **sample_kwargs) -> UmisFitResult:
+    """
+    Samples with NUTS, warm started from a variational approximation if one
+    is given
+
+    Returns
+    -------
+    UmisFitResult: Samples with their Gelman-Rubin statistics, effective
+        sample sizes and number of divergences
+    """
+    with pm_model:
+        if approximation is None:
+            trace = pm.sample(
+                draws,
+                tune=tune,
+                chains=chains,
+                random_seed=random_seed,
+                **sample_kwargs)
+        else:
+            mean = approximation.bij.rmap(approximation.mean.get_value())
+            mean = pm_model.dict_to_array(mean)
+
+            stds = approximation.bij.rmap(approximation.std.eval())
+            variances = pm_model.dict_to_array(stds) ** 2
+
+            # Same weight pymc3 gives the variational variances when
+            # initialising with advi+adapt_diag
+            potential = quadpotential.QuadPotentialDiagAdapt(
+                pm_model.ndim, mean, variances, 50)
+
+            start = list(approximation.sample(draws=chains))
+
+            trace = pm.sample(
+                draws,
+                tune=tune,
+                chains=chains,
+                step=pm.NUTS(potential=potential),
+                start=start,
+                random_seed=random_seed,
+                **sample_kwargs)
+
+    diagnostics = {
+        'n_divergences': int(np.sum(trace.get_sampler_stats('diverging')))}
+
+    converged = None
+    if chains > 1:
+        gelman_rubin = pm.diagnostics.gelman_rubin(trace)
+        diagnostics['gelman_rubin'] = gelman_rubin
+        diagnostics['effective_n'] = pm.diagnostics.effective_n(trace)
+
+        converged = all(
+            np.all(np.asarray(statistic) < 1.1)
+            for statistic in gelman_rubin.values())
+
+    return UmisFitResult(
+        NUTS_METHOD,
+        trace,
+        approximation=approximation,
+        converged=converged,
+        diagnostics=diagnostics)
+
+
+if __name__ == '__main__':
+    sys.exit(1)
@@ -0,0 +1,454 @@
+"""
+Closed form reconciliation of diagrams with only normal observations
+
+When every transfer coefficient and concentration coefficient is known, the
+process throughputs are linear in the inputs, x = (I - TC^T)^-1 B u, and so
+is every staf. With normal priors on the inputs and normal observations of
+the stafs the posterior is normal, and its mean and covariance are given by
+the weighted least squares (Kalman) update
+
+    K = S0 H^T (H S0 H^T + R)^-1
+    u = u0 + K (y - H u0)
+    S = S0 - K H S0
+
+where u0, S0 are the prior mean and covariance of the inputs, H maps the
+inputs to the observed stafs and R is the covariance of the observations.
+"""
+
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from bayesumis.umis_data_models import (
+    Constant,
+    NormalUncertainty,
+    Uncertainty)
+from bayesumis.umis_math_model import (
+    LOG_PARAMETERISATION,
+    MathDistributionProcess,
+    MathTransformationProcess,
+    ParamPrior,
+    UmisMathModel)
+
+
+class GaussianReconciliationResult():
+    """
+    Posterior of a closed form reconciliation. Estimates and standard
+    deviations are in the layout of the variables of the pm model, so
+    estimates can be passed to make_estimates_dict as a map estimate
+
+    Attributes
+    ----------
+    estimates (dict(str, np.ndarray)): Posterior mean of the Inputs, Input
+        CCs, TCs, Staf CCs and Stafs matrices
+    standard_deviations (dict(str, np.ndarray)): Posterior standard deviation
+        of each entry of the same matrices
+    input_mean (np.ndarray): Posterior mean of the inputs
+    input_covariance (np.ndarray): Posterior covariance of the inputs
+    """
+
+    def __init__(
+            self,
+            input_mean: np.ndarray,
+            input_covariance: np.ndarray,
+            input_inds: np.ndarray,
+            input_cols: np.ndarray,
+            throughput_map: np.ndarray,
+            tc_matrix: np.ndarray,
+            input_cc_matrix: np.ndarray,
+            staf_cc_matrix: np.ndarray):
+        """
+        Args
+        ----
+        input_mean (np.ndarray): Posterior mean of the inputs
+        input_covariance (np.ndarray): Posterior covariance of the inputs
+        input_inds (np.ndarray): Process index of each input
+        input_cols (np.ndarray): Column of each input in the Inputs matrix
+        throughput_map (np.ndarray): Matrix mapping the inputs to the process
+            throughputs
+        tc_matrix (np.ndarray): Transfer coefficient matrix
+        input_cc_matrix (np.ndarray): Input concentration coefficient matrix
+        staf_cc_matrix (np.ndarray): Staf concentration coefficient matrix
+        """
+        self.input_mean = input_mean
+        self.input_covariance = input_covariance
+
+        self.__input_inds = input_inds
+        self.__input_cols = input_cols
+        self.__throughput_map = throughput_map
+        self.__tc_matrix = tc_matrix
+        self.__input_cc_matrix = input_cc_matrix
+        self.__staf_cc_matrix = staf_cc_matrix
+
+        # Reconciled staf (o, d) is tc[o, d] / cc[o, d] * throughput[o]
+        self.__staf_weights = tc_matrix / staf_cc_matrix
+
+        throughput_mean = throughput_map.dot(input_mean)
+        throughput_vars = np.einsum(
+            'ij,jk,ik->i', throughput_map, input_covariance, throughput_map)
+        throughput_sds = np.sqrt(np.maximum(throughput_vars, 0))
+
+        input_sds = np.sqrt(np.maximum(np.diag(input_covariance), 0))
+
+        self.estimates: Dict[str, np.ndarray] = {
+            UmisMathModel.INPUT_VAR_NAME: self.__make_inputs_matrix(
+                input_mean),
+            UmisMathModel.INPUT_CC_VAR_NAME: input_cc_matrix,
+            UmisMathModel.TC_VAR_NAME: tc_matrix,
+            UmisMathModel.STAF_CC_VAR_NAME: staf_cc_matrix,
+            UmisMathModel.STAF_VAR_NAME:
+                self.__staf_weights * throughput_mean[:, None]}
+
+        self.standard_deviations: Dict[str, np.ndarray] = {
+            UmisMathModel.INPUT_VAR_NAME: self.__make_inputs_matrix(
+                input_sds),
+            UmisMathModel.INPUT_CC_VAR_NAME: np.zeros_like(input_cc_matrix),
+            UmisMathModel.TC_VAR_NAME: np.zeros_like(tc_matrix),
+            UmisMathModel.STAF_CC_VAR_NAME: np.zeros_like(staf_cc_matrix),
+            UmisMathModel.STAF_VAR_NAME:
+                np.abs(self.__staf_weights) * throughput_sds[:, None]}
+
+    def sample(self, draws: int, random_seed: int = None) \
+            -> Dict[str, np.ndarray]:
+        """
+        Draws samples of the matrices from the posterior
+
+        Args
+        ----
+        draws (int): Number of samples
+        random_seed (int): Seed of the samples
+
+        Returns
+        -------
+        dict(str, np.ndarray): Samples of each matrix, in the layout of a
+            trace from pm.sample
+        """
+        random_state = np.random.RandomState(random_seed)
+        input_draws = random_state.multivariate_normal(
+            self.input_mean, self.input_covariance, size=draws)
+
+        throughput_draws = input_draws.dot(self.__throughput_map.T)
+
+        def repeat(matrix):
+            return np.repeat(matrix[None], draws, axis=0)
+
+        return {
+            UmisMathModel.INPUT_VAR_NAME:
+                self.__make_inputs_matrix(input_draws),
+            UmisMathModel.INPUT_CC_VAR_NAME: repeat(self.__input_cc_matrix),
+            UmisMathModel.TC_VAR_NAME: repeat(self.__tc_matrix),
+            UmisMathModel.STAF_CC_VAR_NAME: repeat(self.__staf_cc_matrix),
+            UmisMathModel.STAF_VAR_NAME:
+                self.__staf_weights[None] * throughput_draws[:, :, None]}
+
+    def __make_inputs_matrix(self, input_values: np.ndarray) -> np.ndarray:
+        """
+        Scatters input values, or rows of samples of them, into the Inputs
+        matrix layout
+        """
+        num_processes = self.__throughput_map.shape[0]
+        inputs_matrix = np.zeros(input_values.shape[:-1] + (num_processes, 2))
+        inputs_matrix[..., self.__input_inds, self.__input_cols] = \
+            input_values
+
+        return inputs_matrix
+
+
+class GaussianReconciliationEngine():
+    """
+    Reconciles a math model in closed form if all of its observations are
+    normal and all of its coefficients are known
+
+    Attributes
+    ----------
+    math_model (UmisMathModel): Model being reconciled, its pm model is not
+        needed
+    """
+
+    def __init__(self, math_model: UmisMathModel):
+        """
+        Args
+        ----
+        math_model (UmisMathModel): Model being reconciled
+        """
+        assert isinstance(math_model, UmisMathModel)
+
+        self.math_model = math_model
+
+    def get_disqualifications(self) -> List[str]:
+        """
+        Gets the reasons the model cannot be reconciled in closed form, empty
+        if it qualifies
+        """
+        math_model = self.math_model
+        reasons = []
+
+        if math_model.n_scenarios is not None:
+            reasons.append("Models with scenarios are not supported")
+
+        # Normal priors are truncated at 0, so the posterior is not normal
+        if math_model.parameterisation == LOG_PARAMETERISATION:
+            reasons.append("Normal priors of the {} parameterisation are "
+                           .format(LOG_PARAMETERISATION) + "truncated")
+
+        input_priors = math_model.get_input_priors()
+        for input_prior in (
+                list(input_priors.external_inputs_dict.values())
+                + list(input_priors.stock_inputs_dict.values())):
+
+            if not isinstance(
+                    input_prior.staf_prior.uncertainty, NormalUncertainty):
+                reasons.append("Input {} is not normal".format(
+                    input_prior.staf_prior.param_name))
+
+            if not isinstance(input_prior.cc_prior.uncertainty, Constant):
+                reasons.append("Concentration coefficient {} is not known"
+                               .format(input_prior.cc_prior.param_name))
+
+        dep_staf_priors = math_model.get_dep_staf_priors()
+        for dep_staf_prior in (
+                dep_staf_priors.lognormal_dep_staf_priors
+                + dep_staf_priors.uniform_dep_staf_priors):
+            reasons.append("Observation {} is not normal".format(
+                dep_staf_prior.staf_prior.param_name))
+
+        for dep_staf_prior in dep_staf_priors.normal_dep_staf_priors:
+            if not isinstance(dep_staf_prior.cc_prior.uncertainty, Constant):
+                reasons.append("Concentration coefficient {} is not known"
+                               .format(dep_staf_prior.cc_prior.param_name))
+
+        for math_process in math_model.get_math_processes():
+            if math_process.n_outflows < 2:
+                continue
+
+            # The pm model draws these from a Dirichlet even when every
+            # share is a Constant, so they are never known
+            if isinstance(math_process, MathDistributionProcess):
+                reasons.append("Transfer coefficients of distribution "
+                               + "process {} are Dirichlet distributed"
+                               .format(math_process.process_id))
+                continue
+
+            known_tcs = self.__get_known_tcs(math_process)
+            if known_tcs is None:
+                reasons.append("Transfer coefficients of process {} are not "
+                               .format(math_process.process_id) + "known")
+
+        return reasons
+
+    def qualifies(self) -> bool:
+        """ True if the model can be reconciled in closed form """
+        return len(self.get_disqualifications()) == 0
+
+    def reconcile(self) -> GaussianReconciliationResult:
+        """
+        Computes the posterior of the inputs and every staf
+
+        Returns
+        -------
+        GaussianReconciliationResult: Posterior means and standard deviations
+        """
+        reasons = self.get_disqualifications()
+        if reasons:
+            raise ValueError("Model cannot be reconciled in closed form:\n{}"
+                             .format("\n".join(reasons)))
+
+        math_model = self.math_model
+        num_processes = len(math_model.get_process_ids())
+
+        tc_matrix = self.__create_tc_matrix(num_processes)
+
+        (input_inds,
+         input_cols,
+         input_ccs,
+         prior_means,
+         prior_sds) = self.__create_input_vectors()
+
+        num_inputs = len(input_inds)
+
+        input_cc_matrix = np.ones((num_processes, 2))
+        input_cc_matrix[input_inds, input_cols] = input_ccs
+
+        # Total input into each process is input_map u
+        input_map = np.zeros((num_processes, num_inputs))
+        input_map[input_inds, np.arange(num_inputs)] = input_ccs
+
+        system = np.eye(num_processes) - tc_matrix.T
+        try:
+            throughput_map = np.linalg.solve(system, input_map)
+        except np.linalg.LinAlgError:
+            raise ValueError("Throughput equations of the model are singular")
+
+        (obs_origin_inds,
+         obs_dest_inds,
+         obs_ccs,
+         obs_means,
+         obs_sds) = self.__create_observation_vectors()
+
+        staf_cc_matrix = np.ones((num_processes, num_processes))
+        staf_cc_matrix[obs_origin_inds, obs_dest_inds] = obs_ccs
+
+        # Observed staf k is a linear function, obs_map[k] u, of the inputs
+        obs_weights = tc_matrix[obs_origin_inds, obs_dest_inds] / obs_ccs
+        obs_map = obs_weights[:, None] * throughput_map[obs_origin_inds]
+
+        prior_covariance = np.diag(prior_sds ** 2)
+
+        if len(obs_means) > 0:
+            innovation_covariance = (
+                obs_map.dot(prior_covariance).dot(obs_map.T)
+                + np.diag(obs_sds ** 2))
+
+            gain = np.linalg.solve(
+                innovation_covariance, obs_map.dot(prior_covariance)).T
+
+            input_mean = prior_means + gain.dot(
+                obs_means - obs_map.dot(prior_means))
+            input_covariance = (
+                prior_covariance - gain.dot(obs_map).dot(prior_covariance))
+
+            # Symmetrised to remove rounding errors
+            input_covariance = (input_covariance + input_covariance.T) / 2
+        else:
+            input_mean = prior_means
+            input_covariance = prior_covariance
+
+        return GaussianReconciliationResult(
+            input_mean,
+            input_covariance,
+            input_inds,
+            input_cols,
+            throughput_map,
+            tc_matrix,
+            input_cc_matrix,
+            staf_cc_matrix)
+
+    def __create_tc_matrix(self, num_processes: int) -> np.ndarray:
+        """
+        Builds the transfer coefficient matrix from the known transfer
+        coefficients, which the pm model holds fixed
+        """
+        math_model = self.math_model
+        tc_matrix = np.zeros((num_processes, num_processes))
+
+        for math_process in math_model.get_math_processes():
+            if math_process.n_outflows == 0:
+                continue
+
+            if math_process.n_outflows == 1:
+                dest_tcs = {math_process.process_outflow_tcs[0].dest_id: 1.0}
+            else:
+                dest_tcs = self.__get_known_tcs(math_process)
+
+            for dest_id, tc_value in dest_tcs.items():
+                tc_matrix[
+                    math_process.process_ind,
+                    math_model.get_process_ind(dest_id)] = tc_value
+
+        return tc_matrix
+
+    @staticmethod
+    def __get_known_tcs(math_process) -> Dict[str, float]:
+        """
+        Gets the transfer coefficient to each destination of a
+        transformation process with two outflows, None if they are not known
+        """
+        tc_priors: List[ParamPrior] = math_process.process_outflow_tcs
+
+        if isinstance(math_process, MathTransformationProcess):
+            # The pm model uses the first observed tc and ignores the other
+            observed_tcs = [
+                tc for tc in tc_priors
+                if isinstance(tc.uncertainty, Uncertainty)]
+
+            if (len(observed_tcs) == 0
+                    or not isinstance(observed_tcs[0].uncertainty, Constant)):
+                return None
+
+            known_tc = observed_tcs[0]
+            other_tc = [tc for tc in tc_priors if tc is not known_tc][0]
+
+            tc_value = min(max(known_tc.uncertainty.mean, 0), 1)
+
+            return {
+                known_tc.dest_id: tc_value,
+                other_tc.dest_id: 1 - tc_value}
+
+        return None
+
+    def __create_input_vectors(self):
+        """
+        Returns
+        -------
+        input_inds, input_cols, input_ccs, means, sds (tuple(np.ndarray)):
+            Process index, Inputs matrix column, concentration coefficient,
+            prior mean and prior standard deviation of each input
+        """
+        math_model = self.math_model
+        input_priors = math_model.get_input_priors()
+
+        inputs = (
+            [(input_prior, 0) for input_prior
+             in input_priors.external_inputs_dict.values()]
+            + [(input_prior, 1) for input_prior
+               in input_priors.stock_inputs_dict.values()])
+
+        input_inds = np.array(
+            [math_model.get_process_ind(input_prior.staf_prior.dest_id)
+             for input_prior, _ in inputs],
+            dtype=np.int64)
+
+        input_cols = np.array([col for _, col in inputs], dtype=np.int64)
+
+        input_ccs = np.array(
+            [input_prior.cc_prior.uncertainty.mean
+             for input_prior, _ in inputs])
+
+        means = np.array(
+            [input_prior.staf_prior.uncertainty.mean
+             for input_prior, _ in inputs])
+
+        sds = np.array(
+            [input_prior.staf_prior.uncertainty.standard_deviation
+             for input_prior, _ in inputs])
+
+        return input_inds, input_cols, input_ccs, means, sds
+
+    def __create_observation_vectors(self):
+        """
+        Returns
+        -------
+        origin_inds, dest_inds, ccs, means, sds (tuple(np.ndarray)): Origin
+            and destination process index, concentration coefficient, mean
+            and standard deviation of each staf observation
+        """
+        math_model = self.math_model
+        dep_staf_priors = \
+            math_model.get_dep_staf_priors().normal_dep_staf_priors
+
+        origin_inds = np.array(
+            [math_model.get_process_ind(prior.staf_prior.origin_id)
+             for prior in dep_staf_priors],
+            dtype=np.int64)
+
+        dest_inds = np.array(
+            [math_model.get_process_ind(prior.staf_prior.dest_id)
+             for prior in dep_staf_priors],
+            dtype=np.int64)
+
+        ccs = np.array(
+            [prior.cc_prior.uncertainty.mean for prior in dep_staf_priors])
+
+        means = np.array(
+            [prior.staf_prior.uncertainty.mean for prior in dep_staf_priors])
+
+        sds = np.array(
+            [prior.staf_prior.uncertainty.standard_deviation
+             for prior in dep_staf_priors])
+
+        return origin_inds, dest_inds, ccs, means, sds
+
+
+if __name__ == '__main__':
+    sys.exit(1)
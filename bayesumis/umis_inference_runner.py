@@ -0,0 +1,426 @@
+"""
+Runs inference over many independent diagrams across a pool of processes
+
+Every chain of every job is sampled as its own task, so a batch of jobs keeps
+all cores busy. Each worker is pinned to one core and keeps a model cache, so
+the chains of one job, and jobs with the same structure, reuse one compiled
+model.
+"""
+
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Queue
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import Material, Timeframe, Uncertainty
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_math_model import UmisMathModel
+from bayesumis.umis_model_cache import UmisModelCache
+
+_worker_model_cache: UmisModelCache = None
+""" Model cache of the worker process, created by __init_worker """
+
+
+class InferenceJob():
+    """
+    A diagram to reconcile and the arguments of its math model
+
+    Attributes
+    ----------
+    umis_diagram (UmisDiagram): Diagram being reconciled
+    reference_material (Material): The material being balanced
+    reference_time (Timeframe): The timeframe over which the stocks and
+        flows are modeled
+    material_reconc_table (dict(Material, Uncertainty)): Maps a material to
+        its concentration coefficient
+    tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an origin
+        process id to a dictionary mapping the destination process id to its
+        transfer coefficient
+    model_kwargs (dict): Other keyword arguments of UmisMathModel
+    """
+
+    def __init__(
+            self,
+            umis_diagram: UmisDiagram,
+            reference_material: Material,
+            reference_time: Timeframe,
+            material_reconc_table: Dict[Material, Uncertainty] = {},
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            **model_kwargs):
+        """
+        Args
+        ----
+        umis_diagram (UmisDiagram): Diagram being reconciled
+        reference_material (Material): The material being balanced
+        reference_time (Timeframe): The timeframe over which the stocks and
+            flows are modeled
+        material_reconc_table (dict(Material, Uncertainty)): Maps a material
+            to its concentration coefficient
+        tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
+            origin process id to a dictionary mapping the destination process
+            id to its transfer coefficient
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+        """
+        assert isinstance(umis_diagram, UmisDiagram)
+        assert isinstance(reference_material, Material)
+        assert isinstance(reference_time, Timeframe)
+
+        self.umis_diagram = umis_diagram
+        self.reference_material = reference_material
+        self.reference_time = reference_time
+        self.material_reconc_table = material_reconc_table
+        self.tc_observation_table = tc_observation_table
+        self.model_kwargs = model_kwargs
+
+    def get_model_args(self) -> dict:
+        """
+        Gets the keyword arguments of the math model of the job
+        """
+        model_args = dict(
+            external_inflows=self.umis_diagram.get_external_inflows(),
+            process_stafs_dict=self.umis_diagram.get_process_stafs_dict(),
+            external_outflows=self.umis_diagram.get_external_outflows(),
+            reference_material=self.reference_material,
+            reference_time=self.reference_time,
+            material_reconc_table=self.material_reconc_table,
+            tc_observation_table=self.tc_observation_table)
+
+        model_args.update(self.model_kwargs)
+        return model_args
+
+    def build_math_model(self, build_pm_model: bool = True) -> UmisMathModel:
+        """
+        Builds the math model of the job. Process indices only depend on the
+        diagram, so a model built without its pm model indexes the traces
+        sampled by the workers
+        """
+        return UmisMathModel(
+            build_pm_model=build_pm_model, **self.get_model_args())
+
+
+class InferenceResult():
+    """
+    Samples of one job gathered from its chains. Indexing by a variable name
+    gives the samples of every successful chain, as with a pymc3 trace
+
+    Attributes
+    ----------
+    job (InferenceJob): Job the samples are of
+    chain_samples (dict(int, dict(str, np.ndarray))): Maps a chain to the
+        samples of each variable
+    chain_diverging (dict(int, np.ndarray)): Maps a chain to whether each
+        sample diverged
+    chain_errors (dict(int, str)): Maps a failed chain to its error
+    """
+
+    def __init__(self, job: InferenceJob):
+        """
+        Args
+        ----
+        job (InferenceJob): Job the samples are of
+        """
+        self.job = job
+        self.chain_samples: Dict[int, Dict[str, np.ndarray]] = {}
+        self.chain_diverging: Dict[int, np.ndarray] = {}
+        self.chain_errors: Dict[int, str] = {}
+
+        self.__math_model = None
+
+    def __getitem__(self, varname: str) -> np.ndarray:
+        return self.get_samples(varname)
+
+    @property
+    def varnames(self) -> List[str]:
+        if not self.chain_samples:
+            return []
+
+        return list(next(iter(self.chain_samples.values())).keys())
+
+    @property
+    def succeeded(self) -> bool:
+        """ True if every chain was sampled """
+        return len(self.chain_errors) == 0 and len(self.chain_samples) > 0
+
+    @property
+    def math_model(self) -> UmisMathModel:
+        """ Math model of the job, without its pm model """
+        if self.__math_model is None:
+            self.__math_model = self.job.build_math_model(
+                build_pm_model=False)
+
+        return self.__math_model
+
+    def get_samples(self, varname: str) -> np.ndarray:
+        """
+        Gets the samples of a variable from every successful chain
+        """
+        if not self.chain_samples:
+            raise ValueError("No chain of the job was sampled")
+
+        return np.concatenate([
+            self.chain_samples[chain][varname]
+            for chain in sorted(self.chain_samples)])
+
+
+class InferenceRunner():
+    """
+    Builds and samples the math models of many jobs in a pool of processes,
+    one chain per task
+
+    Attributes
+    ----------
+    n_workers (int): Number of worker processes
+    draws (int): Number of samples drawn by each chain
+    tune (int): Number of tuning steps of each chain
+    chains (int): Number of chains of each job
+    random_seed (int): Seed of the first chain, None for random chains
+    max_retries (int): Number of times tasks lost to a crashed worker are
+        resubmitted to a new pool
+    cache_dir (str): Directory shared by the model caches of the workers, None
+        to only cache models in the memory of each worker
+    sample_kwargs (dict): Other keyword arguments of pm.sample
+    """
+
+    def __init__(
+            self,
+            n_workers: int = None,
+            draws: int = 1000,
+            tune: int = 1000,
+            chains: int = 2,
+            random_seed: int = None,
+            max_retries: int = 1,
+            cache_dir: str = None,
+            **sample_kwargs):
+        """
+        Args
+        ----
+        n_workers (int): Number of worker processes, defaults to the number of
+            cores
+        draws (int): Number of samples drawn by each chain
+        tune (int): Number of tuning steps of each chain
+        chains (int): Number of chains of each job
+        random_seed (int): Seed of the first chain, None for random chains
+        max_retries (int): Number of times tasks lost to a crashed worker are
+            resubmitted to a new pool
+        cache_dir (str): Directory shared by the model caches of the workers,
+            None to only cache models in the memory of each worker
+        sample_kwargs (dict): Other keyword arguments of pm.sample
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+
+        if n_workers < 1:
+            raise ValueError("Runner needs at least one worker, received {}"
+                             .format(n_workers))
+
+        if chains < 1:
+            raise ValueError("Jobs need at least one chain, received {}"
+                             .format(chains))
+
+        self.n_workers = n_workers
+        self.draws = draws
+        self.tune = tune
+        self.chains = chains
+        self.random_seed = random_seed
+        self.max_retries = max_retries
+        self.cache_dir = cache_dir
+        self.sample_kwargs = sample_kwargs
+
+    def run(
+            self,
+            jobs: List[Union[InferenceJob, UmisDiagram, Tuple]],
+            reference_material: Material = None,
+            reference_time: Timeframe = None) -> List[InferenceResult]:
+        """
+        Samples every chain of every job. A failing chain is recorded on its
+        result, it does not stop the other chains
+
+        Args
+        ----
+        jobs (list): Each job is an InferenceJob, a (UmisDiagram, Material,
+            Timeframe) tuple or a UmisDiagram
+        reference_material (Material): Material of the jobs given as a
+            UmisDiagram
+        reference_time (Timeframe): Timeframe of the jobs given as a
+            UmisDiagram
+
+        Returns
+        -------
+        list(InferenceResult): Result of each job, in the order of jobs
+        """
+        jobs = [
+            self.__make_job(job, reference_material, reference_time)
+            for job in jobs]
+
+        results = [InferenceResult(job) for job in jobs]
+
+        pending_tasks = [
+            (job_ind, chain)
+            for job_ind in range(len(jobs))
+            for chain in range(self.chains)]
+
+        attempt = 0
+        while pending_tasks and attempt <= self.max_retries:
+            pending_tasks = self.__run_tasks(jobs, results, pending_tasks)
+            attempt += 1
+
+        for job_ind, chain in pending_tasks:
+            results[job_ind].chain_errors[chain] = \
+                "Worker process terminated while sampling the chain"
+
+        return results
+
+    def __run_tasks(
+            self,
+            jobs: List[InferenceJob],
+            results: List[InferenceResult],
+            tasks: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Runs tasks in a new pool, storing their samples or errors in results
+
+        Returns
+        -------
+        list(tuple(int, int)): Tasks lost because the pool broke
+        """
+        n_workers = min(self.n_workers, len(tasks))
+
+        core_queue = Queue()
+        for core in self.__get_cores(n_workers):
+            core_queue.put(core)
+
+        lost_tasks = []
+        with ProcessPoolExecutor(
+                max_workers=n_workers,
+                initializer=_init_worker,
+                initargs=(core_queue, self.cache_dir)) as executor:
+
+            future_tasks = {}
+            for job_ind, chain in tasks:
+                future = executor.submit(
+                    _sample_chain,
+                    jobs[job_ind],
+                    chain,
+                    self.draws,
+                    self.tune,
+                    self.__get_seed(job_ind, chain),
+                    self.sample_kwargs)
+
+                future_tasks[future] = (job_ind, chain)
+
+            for future in as_completed(future_tasks):
+                job_ind, chain = future_tasks[future]
+                result = results[job_ind]
+
+                try:
+                    samples, diverging = future.result()
+                except BrokenProcessPool:
+                    lost_tasks.append((job_ind, chain))
+                    continue
+                except Exception:
+                    result.chain_errors[chain] = traceback.format_exc()
+                    continue
+
+                result.chain_samples[chain] = samples
+                result.chain_diverging[chain] = diverging
+
+        return lost_tasks
+
+    def __get_seed(self, job_ind: int, chain: int) -> int:
+        if self.random_seed is None:
+            return None
+
+        return self.random_seed + job_ind * self.chains + chain
+
+    @staticmethod
+    def __get_cores(n_workers: int) -> List[int]:
+        """ Cores the workers are pinned to, None where pinning is missing """
+        if not hasattr(os, 'sched_getaffinity'):
+            return [None] * n_workers
+
+        cores = sorted(os.sched_getaffinity(0))
+        return [cores[i % len(cores)] for i in range(n_workers)]
+
+    @staticmethod
+    def __make_job(
+            job: Union[InferenceJob, UmisDiagram, Tuple],
+            reference_material: Material,
+            reference_time: Timeframe) -> InferenceJob:
+
+        if isinstance(job, InferenceJob):
+            return job
+
+        if isinstance(job, UmisDiagram):
+            if reference_material is None or reference_time is None:
+                raise ValueError("Jobs given as a diagram need a reference "
+                                 + "material and time")
+
+            return InferenceJob(job, reference_material, reference_time)
+
+        if isinstance(job, tuple):
+            return InferenceJob(*job)
+
+        raise TypeError("Job must be an InferenceJob, UmisDiagram or tuple, "
+                        + "received {}".format(type(job)))
+
+
+def _init_worker(core_queue: Queue, cache_dir: str):
+    """
+    Pins the worker to a core and creates its model cache
+    """
+    global _worker_model_cache
+
+    core = core_queue.get()
+    if core is not None:
+        os.sched_setaffinity(0, {core})
+
+    _worker_model_cache = UmisModelCache(cache_dir=cache_dir)
+
+
+def _sample_chain(
+        job: InferenceJob,
+        chain: int,
+        draws: int,
+        tune: int,
+        random_seed: int,
+        sample_kwargs: dict) \
+            -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Samples one chain of a job in a worker
+
+    Returns
+    -------
+    samples, diverging (tuple(dict(str, np.ndarray), np.ndarray)): Samples of
+        each variable, whether each sample diverged
+    """
+    math_model = _worker_model_cache.get_model(**job.get_model_args())
+
+    with math_model.pm_model:
+        trace = pm.sample(
+            draws,
+            tune=tune,
+            step=math_model.get_nuts_step(),
+            chains=1,
+            cores=1,
+            chain_idx=chain,
+            random_seed=random_seed,
+            progressbar=False,
+            compute_convergence_checks=False,
+            **sample_kwargs)
+
+    samples = {
+        varname: trace.get_values(varname)
+        for varname in trace.varnames}
+
+    diverging = trace.get_sampler_stats('diverging')
+
+    return samples, diverging
+
+
+if __name__ == '__main__':
+    sys.exit(1)
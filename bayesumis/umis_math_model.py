@@ -9,13 +9,14 @@ doi:10.1111/jiec.12698
 https://github.com/ricklupton/bayesian-mfa-paper
 """
 
+import hashlib
 import sys
-from typing import Dict, List, Set, Tuple
+from typing import Dict, Iterator, List, Set, Tuple
 
 import numpy as np
 import pymc3 as pm
+import theano
 import theano.tensor as T
-from theano.tensor.nlinalg import matrix_inverse
 
 from bayesumis.umis_data_models import (
     Constant,
@@ -29,6 +30,59 @@ from bayesumis.umis_data_models import (
     UmisProcess,
     Uncertainty,
     UniformUncertainty)
+from bayesumis.umis_math_model_helper import (
+    MATRIX_ASSEMBLIES,
+    SCATTER_ASSEMBLY,
+    assemble_matrix,
+    gather_matrix_entries,
+    sorted_process_stafs,
+    sorted_stafs)
+from bayesumis.umis_fit import (
+    ADVI_METHOD,
+    GAUSSIAN_METHOD,
+    NUTS_METHOD,
+    UmisFitResult,
+    fit_gaussian,
+    fit_model)
+from bayesumis.umis_throughput_solvers import (
+    FUSED_SOLVER,
+    SPARSE_SOLVER,
+    THROUGHPUT_SOLVERS,
+    solve_process_throughputs,
+    solve_reconciled_stafs)
+
+MODEL_FORMAT_VERSION = 1
+""" Version of the pm model built from a structure, part of the structure
+fingerprint. Bumped whenever the model built for a structure changes, so
+models pickled by older code are not reused """
+
+NO_TC_POOLING = 'none'
+SHARED_TC_POOLING = 'shared'
+HIERARCHICAL_TC_POOLING = 'hierarchical'
+
+TC_POOLINGS = (NO_TC_POOLING, SHARED_TC_POOLING, HIERARCHICAL_TC_POOLING)
+
+CENTERED_PARAMETERISATION = 'centered'
+NON_CENTERED_PARAMETERISATION = 'non_centered'
+LOG_PARAMETERISATION = 'log'
+
+PARAMETERISATIONS = (
+    CENTERED_PARAMETERISATION,
+    NON_CENTERED_PARAMETERISATION,
+    LOG_PARAMETERISATION)
+
+CLAMP_TC_TRANSFORM = 'clamp'
+LOGIT_TC_TRANSFORM = 'logit'
+
+TC_TRANSFORMS = (CLAMP_TC_TRANSFORM, LOGIT_TC_TRANSFORM)
+
+HIERARCHICAL_TC_CONCENTRATION = (2.0, 0.02)
+""" Shape and rate of the Gamma prior on the concentration of the
+scenario transfer coefficients of a process around their pooled values """
+
+MIN_DIRICHLET_TC = 1e-6
+""" Floor of the transfer coefficients passed to a Dirichlet, clamped
+transformation coefficients can be exactly 0 or 1 """
 
 
 class UmisMathModel():
@@ -39,7 +93,15 @@ class UmisMathModel():
     Attributes
     ----------
     pm_model (pm.Model): Model holding random variables to run MCMC sampling
-        over
+        over, None until create_pm_model is called if the model was not built
+        on construction
+
+    Observation values are held in Theano shared variables, so models with
+    the same structure fingerprint can share one compiled model
+
+    With n_scenarios set every random variable and matrix has a leading
+    scenario axis, each scenario has its own observations and is reconciled
+    independently within the one model
     """
     INPUT_VAR_NAME = 'Inputs'
     INPUT_CC_VAR_NAME = 'Input CCs'
@@ -55,7 +117,15 @@ class UmisMathModel():
             reference_material: Material,
             reference_time: Timeframe,
             material_reconc_table: Dict[Material, Uncertainty] = {},
-            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {}):
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            solver: str = SPARSE_SOLVER,
+            matrix_assembly: str = SCATTER_ASSEMBLY,
+            build_pm_model: bool = True,
+            n_scenarios: int = None,
+            tc_pooling: str = NO_TC_POOLING,
+            tc_groups: Dict[str, str] = {},
+            parameterisation: str = CENTERED_PARAMETERISATION,
+            tc_transform: str = CLAMP_TC_TRANSFORM):
         """
         Args
         ----
@@ -82,10 +152,96 @@ class UmisMathModel():
         tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
             origin process id to a dictionary mapping the destination process
             id to its transfer coefficient
-        """
+
+        solver (str): Solver for the process throughputs, either 'sparse',
+            'fused' to compute the stafs and their gradient in one op from
+            the sparse factorisation, or the 'dense' matrix inverse reference
+            implementation
+
+        matrix_assembly (str): How the parameter matrices are built, either
+            'scatter' or the 'chained' reference implementation with one
+            set_subtensor per process or observation, as originally built
+
+        build_pm_model (bool): If False only the process structure and priors
+            are created, pm_model is built by create_pm_model
+
+        n_scenarios (int): Number of observation sets sampled together, every
+            scenario starts with the observations of the diagram and is
+            changed with update_observations. None for a single unbatched
+            model
+
+        tc_pooling (str): How the transfer coefficients of the scenarios are
+            related, 'none' for independent coefficients in every scenario,
+            'shared' for one set of coefficients used by every scenario, or
+            'hierarchical' for scenario coefficients drawn around pooled
+            coefficients. Pooled coefficients have no scenario axis in their
+            observations
+
+        tc_groups (dict(str, str)): Maps a process id to its group. The
+            transfer coefficients of processes of one group with outflows to
+            the same groups keep their own priors and are drawn towards
+            pooled coefficients of the group. Processes not in a group are
+            their own group
+
+        parameterisation (str): How normal and lognormal priors are sampled,
+            'centered' on their raw scale, 'non_centered' as a shift and
+            scale of a standard normal, or 'log' in log space, which also
+            truncates normal priors to positive values and renormalises
+            them
+
+        tc_transform (str): How the known transfer coefficient of a
+            transformation process is kept in [0, 1], 'clamp' cuts it to the
+            interval, 'logit' samples it in log odds space so its gradient
+            does not vanish at the bounds. The coefficients of distribution
+            processes are always stick breaking transformed
+        """
+        if solver not in THROUGHPUT_SOLVERS:
+            raise ValueError("Throughput solver must be one of {}, received {}"
+                             .format(THROUGHPUT_SOLVERS, solver))
+
+        if matrix_assembly not in MATRIX_ASSEMBLIES:
+            raise ValueError("Matrix assembly must be one of {}, received {}"
+                             .format(MATRIX_ASSEMBLIES, matrix_assembly))
+
+        if n_scenarios is not None:
+            if not isinstance(n_scenarios, int) or n_scenarios < 1:
+                raise ValueError("Number of scenarios must be a positive "
+                                 + "integer, received {}".format(n_scenarios))
+
+            if matrix_assembly != SCATTER_ASSEMBLY:
+                raise ValueError("Only the {} matrix assembly supports "
+                                 .format(SCATTER_ASSEMBLY)
+                                 + "scenarios, received {}"
+                                 .format(matrix_assembly))
+
+        if tc_pooling not in TC_POOLINGS:
+            raise ValueError("TC pooling must be one of {}, received {}"
+                             .format(TC_POOLINGS, tc_pooling))
+
+        if parameterisation not in PARAMETERISATIONS:
+            raise ValueError("Parameterisation must be one of {}, received {}"
+                             .format(PARAMETERISATIONS, parameterisation))
+
+        if tc_transform not in TC_TRANSFORMS:
+            raise ValueError("TC transform must be one of {}, received {}"
+                             .format(TC_TRANSFORMS, tc_transform))
+
+        if tc_pooling != NO_TC_POOLING and n_scenarios is None:
+            raise ValueError("Transfer coefficients can only be pooled "
+                             + "across scenarios, n_scenarios is not set")
 
         self.reference_material = reference_material
         self.reference_time = reference_time
+        self.solver = solver
+        self.matrix_assembly = matrix_assembly
+        self.n_scenarios = n_scenarios
+        self.tc_pooling = tc_pooling
+        self.tc_groups = tc_groups
+        self.parameterisation = parameterisation
+        self.tc_transform = tc_transform
+
+        # Shape of the leading scenario axis of every variable
+        self.__batch_shape = () if n_scenarios is None else (n_scenarios,)
 
         self.__material_reconc_table = material_reconc_table
         self.__tc_observation_table = tc_observation_table
@@ -93,9 +249,16 @@ class UmisMathModel():
         self.__index_counter = 0
 
         self.__id_math_process_dict: Dict[str, MathProcess] = {}
+        """ Maps a math process id to its math process """
         self.__input_priors = InputPriors()
         self.__dep_staf_priors = DepStafPriors()
-        """ Maps a math process id to its math process """
+
+        self.__staf_obs_shared_params: Dict[str, List[T.Variable]] = {}
+        """ Maps a staf observation family to its shared parameters """
+        self.__pooled_varnames: Set[str] = set()
+        """ Names of the pooled variables, which have no scenario axis """
+        self.__nuts_step = None
+        self.pm_model = None
 
         self.__create_math_processes(
             process_stafs_dict,
@@ -107,11 +270,31 @@ class UmisMathModel():
             process_stafs_dict,
             external_outflows)
 
+        if n_scenarios is not None:
+            for prior in self.__iter_param_priors():
+                if self.__is_pooled_tc(prior):
+                    continue
+
+                prior.scenario_uncertainties = \
+                    [prior.uncertainty] * n_scenarios
+
+        if build_pm_model:
+            self.create_pm_model()
+
+    def create_pm_model(self):
+        """
+        Builds pm_model from the process structure and priors of the model
+        """
+        if self.pm_model is not None:
+            raise ValueError("The pm model of this math model has already "
+                             + "been created")
+
         # Ricks Model
         with pm.Model() as self.pm_model:
             num_processes = len(self.__id_math_process_dict.keys())
 
-            tc_matrix = self.__create_transfer_coefficient_matrix()
+            tc_matrix, tc_values = \
+                self.__create_transfer_coefficient_matrix()
             tc_matrix = pm.Deterministic(self.TC_VAR_NAME, tc_matrix)
 
             input_matrix, input_cc_matrix = \
@@ -124,74 +307,383 @@ class UmisMathModel():
             reconciled_input_matrix = \
                 input_matrix * input_cc_matrix
 
-            input_sums = T.sum(reconciled_input_matrix, axis=1)
-
-            process_throughputs = T.dot(
-                matrix_inverse(T.eye(num_processes) - tc_matrix.T),
-                input_sums[:, None])
-
-            stafs = tc_matrix * process_throughputs[:, None]
+            input_sums = T.sum(reconciled_input_matrix, axis=-1)
 
             staf_ccs = self.__create_staf_ccs_matrix()
 
             staf_ccs = pm.Deterministic(self.STAF_CC_VAR_NAME, staf_ccs)
 
+            if self.solver == FUSED_SOLVER:
+                reconciled_stafs = solve_reconciled_stafs(
+                    num_processes,
+                    tc_values,
+                    input_sums,
+                    staf_ccs,
+                    self.__tc_origin_inds,
+                    self.__tc_dest_inds)
+            else:
+                process_throughputs = solve_process_throughputs(
+                    self.solver,
+                    num_processes,
+                    tc_matrix,
+                    tc_values,
+                    input_sums,
+                    self.__tc_origin_inds,
+                    self.__tc_dest_inds)
+
+                stafs = tc_matrix * T.shape_padright(process_throughputs)
+                reconciled_stafs = stafs / staf_ccs
+
             reconciled_stafs = pm.Deterministic(
-                self.STAF_VAR_NAME, stafs / staf_ccs)
+                self.STAF_VAR_NAME, reconciled_stafs)
 
-            (normal_staf_obs_matrix,
+            (normal_staf_origin_inds,
+             normal_staf_dest_inds,
              normal_staf_means,
              normal_staf_sds) = \
-                self.__create_staf_obs_matrices_normal(
+                self.__create_staf_obs_vectors_normal(
                     self.__dep_staf_priors.normal_dep_staf_priors)
 
-            (lognormal_staf_obs_matrix,
+            (lognormal_staf_origin_inds,
+             lognormal_staf_dest_inds,
              lognormal_staf_means,
              lognormal_staf_sds) = \
-                self.__create_staf_obs_matrices_normal(
+                self.__create_staf_obs_vectors_normal(
                     self.__dep_staf_priors.lognormal_dep_staf_priors)
 
-            (uniform_staf_obs_matrix,
+            (uniform_staf_origin_inds,
+             uniform_staf_dest_inds,
              uniform_staf_lower,
              uniform_staf_upper) = \
-                self.__create_staf_obs_matrices_uniform(
+                self.__create_staf_obs_vectors_uniform(
                     self.__dep_staf_priors.uniform_dep_staf_priors)
 
-            if len(normal_staf_means > 0):
+            if len(normal_staf_origin_inds) > 0:
+                normal_staf_means, normal_staf_sds = \
+                    self.__share_staf_obs_params(
+                        'normal', normal_staf_means, normal_staf_sds)
+
                 normal_dep_staf_eqs = pm.Deterministic(
                     'normal_dep_staf_eqs',
-                    T.tensordot(
-                        normal_staf_obs_matrix, reconciled_stafs))
+                    gather_matrix_entries(
+                        reconciled_stafs,
+                        normal_staf_origin_inds,
+                        normal_staf_dest_inds))
 
                 pm.Normal(
                     'normal_dep_staf_priors',
-                    mu=normal_staf_means[:, None],
-                    sd=normal_staf_sds[:, None],
-                    observed=normal_dep_staf_eqs[:, None])
+                    mu=normal_staf_means,
+                    sd=normal_staf_sds,
+                    observed=normal_dep_staf_eqs)
+
+            if len(lognormal_staf_origin_inds) > 0:
+                lognormal_staf_means, lognormal_staf_sds = \
+                    self.__share_staf_obs_params(
+                        'lognormal', lognormal_staf_means, lognormal_staf_sds)
 
-            if len(lognormal_staf_means > 0):
                 lognormal_dep_staf_eqs = pm.Deterministic(
                     'lognormal_dep_staf_eqs',
-                    T.tensordot(
-                        lognormal_staf_obs_matrix, reconciled_stafs))
+                    gather_matrix_entries(
+                        reconciled_stafs,
+                        lognormal_staf_origin_inds,
+                        lognormal_staf_dest_inds))
 
                 pm.Lognormal(
                     'lognormal_dep_staf_priors',
-                    mu=lognormal_staf_means[:, None],
-                    sd=lognormal_staf_sds[:, None],
-                    observed=lognormal_dep_staf_eqs[:, None])
+                    mu=lognormal_staf_means,
+                    sd=lognormal_staf_sds,
+                    observed=lognormal_dep_staf_eqs)
+
+            if len(uniform_staf_origin_inds) > 0:
+                uniform_staf_lower, uniform_staf_upper = \
+                    self.__share_staf_obs_params(
+                        'uniform', uniform_staf_lower, uniform_staf_upper)
 
-            if len(uniform_staf_lower > 0):
                 uniform_dep_staf_eqs = pm.Deterministic(
                     'uniform_dep_staf_eqs',
-                    T.tensordot(
-                        uniform_staf_obs_matrix, reconciled_stafs))
+                    gather_matrix_entries(
+                        reconciled_stafs,
+                        uniform_staf_origin_inds,
+                        uniform_staf_dest_inds))
 
                 pm.Uniform(
                     'uniform_dep_staf_priors',
-                    lower=uniform_staf_lower[:, None],
-                    upper=uniform_staf_upper[:, None],
-                    observed=uniform_dep_staf_eqs[:, None])
+                    lower=uniform_staf_lower,
+                    upper=uniform_staf_upper,
+                    observed=uniform_dep_staf_eqs)
+
+    def copy_observations(self, math_model: 'UmisMathModel'):
+        """
+        Copies the observation values of a model with the same structure into
+        the shared variables of this model, without rebuilding or
+        recompiling it
+
+        Args
+        ----
+        math_model (UmisMathModel): Model with the same structure
+            fingerprint as this model
+        """
+        if (math_model.get_structure_fingerprint()
+                != self.get_structure_fingerprint()):
+            raise ValueError("Cannot copy observations from a model with a "
+                             + "different structure")
+
+        name_prior_dict = {
+            prior.param_name: prior for prior in self.__iter_param_priors()}
+
+        for prior in math_model.__iter_param_priors():
+            name_prior = name_prior_dict[prior.param_name]
+            name_prior.set_uncertainty(prior.uncertainty)
+
+            if prior.scenario_uncertainties is not None:
+                for scenario, uncertainty in \
+                        enumerate(prior.scenario_uncertainties):
+                    name_prior.set_uncertainty(uncertainty, scenario)
+
+        self.reference_material = math_model.reference_material
+        self.reference_time = math_model.reference_time
+
+        self.__update_shared_params()
+
+    def update_observations(
+            self,
+            staf_observations: Dict[str, Dict[str, Uncertainty]] = {},
+            cc_observations: Dict[str, Dict[str, Uncertainty]] = {},
+            tc_observations: Dict[str, Dict[str, Uncertainty]] = {},
+            scenario: int = None):
+        """
+        Replaces observations of the model in place. The values are written
+        to the shared variables of pm_model, so the model can be sampled
+        again without being rebuilt or recompiled
+
+        Every table maps an origin process id to a dict mapping a destination
+        process id to the new uncertainty, as in tc_observation_table. An
+        observation must already exist in the model and keep its
+        distribution family, otherwise the structure of the model would
+        change
+
+        Args
+        ----
+        staf_observations (dict(str, dict(str, Uncertainty))): Observations
+            of stock and flow values
+        cc_observations (dict(str, dict(str, Uncertainty))): Observations of
+            concentration coefficients
+        tc_observations (dict(str, dict(str, Uncertainty))): Observations of
+            transfer coefficients
+        scenario (int): Scenario the observations are of, None to set them in
+            every scenario
+        """
+        if scenario is not None and (
+                self.n_scenarios is None
+                or not 0 <= scenario < self.n_scenarios):
+            raise ValueError("Model has no scenario {}".format(scenario))
+
+        observable_priors = self.__get_observable_priors()
+
+        updates = []
+        for param_type, observations in [
+                ('staf', staf_observations),
+                ('cc', cc_observations),
+                ('tc', tc_observations)]:
+
+            for origin_id, dest_observations in observations.items():
+                for dest_id, uncertainty in dest_observations.items():
+                    prior = observable_priors[param_type].get(
+                        (origin_id, dest_id))
+
+                    if prior is None:
+                        raise ValueError(
+                            "Model has no {} observation from {} to {}"
+                            .format(param_type, origin_id, dest_id))
+
+                    if scenario is not None and self.__is_pooled_tc(prior):
+                        raise ValueError(
+                            "Observation of {} is pooled across scenarios"
+                            .format(prior.param_name))
+
+                    if type(uncertainty) is not type(prior.uncertainty):
+                        raise ValueError(
+                            "Observation of {} must be {}, received {}"
+                            .format(
+                                prior.param_name,
+                                type(prior.uncertainty).__name__,
+                                type(uncertainty).__name__))
+
+                    updates.append((prior, uncertainty))
+
+        # Only applied once every observation is valid
+        for prior, uncertainty in updates:
+            prior.set_uncertainty(uncertainty, scenario)
+
+        self.__update_shared_params()
+
+    def get_observations(self, scenario: int = None) \
+            -> Dict[str, Dict[str, Dict[str, Uncertainty]]]:
+        """
+        Gets the current observations of the model in the format taken by
+        update_observations
+
+        Args
+        ----
+        scenario (int): Scenario to get the observations of, None for the
+            observations of the diagram
+
+        Returns
+        -------
+        dict(str, dict(str, dict(str, Uncertainty))): Maps 'staf', 'cc' and
+            'tc' to a table of the observations of that parameter type
+        """
+        observations = {}
+        for param_type, priors in self.__get_observable_priors().items():
+            table = {}
+            for (origin_id, dest_id), prior in priors.items():
+                if scenario is None or self.__is_pooled_tc(prior):
+                    uncertainty = prior.uncertainty
+                else:
+                    uncertainty = prior.scenario_uncertainties[scenario]
+
+                if uncertainty is not None:
+                    table.setdefault(origin_id, {})[dest_id] = uncertainty
+
+            observations[param_type] = table
+
+        return observations
+
+    def get_nuts_step(self):
+        """
+        Gets a NUTS step method over pm_model. The log probability and its
+        gradient are compiled on the first call, later calls reset the tuning
+        of the same step method so it can be passed to pm.sample again
+        """
+        if self.pm_model is None:
+            raise ValueError("The pm model of this math model has not been "
+                             + "created")
+
+        if self.__nuts_step is None:
+            with self.pm_model:
+                self.__nuts_step = pm.NUTS()
+        else:
+            self.__nuts_step.reset_tuning()
+
+        return self.__nuts_step
+
+    def fit(
+            self,
+            method: str = ADVI_METHOD,
+            draws: int = 1000,
+            warm_start: bool = False,
+            fallback: bool = False,
+            **fit_kwargs) -> UmisFitResult:
+        """
+        Fits the posterior of the model
+
+        Args
+        ----
+        method (str): 'advi' or 'fullrank_advi' for a fast variational
+            approximation, 'nuts' for MCMC sampling, 'gaussian' for the
+            closed form reconciliation of models with only normal
+            observations and known coefficients
+        draws (int): Number of posterior samples, per chain for NUTS
+        warm_start (bool): For NUTS, starts the chains from an ADVI fit
+        fallback (bool): For variational methods, samples with NUTS warm
+            started from the approximation if it has not converged. For
+            'gaussian', samples with NUTS if the model does not qualify
+        fit_kwargs (dict): Other keyword arguments of umis_fit.fit_model
+
+        Returns
+        -------
+        UmisFitResult: Samples of every variable, in the layout of a trace
+            from pm.sample, and convergence diagnostics
+        """
+        if method == GAUSSIAN_METHOD:
+            # Imported here as the engine is built on the classes of this
+            # module
+            from bayesumis.umis_gaussian_reconciliation import (
+                GaussianReconciliationEngine)
+
+            gaussian_engine = GaussianReconciliationEngine(self)
+            if gaussian_engine.qualifies():
+                return fit_gaussian(
+                    gaussian_engine, draws, fit_kwargs.get('random_seed'))
+
+            if not fallback:
+                raise ValueError(
+                    "Model cannot be reconciled in closed form:\n{}".format(
+                        "\n".join(gaussian_engine.get_disqualifications())))
+
+            method = NUTS_METHOD
+            warm_start = True
+
+        if self.pm_model is None:
+            self.create_pm_model()
+
+        return fit_model(
+            self.pm_model,
+            method=method,
+            draws=draws,
+            warm_start=warm_start,
+            fallback=fallback,
+            **fit_kwargs)
+
+    def get_structure_fingerprint(self) -> str:
+        """
+        Hash of everything the compiled model depends on other than the
+        observation values: the model format version, the process indices
+        and types, the transfer coefficient structure, the distribution
+        family of every prior and the model options
+        """
+        processes = []
+        for process_id, math_process in \
+                sorted(self.__id_math_process_dict.items()):
+
+            outflow_tcs = [
+                (tc.dest_id, type(tc.uncertainty).__name__)
+                for tc in math_process.process_outflow_tcs]
+
+            processes.append((
+                process_id,
+                math_process.process_ind,
+                type(math_process).__name__,
+                outflow_tcs))
+
+        # Kept in model order as the observation vectors are indexed by it
+        priors = [
+            (prior.param_name, type(prior.uncertainty).__name__)
+            for prior in self.__iter_param_priors()]
+
+        options = (
+            self.solver,
+            self.matrix_assembly,
+            self.n_scenarios,
+            self.tc_pooling,
+            sorted(self.tc_groups.items()),
+            self.parameterisation,
+            self.tc_transform)
+
+        structure = repr(
+            (MODEL_FORMAT_VERSION, processes, priors, options))
+        return hashlib.sha256(structure.encode('utf-8')).hexdigest()
+
+    def get_scenario_samples(self, trace, scenario: int) \
+            -> Dict[str, np.ndarray]:
+        """
+        Gets the samples of every variable for one scenario, in the layout of
+        an unbatched trace so they can be indexed by get_staf_inds and
+        get_input_inds
+
+        Args
+        ----
+        trace (pm.backends.base.MultiTrace): Trace sampled from pm_model
+        scenario (int): Index of the scenario
+        """
+        if self.n_scenarios is None:
+            raise ValueError("Model was not built with scenarios")
+
+        return {
+            varname: (
+                trace[varname] if varname in self.__pooled_varnames
+                else trace[varname][:, scenario])
+            for varname in trace.varnames}
 
     def get_input_inds(self, staf: Staf):
         """ Gets the process index of the destination of the staf """
@@ -211,6 +703,27 @@ class UmisMathModel():
 
         return row_ind, col_ind
 
+    def get_math_processes(self) -> List['MathProcess']:
+        """ Gets the math processes, in the order of their indices """
+        return [
+            self.__id_math_process_dict[process_id]
+            for process_id in self.get_process_ids()]
+
+    def get_input_priors(self) -> 'InputPriors':
+        """ Gets the priors of the external and stock inputs """
+        return self.__input_priors
+
+    def get_dep_staf_priors(self) -> 'DepStafPriors':
+        """ Gets the observations of the dependent stocks and flows """
+        return self.__dep_staf_priors
+
+    def get_process_ids(self) -> List[str]:
+        """ Gets the id of each process, in the order of their indices """
+        return sorted(
+            self.__id_math_process_dict,
+            key=lambda process_id:
+                self.__id_math_process_dict[process_id].process_ind)
+
     def get_process_ind(self, process_id: str):
         """ Gets the process index from process id """
         math_process = self.__id_math_process_dict.get(process_id)
@@ -243,6 +756,101 @@ class UmisMathModel():
         dest_index = dest_math_process.process_ind
         return origin_index, dest_index
 
+    def __iter_param_priors(self) -> Iterator['ParamPrior']:
+        """ Iterates over every parameter prior in the model """
+        for math_process in self.__id_math_process_dict.values():
+            for tc_prior in math_process.process_outflow_tcs:
+                yield tc_prior
+
+        input_priors = (
+            list(self.__input_priors.external_inputs_dict.values())
+            + list(self.__input_priors.stock_inputs_dict.values()))
+
+        dep_staf_priors = (
+            self.__dep_staf_priors.normal_dep_staf_priors
+            + self.__dep_staf_priors.lognormal_dep_staf_priors
+            + self.__dep_staf_priors.uniform_dep_staf_priors)
+
+        for prior in input_priors + dep_staf_priors:
+            yield prior.staf_prior
+            yield prior.cc_prior
+
+    def __get_observable_priors(self) \
+            -> Dict[str, Dict[Tuple[str, str], 'ParamPrior']]:
+        """
+        Maps 'staf', 'cc' and 'tc' to the priors of that parameter type keyed
+        by their origin and destination process ids
+        """
+        observable_priors = {'staf': {}, 'cc': {}, 'tc': {}}
+
+        for math_process in self.__id_math_process_dict.values():
+            for tc_prior in math_process.process_outflow_tcs:
+                observable_priors['tc'][
+                    (tc_prior.origin_id, tc_prior.dest_id)] = tc_prior
+
+        input_priors = (
+            list(self.__input_priors.external_inputs_dict.values())
+            + list(self.__input_priors.stock_inputs_dict.values()))
+
+        dep_staf_priors = (
+            self.__dep_staf_priors.normal_dep_staf_priors
+            + self.__dep_staf_priors.lognormal_dep_staf_priors
+            + self.__dep_staf_priors.uniform_dep_staf_priors)
+
+        for prior in input_priors + dep_staf_priors:
+            staf_prior = prior.staf_prior
+            observable_priors['staf'][
+                (staf_prior.origin_id, staf_prior.dest_id)] = staf_prior
+
+            cc_prior = prior.cc_prior
+            observable_priors['cc'][
+                (cc_prior.origin_id, cc_prior.dest_id)] = cc_prior
+
+        return observable_priors
+
+    def __share_staf_obs_params(self, family: str, *param_vectors):
+        """
+        Creates shared variables for the parameters of a family of staf
+        observations
+
+        Args
+        ----
+        family (str): 'normal', 'lognormal' or 'uniform'
+        param_vectors (np.array): Vector of each observation parameter
+        """
+        shared_params = [
+            theano.shared(param_vector, name="{} staf obs {}".format(family, i))
+            for i, param_vector in enumerate(param_vectors)]
+
+        self.__staf_obs_shared_params[family] = shared_params
+        return shared_params
+
+    def __update_shared_params(self):
+        """
+        Sets the shared variables of the model to the current uncertainties
+        of its priors
+        """
+        for prior in self.__iter_param_priors():
+            prior.update_shared_params()
+
+        for math_process in self.__id_math_process_dict.values():
+            math_process.update_shared_params()
+
+        staf_obs_vectors = {
+            'normal': self.__create_staf_obs_vectors_normal(
+                self.__dep_staf_priors.normal_dep_staf_priors),
+            'lognormal': self.__create_staf_obs_vectors_normal(
+                self.__dep_staf_priors.lognormal_dep_staf_priors),
+            'uniform': self.__create_staf_obs_vectors_uniform(
+                self.__dep_staf_priors.uniform_dep_staf_priors)}
+
+        for family, shared_params in self.__staf_obs_shared_params.items():
+            # The first two vectors are the origin and destination indices
+            param_vectors = staf_obs_vectors[family][2:]
+
+            for shared_param, param_vector in zip(shared_params, param_vectors):
+                shared_param.set_value(param_vector)
+
     def __add_external_input_prior(
             self,
             origin_id: str,
@@ -319,8 +927,13 @@ class UmisMathModel():
         """
         num_processes = len(self.__id_math_process_dict.keys())
 
-        inputs_matrix = T.zeros((num_processes, 2))
-        cc_matrix = T.ones((num_processes, 2))
+        inputs_matrix = T.zeros(self.__batch_shape + (num_processes, 2))
+        cc_matrix = T.ones(self.__batch_shape + (num_processes, 2))
+
+        row_inds = []
+        col_inds = []
+        input_rvs = []
+        input_cc_rvs = []
 
         for process_id, external_input in \
                 self.__input_priors.external_inputs_dict.items():
@@ -328,15 +941,17 @@ class UmisMathModel():
             process_index = self.__id_math_process_dict[process_id].process_ind
 
             external_input_prior = external_input.staf_prior
-            external_input_rv = external_input_prior.create_param_rv()
-            inputs_matrix = T.set_subtensor(
-                inputs_matrix[[process_index], [0]], [external_input_rv])
+            external_input_rv = external_input_prior.create_param_rv(
+                self.parameterisation)
 
             external_input_cc_prior = external_input.cc_prior
-            external_input_cc_rv = external_input_cc_prior.create_param_rv()
-            cc_matrix = T.set_subtensor(
-                cc_matrix[[process_index], [0]],
-                [external_input_cc_rv])
+            external_input_cc_rv = external_input_cc_prior.create_param_rv(
+                self.parameterisation)
+
+            row_inds.append(np.array([process_index], dtype=np.int64))
+            col_inds.append(np.array([0], dtype=np.int64))
+            input_rvs.append(T.shape_padright(external_input_rv))
+            input_cc_rvs.append(T.shape_padright(external_input_cc_rv))
 
         for process_id, stock_input in \
                 self.__input_priors.stock_inputs_dict.items():
@@ -346,14 +961,31 @@ class UmisMathModel():
             print("Adding stock input to process {}".format(process_id))
 
             stock_input_prior = stock_input.staf_prior
-            stock_input_rv = stock_input_prior.create_param_rv()
-            inputs_matrix = T.set_subtensor(
-                inputs_matrix[[process_index], [1]], [stock_input_rv])
+            stock_input_rv = stock_input_prior.create_param_rv(
+                self.parameterisation)
 
             stock_input_cc_prior = stock_input.cc_prior
-            stock_input_cc_rv = stock_input_cc_prior.create_param_rv()
-            cc_matrix = T.set_subtensor(
-                cc_matrix[[process_index], [1]], [stock_input_cc_rv])
+            stock_input_cc_rv = stock_input_cc_prior.create_param_rv(
+                self.parameterisation)
+
+            row_inds.append(np.array([process_index], dtype=np.int64))
+            col_inds.append(np.array([1], dtype=np.int64))
+            input_rvs.append(T.shape_padright(stock_input_rv))
+            input_cc_rvs.append(T.shape_padright(stock_input_cc_rv))
+
+        inputs_matrix = assemble_matrix(
+            self.matrix_assembly,
+            inputs_matrix,
+            row_inds,
+            col_inds,
+            input_rvs)
+
+        cc_matrix = assemble_matrix(
+            self.matrix_assembly,
+            cc_matrix,
+            row_inds,
+            col_inds,
+            input_cc_rvs)
 
         return inputs_matrix, cc_matrix
 
@@ -367,7 +999,7 @@ class UmisMathModel():
             outside the model
 
         """
-        for flow in external_inflows:
+        for flow in sorted_stafs(external_inflows):
 
             if flow.staf_reference.time == self.reference_time:
 
@@ -475,9 +1107,9 @@ class UmisMathModel():
             outflows
         """
 
-        for _, process_outflows in process_stafs_dict.items():
+        for _, process_outflows in sorted_process_stafs(process_stafs_dict):
 
-            for flow in process_outflows.flows:
+            for flow in sorted_stafs(process_outflows.flows):
                 # Checks flow is about correct reference time
                 if flow.staf_reference.time == self.reference_time:
 
@@ -558,7 +1190,7 @@ class UmisMathModel():
         ------------
         external_outflows (set(Flow)): Flows from the diagram out
         """
-        for flow in outflows:
+        for flow in sorted_stafs(outflows):
             # Checks flow is about correct reference time
             if flow.staf_reference.time == self.reference_time:
 
@@ -579,23 +1211,18 @@ class UmisMathModel():
         """
         num_procs = len(self.__id_math_process_dict.keys())
 
-        staf_ccs_matrix = T.ones((num_procs, num_procs))
-
-        for dep_staf_prior in self.__dep_staf_priors.normal_dep_staf_priors:
-            cc_prior: ParamPrior = dep_staf_prior.cc_prior
-
-            row_ind = \
-                self.__id_math_process_dict[cc_prior.origin_id].process_ind
-
-            col_ind = \
-                self.__id_math_process_dict[cc_prior.dest_id].process_ind
+        staf_ccs_matrix = T.ones(self.__batch_shape + (num_procs, num_procs))
 
-            cc_rv = cc_prior.create_param_rv()
+        dep_staf_priors = (
+            self.__dep_staf_priors.normal_dep_staf_priors
+            + self.__dep_staf_priors.lognormal_dep_staf_priors
+            + self.__dep_staf_priors.uniform_dep_staf_priors)
 
-            staf_ccs_matrix = T.set_subtensor(
-                staf_ccs_matrix[row_ind, col_ind], cc_rv)
+        row_inds = []
+        col_inds = []
+        cc_rvs = []
 
-        for dep_staf_prior in self.__dep_staf_priors.lognormal_dep_staf_priors:
+        for dep_staf_prior in dep_staf_priors:
             cc_prior: ParamPrior = dep_staf_prior.cc_prior
 
             row_ind = \
@@ -604,51 +1231,45 @@ class UmisMathModel():
             col_ind = \
                 self.__id_math_process_dict[cc_prior.dest_id].process_ind
 
-            cc_rv = cc_prior.create_param_rv()
+            cc_rv = cc_prior.create_param_rv(self.parameterisation)
 
-            staf_ccs_matrix = T.set_subtensor(
-                staf_ccs_matrix[row_ind, col_ind], cc_rv)
+            row_inds.append(np.array([row_ind], dtype=np.int64))
+            col_inds.append(np.array([col_ind], dtype=np.int64))
+            cc_rvs.append(T.shape_padright(cc_rv))
 
-        for dep_staf_prior in self.__dep_staf_priors.uniform_dep_staf_priors:
-            cc_prior: ParamPrior = dep_staf_prior.cc_prior
-
-            row_ind = \
-                self.__id_math_process_dict[cc_prior.origin_id].process_ind
-
-            col_ind = \
-                self.__id_math_process_dict[cc_prior.dest_id].process_ind
-
-            cc_rv = cc_prior.create_param_rv()
-
-            staf_ccs_matrix = T.set_subtensor(
-                staf_ccs_matrix[row_ind, col_ind], cc_rv)
+        staf_ccs_matrix = assemble_matrix(
+            self.matrix_assembly,
+            staf_ccs_matrix,
+            row_inds,
+            col_inds,
+            cc_rvs)
 
         return staf_ccs_matrix
 
-    def __create_staf_obs_matrices_normal(self, dep_staf_priors):
+    def __create_staf_obs_vectors_normal(self, dep_staf_priors):
         """
-        Create observation matrix to select out the flow equations we have
-            lognormal observations for
+        Create the indices that select out the flow equations we have
+            normal or lognormal observations for
 
         Args
         ---------------
         dep_staf_priors (list(DepStafPriors)): List of staf value observations
         Returns
         ---------------
-        observed_staf_matrix (np.array):
-            num_obs x num_processes x num_processes matrix with 1s for each
-            normal staf observation
+        origin_inds (np.array): Origin process index of each observed staf
+        dest_inds (np.array): Destination process index of each observed staf
 
-        means_vector (np.array): The observed means of the flow values
+        means_vector (np.array): The observed means of the flow values, one
+            row per scenario if the model has scenarios
         sds_vector (np.array): The observed standard deviations of the flow
             values
         """
         num_obs = len(dep_staf_priors)
-        num_procs = len(self.__id_math_process_dict.keys())
 
-        observed_staf_matrix = np.zeros((num_obs, num_procs, num_procs))
-        means_vector = np.zeros(num_obs)
-        sds_vector = np.zeros(num_obs)
+        origin_inds = np.zeros(num_obs, dtype=np.int64)
+        dest_inds = np.zeros(num_obs, dtype=np.int64)
+        means_vector = np.zeros(self.__batch_shape + (num_obs,))
+        sds_vector = np.zeros(self.__batch_shape + (num_obs,))
 
         for i, dep_staf_priors in enumerate(dep_staf_priors):
             staf_prior = dep_staf_priors.staf_prior
@@ -661,16 +1282,17 @@ class UmisMathModel():
             dest_index = \
                 self.__id_math_process_dict[dest_id].process_ind
 
-            observed_staf_matrix[i][origin_index][dest_index] = 1
+            origin_inds[i] = origin_index
+            dest_inds[i] = dest_index
 
-            means_vector[i] = staf_prior.uncertainty.mean
-            sds_vector[i] = staf_prior.uncertainty.standard_deviation
+            means_vector[..., i], sds_vector[..., i] = \
+                staf_prior.get_param_values()
 
-        return observed_staf_matrix, means_vector, sds_vector
+        return origin_inds, dest_inds, means_vector, sds_vector
 
-    def __create_staf_obs_matrices_uniform(self, dep_staf_priors):
+    def __create_staf_obs_vectors_uniform(self, dep_staf_priors):
         """
-        Create observation matrix to select out the flow equations we have
+        Create the indices that select out the flow equations we have
             uniform observations for
 
         Args
@@ -680,19 +1302,19 @@ class UmisMathModel():
 
         Returns
         ---------------
-        observed_staf_matrix (np.array):
-            num_obs x num_processes x num_processes matrix with 1s for each
-            normal staf observation
+        origin_inds (np.array): Origin process index of each observed staf
+        dest_inds (np.array): Destination process index of each observed staf
 
-        means_vector (np.array): The observed means of the flow values
-        sds_vector (np.array): The observed standard deviations of the flow
-            values
+        lower_vector (np.array): The observed lower bounds of the flow values,
+            one row per scenario if the model has scenarios
+        upper_vector (np.array): The observed upper bounds of the flow values
         """
         num_obs = len(dep_staf_priors)
-        num_procs = len(self.__id_math_process_dict.keys())
-        observed_staf_matrix = np.zeros((num_obs, num_procs, num_procs))
-        lower_vector = np.zeros(num_obs)
-        upper_vector = np.zeros(num_obs)
+
+        origin_inds = np.zeros(num_obs, dtype=np.int64)
+        dest_inds = np.zeros(num_obs, dtype=np.int64)
+        lower_vector = np.zeros(self.__batch_shape + (num_obs,))
+        upper_vector = np.zeros(self.__batch_shape + (num_obs,))
 
         for i, dep_staf_priors in enumerate(dep_staf_priors):
             staf_prior = dep_staf_priors.staf_prior
@@ -705,12 +1327,13 @@ class UmisMathModel():
             dest_index = \
                 self.__id_math_process_dict[dest_id].process_ind
 
-            observed_staf_matrix[i][origin_index][dest_index] = 1
+            origin_inds[i] = origin_index
+            dest_inds[i] = dest_index
 
-            lower_vector[i] = staf_prior.uncertainty.lower
-            upper_vector[i] = staf_prior.uncertainty.upper
+            lower_vector[..., i], upper_vector[..., i] = \
+                staf_prior.get_param_values()
 
-        return observed_staf_matrix, lower_vector, upper_vector
+        return origin_inds, dest_inds, lower_vector, upper_vector
 
     def __create_dependent_staf_priors(
             self,
@@ -743,7 +1366,7 @@ class UmisMathModel():
             outflows
         """
 
-        for outflow in external_outflows:
+        for outflow in sorted_stafs(external_outflows):
 
             # Checks flow is about correct reference time
             if outflow.staf_reference.time == self.reference_time:
@@ -795,9 +1418,10 @@ class UmisMathModel():
             outflows
         """
 
-        for origin_process, process_outputs in process_stafs_dict.items():
+        for origin_process, process_outputs in \
+                sorted_process_stafs(process_stafs_dict):
 
-            for flow in process_outputs.flows:
+            for flow in sorted_stafs(process_outputs.flows):
                 # Checks flow is about correct reference time
                 if flow.staf_reference.time == self.reference_time:
 
@@ -876,9 +1500,11 @@ class UmisMathModel():
                                 staf_uncert,
                                 cc_uncert)
 
-    def __create_transfer_coefficient_matrix(self) -> T.Variable:
+    def __create_transfer_coefficient_matrix(self) \
+            -> Tuple[T.Variable, T.Variable]:
         """
-        Builds matrix with transfer coeffs represented as random variables
+        Builds matrix with transfer coeffs represented as random variables,
+        and the vector of its non-zero entries
 
         Args
         ------------
@@ -892,21 +1518,207 @@ class UmisMathModel():
         """
         num_of_processes = len(self.__id_math_process_dict.keys())
 
-        tc_matrix = T.zeros((num_of_processes, num_of_processes))
+        tc_matrix = T.zeros(
+            self.__batch_shape + (num_of_processes, num_of_processes))
+
+        tc_origin_inds = []
+        tc_dest_inds = []
+        tc_rvs = []
+        process_tc_rvs = {}
 
         for _, math_process in self.__id_math_process_dict.items():
-            dest_ids, dest_rvs = \
-                math_process.create_outflow_tc_rvs()
+            if self.tc_pooling == NO_TC_POOLING:
+                dest_ids, dest_rvs = math_process.create_outflow_tc_rvs(
+                    self.n_scenarios,
+                    self.parameterisation,
+                    self.tc_transform)
+            else:
+                # Every variable made for the pooled coefficients, including
+                # the transformed free variables, lacks the scenario axis
+                varnames = set(pm.modelcontext(None).named_vars)
+                dest_ids, dest_rvs = math_process.create_outflow_tc_rvs(
+                    None, self.parameterisation, self.tc_transform)
+                self.__pooled_varnames.update(
+                    set(pm.modelcontext(None).named_vars) - varnames)
+
+            if len(dest_ids) == 0:
+                continue
+
+            if self.tc_pooling != NO_TC_POOLING:
+                dest_rvs = self.__create_scenario_tc_rvs(
+                    math_process.process_id, dest_rvs, len(dest_ids))
 
             origin_ind = math_process.process_ind
 
             dest_inds = [self.__id_math_process_dict[pid].process_ind
                          for pid in dest_ids]
 
-            tc_matrix = T.set_subtensor(
-                tc_matrix[[origin_ind], dest_inds], dest_rvs)
+            tc_origin_inds.append(
+                np.full(len(dest_inds), origin_ind, dtype=np.int64))
+            tc_dest_inds.append(np.array(dest_inds, dtype=np.int64))
+            tc_rvs.append(dest_rvs)
+            process_tc_rvs[math_process.process_id] = (dest_ids, dest_rvs)
+
+        if len(self.tc_groups) > 0:
+            self.__pool_grouped_tcs(process_tc_rvs)
+
+        # Sparsity pattern of the transfer coefficients, used by the solvers
+        self.__tc_origin_inds = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + tc_origin_inds)
+        self.__tc_dest_inds = np.concatenate(
+            [np.zeros(0, dtype=np.int64)] + tc_dest_inds)
+
+        if len(tc_rvs) > 0:
+            tc_values = T.concatenate(tc_rvs, axis=-1)
+        else:
+            tc_values = T.zeros(self.__batch_shape + (0,))
+
+        # One group per process, so the chained assembly sets the outflow
+        # coefficients of each process together as the original graph did
+        tc_matrix = assemble_matrix(
+            self.matrix_assembly,
+            tc_matrix,
+            tc_origin_inds,
+            tc_dest_inds,
+            tc_rvs)
+
+        return tc_matrix, tc_values
+
+    def __create_scenario_tc_rvs(
+            self,
+            process_id: str,
+            pooled_rvs: T.Variable,
+            n_outflows: int) -> T.Variable:
+        """
+        Creates the transfer coefficients of every scenario from the pooled
+        transfer coefficients of a process
+
+        Args
+        ----
+        process_id (str): Id of the origin process
+        pooled_rvs (T.Variable): Pooled coefficient of each outflow
+        n_outflows (int): Number of outflows of the process
+
+        Returns
+        -------
+        T.Variable: Coefficient of each outflow in each scenario
+        """
+        scenario_ones = T.ones(self.__batch_shape + (1,))
+
+        if self.tc_pooling == SHARED_TC_POOLING or n_outflows == 1:
+            return scenario_ones * pooled_rvs
+
+        alpha, beta = HIERARCHICAL_TC_CONCENTRATION
+
+        varnames = set(pm.modelcontext(None).named_vars)
+        concentration = pm.Gamma(
+            "P_{} concentration".format(process_id),
+            alpha=alpha,
+            beta=beta)
+        self.__pooled_varnames.update(
+            set(pm.modelcontext(None).named_vars) - varnames)
+
+        # A clamped pooled coefficient of 0 would give a concentration of 0
+        pooled_rvs = T.maximum(pooled_rvs, MIN_DIRICHLET_TC)
+
+        shape = self.__batch_shape + (n_outflows,)
+        return pm.Dirichlet(
+            "P_{} scenarios".format(process_id),
+            a=concentration * scenario_ones * pooled_rvs,
+            shape=shape,
+            testval=np.full(shape, 1 / n_outflows))
+
+    def __pool_grouped_tcs(
+            self,
+            process_tc_rvs: Dict[str, Tuple[List[str], T.Variable]]):
+        """
+        Adds pooled transfer coefficients for each group of processes in
+        tc_groups with outflows to the same groups, and a Dirichlet factor
+        drawing the coefficients of each process of the group towards them
+
+        The Dirichlet factor is the group prior of the coefficients of each
+        member, and the own prior of a member is the likelihood of its
+        observation. Unobserved members have flat own priors, a Dirichlet of
+        ones or a uniform coefficient, so their coefficients follow the
+        group alone and no prior is counted twice
+
+        Args
+        ----
+        process_tc_rvs (dict(str, tuple(list(str), T.Variable))): Maps a
+            process id to the ids of its destinations and their coefficients
+        """
+        group_tc_rvs: Dict[Tuple[str, Tuple[str, ...]], List[T.Variable]] = {}
+
+        for process_id, (dest_ids, dest_rvs) in \
+                sorted(process_tc_rvs.items()):
+
+            if process_id not in self.tc_groups or len(dest_ids) < 2:
+                continue
 
-        return tc_matrix
+            dest_groups = [
+                self.tc_groups.get(dest_id, dest_id) for dest_id in dest_ids]
+
+            # Outflows are aligned across the group by their destination
+            # groups, which must then tell the outflows apart
+            if len(set(dest_groups)) != len(dest_groups):
+                continue
+
+            order = np.argsort(dest_groups)
+            group_key = (
+                self.tc_groups[process_id],
+                tuple(dest_groups[i] for i in order))
+
+            # Clamped transformation coefficients can be exactly 0, where
+            # the Dirichlet density is degenerate
+            member_rvs = T.maximum(
+                T.take(dest_rvs, order, axis=dest_rvs.ndim - 1),
+                MIN_DIRICHLET_TC)
+            member_rvs = member_rvs / T.sum(
+                member_rvs, axis=-1, keepdims=True)
+
+            group_tc_rvs.setdefault(group_key, []).append(member_rvs)
+
+        alpha, beta = HIERARCHICAL_TC_CONCENTRATION
+
+        for (group, dest_groups), member_rvs in sorted(group_tc_rvs.items()):
+            if len(member_rvs) < 2:
+                continue
+
+            name = "TC group {}-{}".format(group, ",".join(dest_groups))
+            n_outflows = len(dest_groups)
+
+            varnames = set(pm.modelcontext(None).named_vars)
+
+            pooled_rvs = pm.Dirichlet(
+                "{} pooled".format(name),
+                a=np.ones(n_outflows),
+                shape=(n_outflows,),
+                testval=np.full(n_outflows, 1 / n_outflows))
+
+            concentration = pm.Gamma(
+                "{} concentration".format(name),
+                alpha=alpha,
+                beta=beta)
+
+            self.__pooled_varnames.update(
+                set(pm.modelcontext(None).named_vars) - varnames)
+
+            # Members are stacked before the outflow axis, after any
+            # scenario axis
+            members_shape = \
+                self.__batch_shape + (len(member_rvs), n_outflows)
+
+            member_tcs = pm.Dirichlet.dist(
+                a=concentration * T.ones(members_shape) * pooled_rvs,
+                shape=members_shape)
+
+            pm.Potential(
+                name,
+                T.sum(member_tcs.logp(T.stack(member_rvs, axis=-2))))
+
+    def __is_pooled_tc(self, prior: 'ParamPrior') -> bool:
+        """ Checks if a prior is a transfer coefficient shared by scenarios """
+        return self.tc_pooling != NO_TC_POOLING and prior.param_type == 'TC'
 
     def __get_process_ind(self, process_id: str) -> int:
         """ Returns the index of the process in the matrix if id exists """
@@ -970,6 +1782,8 @@ class MathProcess():
     process_outflow_tcs (list(ParamPrior)): Prior knowledge of transfer
         coefficients for this process
     n_outflows (int): Number of outflows of the process
+    n_scenarios (int): Number of scenarios of the transfer coefficient random
+        variables, None if they have no scenario axis
     """
 
     def __init__(
@@ -989,6 +1803,14 @@ class MathProcess():
         self.process_ind = process_ind
         self.process_outflow_tcs = []
         self.n_outflows = 0
+        self.n_scenarios = None
+
+    def update_shared_params(self):
+        """
+        Sets the shared variables of the process to the current transfer
+        coefficient priors, processes without shared variables do nothing
+        """
+        return
 
 
 class MathDistributionProcess(MathProcess):
@@ -1001,6 +1823,11 @@ class MathDistributionProcess(MathProcess):
     process_ind (int): Index of process in the matrix
     outflow_process_ids (list(str)): Ids of each process receiving a flow
     n_outflows (int): Number of outflows of the process
+
+    Attributes
+    ------------------------
+    shares (T.sharedvar): Dirichlet concentration of each outflow, None until
+        the transfer coefficient random variables are created
     """
 
     def __init__(
@@ -1015,6 +1842,7 @@ class MathDistributionProcess(MathProcess):
         """
 
         super(MathDistributionProcess, self).__init__(process_id, process_ind)
+        self.shares = None
 
     def add_outflow(self, process_outflow_tc: 'ParamPrior'):
         """
@@ -1029,46 +1857,87 @@ class MathDistributionProcess(MathProcess):
         self.process_outflow_tcs.append(process_outflow_tc)
         self.n_outflows += 1
 
-    def create_outflow_tc_rvs(self) \
+    def create_outflow_tc_rvs(
+            self,
+            n_scenarios: int = None,
+            parameterisation: str = CENTERED_PARAMETERISATION,
+            tc_transform: str = CLAMP_TC_TRANSFORM) \
             -> Tuple[List[str], pm.Continuous]:
         """
         Create RVs for transfer coefficients for the process
 
         Args
         -----------
-        dist_coeffs (DistributionCoefficients): known transfer coefficients
+        n_scenarios (int): Number of scenarios, None for no scenario axis
+        parameterisation (str): Unused, the coefficients are Dirichlet
+        tc_transform (str): Unused, the coefficients are stick breaking
+            transformed
         """
 
         assert (self.n_outflows == len(self.process_outflow_tcs))
+        self.n_scenarios = n_scenarios
 
         if (self.n_outflows == 0):
             return [], 0
 
-        # If no coefficients supplied, model as a uniform dirichlet
-        # distribution
-        shares = []
-        outflow_process_ids = []
-        for tc in self.process_outflow_tcs:
-
-            tc_uncertainty = tc.uncertainty
-            if isinstance(tc_uncertainty, Uncertainty):
-                shares.append(tc_uncertainty.mean)
-            else:
-                shares.append(1)
+        outflow_process_ids = [
+            tc.dest_id for tc in self.process_outflow_tcs]
 
-            outflow_process_ids.append(tc.dest_id)
-        shares = np.array(shares)
+        batch_shape = () if n_scenarios is None else (n_scenarios,)
 
         if self.n_outflows == 1:
             random_variable = pm.Deterministic(
-                "P_{}".format(self.process_id), T.ones(1,))
+                "P_{}".format(self.process_id), T.ones(batch_shape + (1,)))
 
         else:
+            shares = self.__get_shares()
+            self.shares = theano.shared(
+                shares, name="P_{} shares".format(self.process_id))
+
             random_variable = pm.Dirichlet(
-                "P_{}".format(self.process_id), shares)
+                "P_{}".format(self.process_id),
+                self.shares,
+                shape=shares.shape,
+                testval=shares / shares.sum(axis=-1, keepdims=True))
 
         return outflow_process_ids, random_variable
 
+    def update_shared_params(self):
+        """
+        Sets the Dirichlet concentrations to the current transfer coefficient
+        priors
+        """
+        if self.shares is not None:
+            self.shares.set_value(self.__get_shares())
+
+    def __get_shares(self) -> np.ndarray:
+        """
+        Gets the Dirichlet concentration of each outflow, one row per
+        scenario if the process has scenarios
+        """
+        if self.n_scenarios is None:
+            shares = [
+                self.__get_share(tc.uncertainty)
+                for tc in self.process_outflow_tcs]
+
+            return np.array(shares, dtype=theano.config.floatX)
+
+        shares = [
+            [self.__get_share(tc_uncertainty)
+             for tc_uncertainty in tc.scenario_uncertainties]
+            for tc in self.process_outflow_tcs]
+
+        return np.array(shares, dtype=theano.config.floatX).T
+
+    @staticmethod
+    def __get_share(tc_uncertainty: Uncertainty) -> float:
+        # If no coefficients supplied, model as a uniform dirichlet
+        # distribution
+        if isinstance(tc_uncertainty, Uncertainty):
+            return tc_uncertainty.mean
+        else:
+            return 1
+
 
 class MathTransformationProcess(MathProcess):
     """
@@ -1110,13 +1979,26 @@ class MathTransformationProcess(MathProcess):
         self.process_outflow_tcs.append(process_outflow_tc)
         self.n_outflows += 1
 
-    def create_outflow_tc_rvs(self) \
+    def create_outflow_tc_rvs(
+            self,
+            n_scenarios: int = None,
+            parameterisation: str = CENTERED_PARAMETERISATION,
+            tc_transform: str = CLAMP_TC_TRANSFORM) \
             -> Tuple[List[str], pm.Continuous]:
         """
         Create RVs for the transfer coefficients for the process
+
+        Args
+        ----
+        n_scenarios (int): Number of scenarios, None for no scenario axis
+        parameterisation (str): One of PARAMETERISATIONS, how the known
+            transfer coefficient is sampled when it is clamped
+        tc_transform (str): One of TC_TRANSFORMS
         """
 
         assert (self.n_outflows == len(self.process_outflow_tcs))
+        self.n_scenarios = n_scenarios
+        batch_shape = () if n_scenarios is None else (n_scenarios,)
 
         if (self.n_outflows == 0):
 
@@ -1127,19 +2009,27 @@ class MathTransformationProcess(MathProcess):
             random_variable = pm.Deterministic(
                 "P_{}".format(
                     self.process_id),
-                T.ones(1,))
+                T.ones(batch_shape + (1,)))
 
             return [dest_id], random_variable
 
         if self.n_outflows == 2:
             known_outflow_tc, unknown_outflow_tc = self.__identify_known_tc()
 
-            known_outflow_rv = known_outflow_tc.create_param_rv()
+            if (tc_transform == LOGIT_TC_TRANSFORM
+                    and not isinstance(known_outflow_tc.uncertainty,
+                                       Constant)):
+                coefficient_1 = known_outflow_tc.create_param_rv(
+                    unit_interval=True)
+            else:
+                known_outflow_rv = known_outflow_tc.create_param_rv(
+                    parameterisation)
 
-            # Enforce the TC to be between 0 and 1
-            coefficient_1 = ParamPrior.enforce_range(known_outflow_rv)
+                # Enforce the TC to be between 0 and 1
+                coefficient_1 = ParamPrior.enforce_range(known_outflow_rv)
 
-            random_variables = T.stack([coefficient_1, 1-coefficient_1])
+            random_variables = T.stack(
+                [coefficient_1, 1-coefficient_1], axis=-1)
 
             known_outflow_id = known_outflow_tc.dest_id
 
@@ -1171,10 +2061,20 @@ class MathTransformationProcess(MathProcess):
 
             return known_outflow_tc, unknown_outflow_tc
         else:
-            outflow_tc_1.uncertainty = UniformUncertainty(lower=0, upper=1)
-            outflow_tc_2.uncertainty = UniformUncertainty(lower=0, upper=1)
+            # Neither is known so the first tc is uniform on [0, 1], the
+            # observed priors are left untouched so the structure of the
+            # model does not change once it is built
+            uniform_outflow_tc = ParamPrior(
+                outflow_tc_1.param_type,
+                outflow_tc_1.origin_id,
+                outflow_tc_1.dest_id,
+                UniformUncertainty(lower=0, upper=1))
 
-            return outflow_tc_1, outflow_tc_2
+            if self.n_scenarios is not None:
+                uniform_outflow_tc.scenario_uncertainties = \
+                    [uniform_outflow_tc.uncertainty] * self.n_scenarios
+
+            return uniform_outflow_tc, outflow_tc_2
 
 
 class MathStorageProcess(MathProcess):
@@ -1201,7 +2101,11 @@ class MathStorageProcess(MathProcess):
         # not have outflows
         super(MathStorageProcess, self).__init__(process_id, process_ind)
 
-    def create_outflow_tc_rvs(self):
+    def create_outflow_tc_rvs(
+            self,
+            n_scenarios: int = None,
+            parameterisation: str = CENTERED_PARAMETERISATION,
+            tc_transform: str = CLAMP_TC_TRANSFORM):
         """
         No random variable associated with process as there are no outflows
         """
@@ -1219,6 +2123,12 @@ class ParamPrior():
     origin_id (str): Origin process id
     dest_id (str): Destination process id
     uncertainty (Uncertainty): Quantity of flow and its uncertainty
+    shared_params (list(T.sharedvar)): Shared variables holding the
+        parameters of the uncertainty once the random variable is created
+    scenario_uncertainties (list(Uncertainty)): Uncertainty of each scenario,
+        None if the parameter has no scenario axis
+    unit_interval (bool): Whether the random variable is restricted to
+        [0, 1]
     """
 
     def __init__(
@@ -1247,36 +2157,228 @@ class ParamPrior():
         self.param_name = "{}-{}_{}".format(
             param_type, origin_id, dest_id)
         self.uncertainty = uncertainty
+        self.shared_params: List[T.sharedvar.SharedVariable] = []
+        self.scenario_uncertainties: List[Uncertainty] = None
+        self.unit_interval = False
+
+    def get_param_values(self) -> Tuple[float, ...]:
+        """
+        Gets the parameters of the uncertainty in the order they are passed
+        to its distribution, as vectors over the scenarios if the parameter
+        has scenarios
+        """
+        if self.scenario_uncertainties is None:
+            return self.__get_uncertainty_params(self.uncertainty)
+
+        scenario_params = [
+            self.__get_uncertainty_params(uncertainty)
+            for uncertainty in self.scenario_uncertainties]
+
+        return tuple(np.array(params) for params in zip(*scenario_params))
+
+    @staticmethod
+    def __get_uncertainty_params(uncertainty: Uncertainty) \
+            -> Tuple[float, ...]:
+        if isinstance(uncertainty, UniformUncertainty):
+            return (uncertainty.lower, uncertainty.upper)
 
-    def create_param_rv(self):
+        elif (isinstance(uncertainty, NormalUncertainty)
+                or isinstance(uncertainty, LognormalUncertainty)):
+            return (uncertainty.mean,
+                    uncertainty.standard_deviation)
+
+        elif isinstance(uncertainty, Constant):
+            return (uncertainty.mean,)
+
+        else:
+            raise ValueError(
+                "Uncertainty parameter is of unknown distribution")
+
+    def set_uncertainty(self, uncertainty: Uncertainty, scenario: int = None):
         """
-        Create random variable for this parameter
+        Replaces the uncertainty of the parameter, the distribution family
+        must not change once the random variable has been created
+
+        Args
+        ----
+        uncertainty (Uncertainty): New quantity and its uncertainty
+        scenario (int): Scenario to replace the uncertainty of, None to
+            replace it in every scenario
         """
+        if (self.shared_params
+                and type(uncertainty) is not type(self.uncertainty)):
+            raise ValueError(
+                "Uncertainty of {} must be {}, received {}".format(
+                    self.param_name,
+                    type(self.uncertainty).__name__,
+                    type(uncertainty).__name__))
+
+        if scenario is not None:
+            self.scenario_uncertainties[scenario] = uncertainty
+            return
+
+        self.uncertainty = uncertainty
+
+        if self.scenario_uncertainties is not None:
+            self.scenario_uncertainties = \
+                [uncertainty] * len(self.scenario_uncertainties)
+
+    def update_shared_params(self):
+        """
+        Sets the shared parameters of the random variable to the current
+        uncertainty
+        """
+        if not self.shared_params:
+            return
+
+        if self.unit_interval:
+            self.__check_unit_interval_bounds()
+
+        for shared_param, param_value in \
+                zip(self.shared_params, self.get_param_values()):
+            shared_param.set_value(
+                np.asarray(param_value, dtype=theano.config.floatX))
+
+    def create_param_rv(
+            self,
+            parameterisation: str = CENTERED_PARAMETERISATION,
+            unit_interval: bool = False):
+        """
+        Create random variable for this parameter, the parameters of its
+        distribution are shared variables so they can be updated without
+        rebuilding the model
+
+        Args
+        ----
+        parameterisation (str): One of PARAMETERISATIONS, how a normal or
+            lognormal random variable is sampled
+        unit_interval (bool): If True the random variable is restricted to
+            [0, 1] and sampled in log odds space, parameterisation is then
+            unused
+        """
+        if self.scenario_uncertainties is None:
+            shape = ()
+        else:
+            shape = (len(self.scenario_uncertainties),)
+
+        self.shared_params = [
+            theano.shared(
+                np.asarray(param_value, dtype=theano.config.floatX),
+                name="{} param {}".format(self.param_name, i))
+            for i, param_value in enumerate(self.get_param_values())]
+
+        self.unit_interval = unit_interval
+        if unit_interval:
+            self.__check_unit_interval_bounds()
 
         if isinstance(self.uncertainty, UniformUncertainty):
+            lower, upper = self.shared_params
+
+            if unit_interval:
+                lower = T.maximum(0, lower)
+                upper = T.minimum(1, upper)
+
             return pm.Uniform(
                 self.param_name,
-                lower=self.uncertainty.lower,
-                upper=self.uncertainty.upper)
+                shape=shape,
+                lower=lower,
+                upper=upper)
+
+        elif isinstance(self.uncertainty,
+                        (NormalUncertainty, LognormalUncertainty)):
+            if unit_interval:
+                return self.__create_unit_interval_rv(shape)
+
+            mean, standard_deviation = self.shared_params
+            is_lognormal = isinstance(self.uncertainty, LognormalUncertainty)
+
+            # A lognormal is already a normal in log space
+            if (parameterisation == NON_CENTERED_PARAMETERISATION
+                    or (parameterisation == LOG_PARAMETERISATION
+                        and is_lognormal)):
+                offset = pm.Normal(
+                    "{} offset".format(self.param_name),
+                    shape=shape,
+                    mu=0,
+                    sd=1)
+
+                value = mean + standard_deviation * offset
+                if is_lognormal:
+                    value = T.exp(value)
+
+                return pm.Deterministic(self.param_name, value)
+
+            if is_lognormal:
+                return pm.Lognormal(
+                    self.param_name,
+                    shape=shape,
+                    mu=mean,
+                    sd=standard_deviation)
+
+            if parameterisation == LOG_PARAMETERISATION:
+                mean_value, standard_deviation_value = \
+                    self.get_param_values()
+
+                # Truncated at 0 and renormalised, a normal cut off at 0
+                # would put less than its full mass on the positive values
+                return pm.TruncatedNormal(
+                    self.param_name,
+                    shape=shape,
+                    mu=mean,
+                    sd=standard_deviation,
+                    lower=0,
+                    transform=pm.distributions.transforms.log,
+                    testval=np.where(
+                        np.asarray(mean_value) > 0,
+                        mean_value,
+                        standard_deviation_value))
 
-        elif isinstance(self.uncertainty, NormalUncertainty):
             return pm.Normal(
                 self.param_name,
-                mu=self.uncertainty.mean,
-                sd=self.uncertainty.standard_deviation)
+                shape=shape,
+                mu=mean,
+                sd=standard_deviation)
 
-        elif isinstance(self.uncertainty, LognormalUncertainty):
-            return pm.Lognormal(
-                self.param_name,
-                mu=self.uncertainty.mean,
-                sd=self.uncertainty.standard_deviation)
+        else:
+            value, = self.shared_params
+            return value
+
+    def __check_unit_interval_bounds(self):
+        """
+        Checks that a uniform prior restricted to [0, 1] still has an
+        interval, its log probability is otherwise -inf everywhere
+        """
+        if not isinstance(self.uncertainty, UniformUncertainty):
+            return
 
-        elif isinstance(self.uncertainty, Constant):
-            return np.float(self.uncertainty.mean)
+        lower, upper = self.get_param_values()
 
-        else:
+        if np.any(np.maximum(0, lower) >= np.minimum(1, upper)):
             raise ValueError(
-                "Uncertainty parameter is of unknown distribution")
+                "Uniform prior of {} must overlap [0, 1], received [{}, {}]"
+                .format(self.param_name, lower, upper))
+
+    def __create_unit_interval_rv(self, shape: tuple):
+        """
+        Creates the normal or lognormal random variable of the parameter
+        restricted to [0, 1], sampled in log odds space
+        """
+        mean, standard_deviation = self.shared_params
+        mean_value, _ = self.get_param_values()
+
+        if isinstance(self.uncertainty, LognormalUncertainty):
+            distribution = pm.Lognormal
+            mean_value = np.exp(mean_value)
+        else:
+            distribution = pm.Normal
+
+        return distribution(
+            self.param_name,
+            shape=shape,
+            mu=mean,
+            sd=standard_deviation,
+            transform=pm.distributions.transforms.logodds,
+            testval=np.clip(mean_value, 0.01, 0.99))
 
     @staticmethod
     def enforce_range(param_rv):
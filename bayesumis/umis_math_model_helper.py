@@ -9,9 +9,15 @@ doi:10.1111/jiec.12698
 https://github.com/ricklupton/bayesian-mfa-paper
 """
 
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import numpy as np
+import theano.tensor as T
+
+SCATTER_ASSEMBLY = 'scatter'
+CHAINED_ASSEMBLY = 'chained'
+
+MATRIX_ASSEMBLIES = (SCATTER_ASSEMBLY, CHAINED_ASSEMBLY)
 
 
 def make_distribution_tcs(
@@ -68,3 +74,120 @@ def get_process_name(
         process_name, space_name, pos_to_diagram)
 
     return process_name
+
+
+def assemble_matrix(
+        assembly: str,
+        base_matrix: T.Variable,
+        row_inds: List[np.ndarray],
+        col_inds: List[np.ndarray],
+        values: List[T.Variable]) -> T.Variable:
+    """
+    Sets entry (row_inds[i][j], col_inds[i][j]) of base_matrix to
+    values[i][..., j], where group i holds the entries of one process or
+    observation
+
+    Args
+    ----
+    assembly (str): 'scatter' sets every entry with a single scatter so the
+        graph depth does not grow with the number of entries, 'chained' is
+        the original construction with one set_subtensor per group, kept as
+        a reference implementation
+    base_matrix (T.Variable): Matrix holding the value of unset entries, or
+        a stack of matrices with a leading scenario axis
+    row_inds (list(np.ndarray)): Row index of each value of each group
+    col_inds (list(np.ndarray)): Column index of each value of each group
+    values (list(T.Variable)): Vector of the values of each group, or one
+        vector per scenario
+    """
+    if len(values) == 0:
+        return base_matrix
+
+    if base_matrix.ndim == 3 and assembly != SCATTER_ASSEMBLY:
+        raise ValueError("Only the {} matrix assembly supports scenarios"
+                         .format(SCATTER_ASSEMBLY))
+
+    if assembly == CHAINED_ASSEMBLY:
+        matrix = base_matrix
+        for group_row_inds, group_col_inds, group_values in \
+                zip(row_inds, col_inds, values):
+            matrix = T.set_subtensor(
+                matrix[group_row_inds, group_col_inds], group_values)
+
+        return matrix
+
+    if assembly != SCATTER_ASSEMBLY:
+        raise ValueError("Matrix assembly must be one of {}, received {}"
+                         .format(MATRIX_ASSEMBLIES, assembly))
+
+    row_inds = np.concatenate(row_inds)
+    col_inds = np.concatenate(col_inds)
+    values = T.concatenate(values, axis=-1)
+
+    if base_matrix.ndim == 2:
+        return T.set_subtensor(base_matrix[row_inds, col_inds], values)
+
+    # Scatters rows of a (rows * cols, scenarios) matrix, the one advanced
+    # index form with a fast gradient
+    num_scenarios, num_rows, num_cols = base_matrix.shape
+    flat_matrix = base_matrix.reshape(
+        (num_scenarios, num_rows * num_cols)).T
+
+    flat_inds = row_inds * num_cols + col_inds
+    flat_matrix = T.set_subtensor(flat_matrix[flat_inds], values.T)
+
+    return flat_matrix.T.reshape(base_matrix.shape)
+
+
+def sorted_stafs(stafs: Iterable) -> List:
+    """
+    Sorts stocks and flows by their STAFDB id and processes, so the math model
+    assigns the same indices to the same diagram in every interpreter
+
+    Args
+    ----
+    stafs (iterable(Staf)): Stocks and flows to sort
+    """
+    return sorted(
+        stafs,
+        key=lambda staf: (
+            staf.stafdb_id,
+            staf.origin_process.diagram_id,
+            staf.destination_process.diagram_id))
+
+
+def sorted_process_stafs(process_stafs_dict: Dict) -> List[Tuple]:
+    """
+    Sorts the items of a process stafs dict by the diagram id of the process
+
+    Args
+    ----
+    process_stafs_dict (dict(UmisProcess, ProcessOutputs)): Maps a process to
+        its outflows
+    """
+    return sorted(
+        process_stafs_dict.items(),
+        key=lambda item: item[0].diagram_id)
+
+
+def gather_matrix_entries(
+        matrix: T.Variable,
+        row_inds: np.ndarray,
+        col_inds: np.ndarray) -> T.Variable:
+    """
+    Gets entry (row_inds[i], col_inds[i]) of a matrix, or of every matrix in
+    a stack with a leading scenario axis
+
+    Args
+    ----
+    matrix (T.Variable): Matrix, or stack of matrices
+    row_inds (np.ndarray): Row index of each entry
+    col_inds (np.ndarray): Column index of each entry
+    """
+    if matrix.ndim == 2:
+        return matrix[row_inds, col_inds]
+
+    num_scenarios, num_rows, num_cols = matrix.shape
+    flat_matrix = matrix.reshape((num_scenarios, num_rows * num_cols))
+
+    return T.take(flat_matrix, row_inds * num_cols + col_inds, axis=1)
@@ -0,0 +1,216 @@
+"""
+Cache of compiled math models keyed by the structure of their diagram
+
+Building the pymc3 model and compiling its log probability and gradient
+dominate the time to run a reconciliation. Observation values are held in
+shared variables, so a new diagram with the same structure as a cached one
+reuses the cached model and only its observations are copied across.
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Dict, Set
+
+from bayesumis.umis_data_models import (
+    Flow,
+    Material,
+    ProcessOutputs,
+    Timeframe)
+from bayesumis.umis_math_model import UmisMathModel
+
+
+class UmisModelCache():
+    """
+    Least recently used cache of compiled math models, held in memory and
+    optionally pickled to a directory so they survive between processes
+
+    Attributes
+    ----------
+    cache_dir (str): Directory holding pickled models, None to only cache in
+        memory
+    max_entries (int): Maximum number of models held in memory and on disk
+    """
+
+    CACHE_FILE_EXTENSION = '.pkl'
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 8):
+        """
+        Args
+        ----
+        cache_dir (str): Directory holding pickled models, None to only cache
+            in memory
+        max_entries (int): Maximum number of models held in memory and on
+            disk
+        """
+        if max_entries < 1:
+            raise ValueError("Cache must hold at least one model, received {}"
+                             .format(max_entries))
+
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+        self.__models: Dict[str, UmisMathModel] = OrderedDict()
+        """ Maps a structure fingerprint to its compiled model """
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_model(
+            self,
+            external_inflows: Set[Flow],
+            process_stafs_dict: Dict[str, ProcessOutputs],
+            external_outflows: Set[Flow],
+            reference_material: Material,
+            reference_time: Timeframe,
+            **model_kwargs) -> UmisMathModel:
+        """
+        Gets a compiled math model of the diagram, reusing a cached model
+        with the same structure if there is one. Takes the same arguments as
+        UmisMathModel
+
+        The returned model is shared with the cache, its observations are
+        overwritten by the next call with the same structure
+
+        Returns
+        -------
+        UmisMathModel: Model with pm_model built and its NUTS step compiled
+        """
+        math_model = UmisMathModel(
+            external_inflows,
+            process_stafs_dict,
+            external_outflows,
+            reference_material,
+            reference_time,
+            build_pm_model=False,
+            **model_kwargs)
+
+        fingerprint = math_model.get_structure_fingerprint()
+
+        cached_model = self.__models.get(fingerprint)
+        if cached_model is None:
+            cached_model = self.__load_model(fingerprint)
+        else:
+            self.__touch_model_file(fingerprint)
+
+        if cached_model is not None:
+            cached_model.copy_observations(math_model)
+            self.__add_model(fingerprint, cached_model)
+
+            return cached_model
+
+        math_model.create_pm_model()
+        math_model.get_nuts_step()
+
+        self.__add_model(fingerprint, math_model)
+        self.__save_model(fingerprint, math_model)
+
+        return math_model
+
+    def clear(self):
+        """
+        Removes every model from memory and from the cache directory
+        """
+        self.__models.clear()
+
+        if self.cache_dir is None:
+            return
+
+        for file_path in self.__get_cache_files():
+            os.remove(file_path)
+
+    def __add_model(self, fingerprint: str, math_model: UmisMathModel):
+        """
+        Adds a model as the most recently used, evicting the least recently
+        used model if the cache is full
+        """
+        self.__models[fingerprint] = math_model
+        self.__models.move_to_end(fingerprint)
+
+        while len(self.__models) > self.max_entries:
+            self.__models.popitem(last=False)
+
+    def __get_cache_path(self, fingerprint: str) -> str:
+        return os.path.join(
+            self.cache_dir, fingerprint + self.CACHE_FILE_EXTENSION)
+
+    def __get_cache_files(self):
+        return [
+            os.path.join(self.cache_dir, file_name)
+            for file_name in os.listdir(self.cache_dir)
+            if file_name.endswith(self.CACHE_FILE_EXTENSION)]
+
+    def __touch_model_file(self, fingerprint: str):
+        """
+        Marks the pickled model as recently used, so files are evicted in
+        the same order as the models in memory
+        """
+        if self.cache_dir is None:
+            return
+
+        try:
+            os.utime(self.__get_cache_path(fingerprint))
+        except FileNotFoundError:
+            pass
+
+    def __load_model(self, fingerprint: str) -> UmisMathModel:
+        """
+        Loads a pickled model from the cache directory, None if there is no
+        model with the fingerprint
+        """
+        if self.cache_dir is None:
+            return None
+
+        cache_path = self.__get_cache_path(fingerprint)
+
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                math_model = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError,
+                EOFError,
+                AttributeError,
+                ImportError):
+            # A file from an incompatible version, whose classes may have
+            # been moved or removed, rebuild the model
+            os.remove(cache_path)
+            return None
+
+        self.__touch_model_file(fingerprint)
+
+        return math_model
+
+    def __save_model(self, fingerprint: str, math_model: UmisMathModel):
+        """
+        Pickles a model to the cache directory, evicting the least recently
+        used files if the directory is full
+        """
+        if self.cache_dir is None:
+            return
+
+        # Written to a temporary file first so concurrent readers never see a
+        # partial model
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                pickle.dump(
+                    math_model, temp_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(temp_path, self.__get_cache_path(fingerprint))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        cache_files = sorted(
+            self.__get_cache_files(),
+            key=lambda file_path: os.stat(file_path).st_mtime_ns)
+
+        for file_path in cache_files[:-self.max_entries]:
+            os.remove(file_path)
+
+
+if __name__ == '__main__':
+    sys.exit(1)
@@ -0,0 +1,185 @@
+"""
+Math model of a diagram balancing several materials together
+
+Every material is a scenario of one batched UmisMathModel, so the inputs,
+stafs and concentration coefficients of all materials are stacked along a
+leading material axis over the one process graph of the diagram, and are
+solved and sampled together. The transfer coefficients of the materials are
+independent, shared or partially pooled, so observations of one material
+inform the transfer coefficients of the others.
+"""
+
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import (
+    Material,
+    Timeframe,
+    Uncertainty)
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import ADVI_METHOD, UmisFitResult
+from bayesumis.umis_math_model import NO_TC_POOLING, UmisMathModel
+
+
+class MultiMaterialUmisMathModel():
+    """
+    Builds one math model of a diagram over several reference materials
+
+    Attributes
+    ----------
+    reference_materials (list(Material)): Material of each index of the
+        material axis
+    math_model (UmisMathModel): Model with one scenario per material, the
+        material axis of its variables
+    """
+
+    def __init__(
+            self,
+            umis_diagram: UmisDiagram,
+            reference_materials: List[Material],
+            reference_time: Timeframe,
+            material_reconc_tables:
+                Dict[Material, Dict[Material, Uncertainty]] = {},
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            tc_pooling: str = NO_TC_POOLING,
+            build_pm_model: bool = True,
+            **model_kwargs):
+        """
+        Args
+        ----
+        umis_diagram (UmisDiagram): Diagram being reconciled
+        reference_materials (list(Material)): The materials being balanced,
+            the model of each must have the same structure, so the same
+            stafs must be observed with the same distributions
+        reference_time (Timeframe): The timeframe over which the stocks and
+            flows are modeled
+        material_reconc_tables (dict(Material, dict(Material, Uncertainty))):
+            Maps a reference material to its material_reconc_table, mapping
+            a material to its concentration coefficient
+        tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
+            origin process id to a dictionary mapping the destination process
+            id to its transfer coefficient, in every material
+        tc_pooling (str): 'none' for independent transfer coefficients in
+            every material, 'shared' for the same coefficients in every
+            material, or 'hierarchical' for material coefficients drawn
+            around pooled coefficients
+        build_pm_model (bool): If False pm_model is built by create_pm_model
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+        """
+        if len(reference_materials) == 0:
+            raise ValueError("Multi material model needs at least one "
+                             + "material")
+
+        if len(set(reference_materials)) != len(reference_materials):
+            raise ValueError("Reference materials must be unique")
+
+        if 'n_scenarios' in model_kwargs:
+            raise ValueError("The scenarios of a multi material model are "
+                             + "its materials, n_scenarios cannot be set")
+
+        self.reference_materials = list(reference_materials)
+
+        model_args = [
+            (umis_diagram.get_external_inflows(),
+             umis_diagram.get_process_stafs_dict(),
+             umis_diagram.get_external_outflows(),
+             reference_material,
+             reference_time,
+             material_reconc_tables.get(reference_material, {}),
+             tc_observation_table)
+            for reference_material in reference_materials]
+
+        material_models = [
+            UmisMathModel(*args, build_pm_model=False, **model_kwargs)
+            for args in model_args]
+
+        fingerprint = material_models[0].get_structure_fingerprint()
+        for material_ind, material_model in enumerate(material_models):
+            if material_model.get_structure_fingerprint() != fingerprint:
+                raise ValueError(
+                    "Model of material {} has a different structure than "
+                    .format(reference_materials[material_ind])
+                    + "the model of material {}"
+                    .format(reference_materials[0]))
+
+        self.math_model = UmisMathModel(
+            *model_args[0],
+            build_pm_model=False,
+            n_scenarios=len(reference_materials),
+            tc_pooling=tc_pooling,
+            **model_kwargs)
+
+        for material_ind, material_model in enumerate(material_models):
+            observations = material_model.get_observations()
+
+            # Every material shares the transfer coefficient observations,
+            # which pooled coefficients only hold once
+            if tc_pooling == NO_TC_POOLING:
+                tc_observations = observations['tc']
+            else:
+                tc_observations = {}
+
+            self.math_model.update_observations(
+                staf_observations=observations['staf'],
+                cc_observations=observations['cc'],
+                tc_observations=tc_observations,
+                scenario=material_ind)
+
+        if build_pm_model:
+            self.create_pm_model()
+
+    @property
+    def pm_model(self) -> pm.Model:
+        """ Model of every material, None until create_pm_model is called """
+        return self.math_model.pm_model
+
+    def create_pm_model(self):
+        """ Builds the model of every material """
+        self.math_model.create_pm_model()
+
+    def fit(
+            self,
+            method: str = ADVI_METHOD,
+            **fit_kwargs) -> UmisFitResult:
+        """
+        Fits the posterior of every material, takes the arguments of
+        UmisMathModel.fit. Every variable has a leading material axis
+
+        Returns
+        -------
+        UmisFitResult: Samples of every variable and convergence diagnostics
+        """
+        return self.math_model.fit(method=method, **fit_kwargs)
+
+    def get_nuts_step(self):
+        """ Gets a NUTS step method over pm_model """
+        return self.math_model.get_nuts_step()
+
+    def get_material_ind(self, material: Material) -> int:
+        """ Gets the index of a material on the material axis """
+        if material not in self.reference_materials:
+            raise ValueError("Material {} is not in this model"
+                             .format(material))
+
+        return self.reference_materials.index(material)
+
+    def get_material_samples(self, trace, material: Material) \
+            -> Dict[str, np.ndarray]:
+        """
+        Gets the samples of every variable for one material, in the layout
+        of an unbatched trace so they can be indexed by the math model
+
+        Args
+        ----
+        trace (pm.backends.base.MultiTrace): Trace sampled from pm_model
+        material (Material): One of reference_materials
+        """
+        return self.math_model.get_scenario_samples(
+            trace, self.get_material_ind(material))
+
+
+if __name__ == '__main__':
+    sys.exit(1)
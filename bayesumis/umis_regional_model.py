@@ -0,0 +1,197 @@
+"""
+Hierarchical math model of a diagram of several regions
+
+The regional diagrams are merged into one diagram, and as their processes are
+in different spaces the matrices of the merged model are block diagonal with
+one block per region. The transfer coefficients of the processes with the
+same stafdb id in different regions are partially pooled, so sparsely
+observed regions borrow strength from well observed ones. Every region is
+compiled and sampled once, together.
+"""
+
+import sys
+from typing import Dict, List, Set
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import (
+    Flow,
+    Material,
+    Staf,
+    Timeframe,
+    UmisProcess,
+    Uncertainty)
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import ADVI_METHOD, UmisFitResult
+from bayesumis.umis_math_model import UmisMathModel
+
+
+class RegionalUmisMathModel():
+    """
+    Builds one math model over several regional diagrams, with hierarchical
+    transfer coefficients shared by the processes of matching stafdb ids
+
+    Attributes
+    ----------
+    region_names (list(str)): Name of each region, in the order given
+    umis_diagram (UmisDiagram): Diagram merging every region
+    math_model (UmisMathModel): Model of the merged diagram
+    """
+
+    def __init__(
+            self,
+            regional_diagrams: Dict[str, UmisDiagram],
+            reference_material: Material,
+            reference_time: Timeframe,
+            material_reconc_table: Dict[Material, Uncertainty] = {},
+            tc_observation_table: Dict[str, Dict[str, Uncertainty]] = {},
+            tc_groups: Dict[str, str] = None,
+            build_pm_model: bool = True,
+            **model_kwargs):
+        """
+        Args
+        ----
+        regional_diagrams (dict(str, UmisDiagram)): Maps the name of a region
+            to its diagram, the regions must not share processes
+        reference_material (Material): The material being balanced
+        reference_time (Timeframe): The timeframe over which the stocks and
+            flows are modeled
+        material_reconc_table (dict(Material, Uncertainty)): Maps a material
+            to its concentration coefficient
+        tc_observation_table (dict(str, dict(str, Uncertainty))): Maps an
+            origin process id to a dictionary mapping the destination process
+            id to its transfer coefficient
+        tc_groups (dict(str, str)): Maps a process id to the group its
+            transfer coefficients are pooled in, if None every process is
+            grouped by its stafdb id
+        build_pm_model (bool): If False pm_model is built by create_pm_model
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+        """
+        if len(regional_diagrams) == 0:
+            raise ValueError("Regional model needs at least one region")
+
+        self.region_names: List[str] = list(regional_diagrams)
+
+        self.__region_process_ids: Dict[str, Set[str]] = {}
+        """ Maps the name of a region to the ids of its processes """
+
+        external_inflows: Set[Flow] = set()
+        internal_stafs: Set[Staf] = set()
+        external_outflows: Set[Flow] = set()
+        processes: Dict[str, UmisProcess] = {}
+
+        for region_name, region_diagram in regional_diagrams.items():
+            region_processes = {
+                process.diagram_id: process
+                for process in region_diagram.get_process_stafs_dict()}
+
+            shared_ids = set(region_processes) & set(processes)
+            if len(shared_ids) > 0:
+                raise ValueError(
+                    "Region {} shares processes {} with another region"
+                    .format(region_name, sorted(shared_ids)))
+
+            # Destinations outside the regions may be shared, they have no
+            # outflows so the matrices stay block diagonal
+            for flow in region_diagram.get_external_outflows():
+                dest_process = flow.destination_process
+                region_processes.setdefault(
+                    dest_process.diagram_id, dest_process)
+
+            processes.update(region_processes)
+            self.__region_process_ids[region_name] = set(region_processes)
+
+            external_inflows.update(region_diagram.get_external_inflows())
+            internal_stafs.update(_get_internal_stafs(region_diagram))
+            external_outflows.update(region_diagram.get_external_outflows())
+
+        self.umis_diagram = UmisDiagram(
+            external_inflows, internal_stafs, external_outflows)
+
+        if tc_groups is None:
+            tc_groups = {
+                process_id: process.stafdb_id
+                for process_id, process in processes.items()}
+
+        self.math_model = UmisMathModel(
+            self.umis_diagram.get_external_inflows(),
+            self.umis_diagram.get_process_stafs_dict(),
+            self.umis_diagram.get_external_outflows(),
+            reference_material,
+            reference_time,
+            material_reconc_table,
+            tc_observation_table,
+            build_pm_model=False,
+            tc_groups=tc_groups,
+            **model_kwargs)
+
+        if build_pm_model:
+            self.create_pm_model()
+
+    @property
+    def pm_model(self) -> pm.Model:
+        """ Model of every region, None until create_pm_model is called """
+        return self.math_model.pm_model
+
+    def create_pm_model(self):
+        """ Builds the model of every region """
+        self.math_model.create_pm_model()
+
+    def fit(
+            self,
+            method: str = ADVI_METHOD,
+            **fit_kwargs) -> UmisFitResult:
+        """
+        Fits the posterior of every region, takes the arguments of
+        UmisMathModel.fit
+
+        Returns
+        -------
+        UmisFitResult: Samples of every variable and convergence diagnostics
+        """
+        return self.math_model.fit(method=method, **fit_kwargs)
+
+    def get_nuts_step(self):
+        """ Gets a NUTS step method over pm_model """
+        return self.math_model.get_nuts_step()
+
+    def get_region_process_inds(self, region_name: str) -> np.ndarray:
+        """
+        Gets the index of each process of a region in the matrices of the
+        model, in index order, which select the block of the region
+        """
+        if region_name not in self.__region_process_ids:
+            raise ValueError("Model has no region {}".format(region_name))
+
+        region_process_ids = self.__region_process_ids[region_name]
+
+        return np.array(
+            [self.math_model.get_process_ind(process_id)
+             for process_id in self.math_model.get_process_ids()
+             if process_id in region_process_ids],
+            dtype=np.int64)
+
+    def get_input_inds(self, staf: Staf):
+        """ Gets the process index of the destination of the staf """
+        return self.math_model.get_input_inds(staf)
+
+    def get_staf_inds(self, staf: Staf):
+        """ Gets the indices of a non input staf """
+        return self.math_model.get_staf_inds(staf)
+
+
+def _get_internal_stafs(umis_diagram: UmisDiagram) -> Set[Staf]:
+    """ Gets the internal stocks and flows of a diagram """
+    internal_stafs = set()
+    for process_outputs in umis_diagram.get_process_stafs_dict().values():
+        internal_stafs.update(process_outputs.flows)
+
+        if process_outputs.stock is not None:
+            internal_stafs.add(process_outputs.stock)
+
+    return internal_stafs
+
+
+if __name__ == '__main__':
+    sys.exit(1)
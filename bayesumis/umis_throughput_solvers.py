@@ -0,0 +1,621 @@
+"""
+Solvers for the process throughput equations of the mathematical model
+
+The throughput of every process satisfies (I - TC^T) x = inputs, where TC is
+the transfer coefficient matrix. The dense solver inverts the whole matrix and
+is kept as a reference implementation, the sparse solver factorises only the
+non-zero transfer coefficients of the diagram. The fused solver computes the
+reconciled stafs directly from the same factorisation, in one op with its
+own vector-Jacobian product.
+
+Factorisations are cached by their transfer coefficients, and each cache
+is resized to hold every scenario of a solve, so the gradient of a solve
+evaluated at the same point reuses the factorisations of the forward pass.
+Only the most recently used sparsity patterns keep a cache, so long lived
+processes building many models do not hold every factorisation they made.
+Every solver accepts a leading scenario axis, in which case every
+scenario is solved with its own transfer coefficients and inputs.
+"""
+
+import sys
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import theano
+import theano.tensor as T
+from scipy.sparse.linalg import splu
+from theano.tensor.nlinalg import matrix_inverse
+
+DENSE_SOLVER = 'dense'
+SPARSE_SOLVER = 'sparse'
+FUSED_SOLVER = 'fused'
+
+THROUGHPUT_SOLVERS = (DENSE_SOLVER, SPARSE_SOLVER, FUSED_SOLVER)
+
+MAX_FACTORISATION_PATTERNS = 16
+""" Maximum number of sparsity patterns with a factorisation cache """
+
+
+class FactorisationCache():
+    """
+    Least recently used cache of the sparse LU factorisations of I - TC^T of
+    one sparsity pattern, keyed by the values of the transfer coefficients
+    """
+
+    def __init__(
+            self,
+            num_processes: int,
+            origin_inds: tuple,
+            dest_inds: tuple,
+            max_entries: int = 8):
+        """
+        Args
+        ----
+        num_processes (int): Number of processes in the model
+        origin_inds (tuple(int)): Origin process index of each transfer
+            coefficient
+        dest_inds (tuple(int)): Destination process index of each transfer
+            coefficient
+        max_entries (int): Maximum number of factorisations held, resized
+            by reserve to the number of scenarios of a solve if greater
+        """
+        self.num_processes = num_processes
+        self.max_entries = max_entries
+
+        self.__min_entries = max_entries
+
+        self.__origin_array = np.array(origin_inds, dtype=np.int64)
+        self.__dest_array = np.array(dest_inds, dtype=np.int64)
+
+        self.__factorisations = OrderedDict()
+        """ Maps the bytes of the transfer coefficients to their
+        factorisation, least recent first """
+
+    def reserve(self, n_entries: int):
+        """
+        Resizes the cache to hold n_entries factorisations, so the
+        factorisation of every scenario of a solve is still held when its
+        gradient is evaluated. A solve with fewer scenarios shrinks the cache
+        back, never below the max_entries it was created with
+        """
+        self.max_entries = max(self.__min_entries, n_entries)
+
+        while len(self.__factorisations) > self.max_entries:
+            self.__factorisations.popitem(last=False)
+
+    def factorise(self, tc_values: np.ndarray):
+        """
+        Sparse LU factorisation of I - TC^T, raises RuntimeError if the
+        system is singular
+
+        Args
+        ----
+        tc_values (np.ndarray): Non-zero transfer coefficients
+        """
+        tc_values = np.ascontiguousarray(tc_values, dtype=np.float64)
+        key = tc_values.tobytes()
+
+        factorisation = self.__factorisations.get(key)
+        if factorisation is not None:
+            self.__factorisations.move_to_end(key)
+            return factorisation
+
+        num_processes = self.num_processes
+
+        # TC^T has the transfer coefficient from origin o to destination d at
+        # row d and column o
+        tc_transpose = sp.csc_matrix(
+            (tc_values, (self.__dest_array, self.__origin_array)),
+            shape=(num_processes, num_processes))
+
+        system = sp.identity(num_processes, format='csc') - tc_transpose
+        factorisation = splu(system.tocsc())
+
+        self.__factorisations[key] = factorisation
+        if len(self.__factorisations) > self.max_entries:
+            self.__factorisations.popitem(last=False)
+
+        return factorisation
+
+
+_factorisation_caches: Dict[Tuple[int, tuple, tuple], FactorisationCache] = \
+    OrderedDict()
+""" Maps a number of processes and sparsity pattern to its cache, least
+recent first. The ops look their cache up so they stay picklable """
+
+
+def get_factorisation_cache(
+        num_processes: int,
+        origin_inds: tuple,
+        dest_inds: tuple) -> FactorisationCache:
+    """
+    Gets the factorisation cache of a sparsity pattern, evicting the cache
+    of the least recently used pattern if there are more than
+    MAX_FACTORISATION_PATTERNS
+    """
+    key = (num_processes, origin_inds, dest_inds)
+
+    factorisation_cache = _factorisation_caches.get(key)
+    if factorisation_cache is None:
+        factorisation_cache = FactorisationCache(*key)
+        _factorisation_caches[key] = factorisation_cache
+
+    _factorisation_caches.move_to_end(key)
+    while len(_factorisation_caches) > MAX_FACTORISATION_PATTERNS:
+        _factorisation_caches.popitem(last=False)
+
+    return factorisation_cache
+
+
+def solve_process_throughputs(
+        solver: str,
+        num_processes: int,
+        tc_matrix: T.Variable,
+        tc_values: T.Variable,
+        input_sums: T.Variable,
+        tc_origin_inds: np.ndarray,
+        tc_dest_inds: np.ndarray) -> T.Variable:
+    """
+    Builds the process throughputs of the model with the chosen solver
+
+    Args
+    ----
+    solver (str): One of THROUGHPUT_SOLVERS
+    num_processes (int): Number of processes in the model
+    tc_matrix (T.Variable): num_processes x num_processes transfer coefficient
+        matrix, or one per scenario
+    tc_values (T.Variable): Non-zero transfer coefficients, the ith value is
+        the entry at (tc_origin_inds[i], tc_dest_inds[i]) of tc_matrix, or one
+        vector per scenario
+    input_sums (T.Variable): Total input into each process, or one vector
+        per scenario
+    tc_origin_inds (np.ndarray): Origin process index of each tc value
+    tc_dest_inds (np.ndarray): Destination process index of each tc value
+
+    Returns
+    -------
+    T.Variable: Vector of the throughput of each process, or one vector per
+        scenario
+    """
+    if solver == DENSE_SOLVER:
+        def dense_solve(scenario_tc_matrix, scenario_input_sums):
+            return T.dot(
+                matrix_inverse(T.eye(num_processes) - scenario_tc_matrix.T),
+                scenario_input_sums)
+
+        if tc_matrix.ndim == 2:
+            return dense_solve(tc_matrix, input_sums)
+
+        throughputs, _ = theano.map(
+            dense_solve, sequences=[tc_matrix, input_sums])
+
+        return throughputs
+
+    # The fused solver only fuses the stafs, its throughputs are the sparse
+    # throughputs
+    if solver in (SPARSE_SOLVER, FUSED_SOLVER):
+        sparse_solve = SparseThroughputSolve(
+            num_processes,
+            tuple(int(ind) for ind in tc_origin_inds),
+            tuple(int(ind) for ind in tc_dest_inds))
+
+        return sparse_solve(tc_values, input_sums)
+
+    raise ValueError("Throughput solver must be one of {}, received {}"
+                     .format(THROUGHPUT_SOLVERS, solver))
+
+
+def solve_reconciled_stafs(
+        num_processes: int,
+        tc_values: T.Variable,
+        input_sums: T.Variable,
+        staf_ccs: T.Variable,
+        tc_origin_inds: np.ndarray,
+        tc_dest_inds: np.ndarray) -> T.Variable:
+    """
+    Builds the reconciled stafs of the model with the fused solver, the
+    transfer coefficient times the throughput of its origin divided by the
+    staf concentration coefficient
+
+    Args
+    ----
+    num_processes (int): Number of processes in the model
+    tc_values (T.Variable): Non-zero transfer coefficients, or one vector per
+        scenario
+    input_sums (T.Variable): Total input into each process, or one vector
+        per scenario
+    staf_ccs (T.Variable): num_processes x num_processes staf concentration
+        coefficient matrix, or one per scenario
+    tc_origin_inds (np.ndarray): Origin process index of each tc value
+    tc_dest_inds (np.ndarray): Destination process index of each tc value
+
+    Returns
+    -------
+    T.Variable: num_processes x num_processes reconciled staf matrix, or one
+        per scenario
+    """
+    fused_solve = FusedStafSolve(
+        num_processes,
+        tuple(int(ind) for ind in tc_origin_inds),
+        tuple(int(ind) for ind in tc_dest_inds))
+
+    return fused_solve(tc_values, input_sums, staf_ccs)
+
+
+class SparseThroughputSolve(theano.Op):
+    """
+    Solves (I - TC^T) x = b using a sparse LU factorisation of the non-zero
+    transfer coefficients, so the cost of a solve and of its gradient scales
+    with the number of transfer coefficients rather than num_processes^3
+
+    The inputs are either vectors, or matrices with a leading scenario axis
+    in which case each scenario is factorised and solved separately
+
+    Attributes
+    ----------
+    num_processes (int): Number of processes in the model
+    origin_inds (tuple(int)): Origin process index of each transfer
+        coefficient
+    dest_inds (tuple(int)): Destination process index of each transfer
+        coefficient
+    transpose (bool): If True solves (I - TC^T)^T x = b instead
+    """
+    __props__ = ('num_processes', 'origin_inds', 'dest_inds', 'transpose')
+
+    def __init__(
+            self,
+            num_processes: int,
+            origin_inds: tuple,
+            dest_inds: tuple,
+            transpose: bool = False):
+        """
+        Args
+        ----
+        num_processes (int): Number of processes in the model
+        origin_inds (tuple(int)): Origin process index of each transfer
+            coefficient
+        dest_inds (tuple(int)): Destination process index of each transfer
+            coefficient
+        transpose (bool): If True solves (I - TC^T)^T x = b instead
+        """
+        assert len(origin_inds) == len(dest_inds)
+
+        self.num_processes = num_processes
+        self.origin_inds = origin_inds
+        self.dest_inds = dest_inds
+        self.transpose = transpose
+
+        self.__origin_array = np.array(origin_inds, dtype=np.int64)
+        self.__dest_array = np.array(dest_inds, dtype=np.int64)
+
+    def make_node(self, tc_values, input_sums):
+        tc_values = T.cast(T.as_tensor_variable(tc_values), 'float64')
+        input_sums = T.cast(T.as_tensor_variable(input_sums), 'float64')
+
+        assert input_sums.ndim in (1, 2)
+        assert tc_values.ndim == input_sums.ndim
+
+        throughputs = T.TensorType(
+            'float64', (False,) * input_sums.ndim)()
+
+        return theano.Apply(self, [tc_values, input_sums], [throughputs])
+
+    def perform(self, node, inputs, output_storage):
+        tc_values, input_sums = inputs
+        _reserve_scenarios(self, tc_values)
+
+        if input_sums.ndim == 1:
+            output_storage[0][0] = self.__solve(tc_values, input_sums)
+            return
+
+        throughputs = np.empty_like(input_sums)
+        for scenario in range(input_sums.shape[0]):
+            throughputs[scenario] = self.__solve(
+                tc_values[scenario], input_sums[scenario])
+
+        output_storage[0][0] = throughputs
+
+    def __solve(self, tc_values: np.ndarray, input_sums: np.ndarray) \
+            -> np.ndarray:
+        """
+        Solves the system of a single scenario
+        """
+        factorisation = _factorise(self, tc_values)
+        if factorisation is None:
+            # Singular system, the throughputs are undefined so the sample is
+            # rejected, mirroring the infs of the dense inverse
+            return np.full(self.num_processes, np.nan)
+
+        trans = 'T' if self.transpose else 'N'
+        return factorisation.solve(input_sums, trans=trans)
+
+    def infer_shape(self, node, input_shapes):
+        return [input_shapes[1]]
+
+    def L_op(self, inputs, outputs, output_grads):
+        tc_values, _ = inputs
+        throughputs, = outputs
+        throughputs_grad, = output_grads
+
+        transposed_solve = SparseThroughputSolve(
+            self.num_processes,
+            self.origin_inds,
+            self.dest_inds,
+            not self.transpose)
+
+        input_sums_grad = transposed_solve(tc_values, throughputs_grad)
+
+        # Processes are on the last axis, after any scenario axis
+        axis = throughputs.ndim - 1
+
+        # d(I - TC^T)[d, o] = -dTC[o, d], so only the entries of the
+        # sparsity pattern of TC receive a gradient
+        if self.transpose:
+            tc_values_grad = (
+                T.take(throughputs, self.__dest_array, axis=axis)
+                * T.take(input_sums_grad, self.__origin_array, axis=axis))
+        else:
+            tc_values_grad = (
+                T.take(input_sums_grad, self.__dest_array, axis=axis)
+                * T.take(throughputs, self.__origin_array, axis=axis))
+
+        return [tc_values_grad, input_sums_grad]
+
+
+class FusedStafSolve(theano.Op):
+    """
+    Computes the reconciled stafs TC[o, d] * x[o] / CC[o, d], where
+    (I - TC^T) x = b, from one sparse LU factorisation. Its gradient is the
+    FusedStafSolveGrad op, which reuses the cached factorisation of the
+    forward pass instead of differentiating through the solve and the
+    broadcast multiply and divide
+
+    The inputs are either vectors and a matrix, or have a leading scenario
+    axis in which case each scenario is factorised and solved separately
+
+    Attributes
+    ----------
+    num_processes (int): Number of processes in the model
+    origin_inds (tuple(int)): Origin process index of each transfer
+        coefficient
+    dest_inds (tuple(int)): Destination process index of each transfer
+        coefficient
+    """
+    __props__ = ('num_processes', 'origin_inds', 'dest_inds')
+
+    def __init__(
+            self,
+            num_processes: int,
+            origin_inds: tuple,
+            dest_inds: tuple):
+        """
+        Args
+        ----
+        num_processes (int): Number of processes in the model
+        origin_inds (tuple(int)): Origin process index of each transfer
+            coefficient
+        dest_inds (tuple(int)): Destination process index of each transfer
+            coefficient
+        """
+        assert len(origin_inds) == len(dest_inds)
+
+        self.num_processes = num_processes
+        self.origin_inds = origin_inds
+        self.dest_inds = dest_inds
+
+    def make_node(self, tc_values, input_sums, staf_ccs):
+        tc_values = T.cast(T.as_tensor_variable(tc_values), 'float64')
+        input_sums = T.cast(T.as_tensor_variable(input_sums), 'float64')
+        staf_ccs = T.cast(T.as_tensor_variable(staf_ccs), 'float64')
+
+        assert input_sums.ndim in (1, 2)
+        assert tc_values.ndim == input_sums.ndim
+        assert staf_ccs.ndim == input_sums.ndim + 1
+
+        stafs = T.TensorType('float64', (False,) * staf_ccs.ndim)()
+
+        return theano.Apply(
+            self, [tc_values, input_sums, staf_ccs], [stafs])
+
+    def perform(self, node, inputs, output_storage):
+        _reserve_scenarios(self, inputs[0])
+        output_storage[0][0] = _map_scenarios(self.__solve, inputs)
+
+    def __solve(
+            self,
+            tc_values: np.ndarray,
+            input_sums: np.ndarray,
+            staf_ccs: np.ndarray) -> np.ndarray:
+        """
+        Reconciled stafs of a single scenario
+        """
+        num_processes = self.num_processes
+        stafs = np.zeros((num_processes, num_processes))
+
+        throughputs = _solve_throughputs(self, tc_values, input_sums)
+        if throughputs is None:
+            stafs.fill(np.nan)
+            return stafs
+
+        origin_inds = np.array(self.origin_inds, dtype=np.int64)
+        dest_inds = np.array(self.dest_inds, dtype=np.int64)
+
+        stafs[origin_inds, dest_inds] = (
+            tc_values * throughputs[origin_inds]
+            / staf_ccs[origin_inds, dest_inds])
+
+        return stafs
+
+    def infer_shape(self, node, input_shapes):
+        return [input_shapes[2]]
+
+    def L_op(self, inputs, outputs, output_grads):
+        stafs_grad, = output_grads
+
+        fused_solve_grad = FusedStafSolveGrad(
+            self.num_processes, self.origin_inds, self.dest_inds)
+
+        return fused_solve_grad(*inputs, stafs_grad)
+
+
+class FusedStafSolveGrad(theano.Op):
+    """
+    Vector-Jacobian product of FusedStafSolve, the gradients of its
+    transfer coefficients, input sums and staf concentration coefficients
+    given the gradient of its stafs
+
+    Attributes
+    ----------
+    num_processes (int): Number of processes in the model
+    origin_inds (tuple(int)): Origin process index of each transfer
+        coefficient
+    dest_inds (tuple(int)): Destination process index of each transfer
+        coefficient
+    """
+    __props__ = ('num_processes', 'origin_inds', 'dest_inds')
+
+    def __init__(
+            self,
+            num_processes: int,
+            origin_inds: tuple,
+            dest_inds: tuple):
+        """
+        Args
+        ----
+        num_processes (int): Number of processes in the model
+        origin_inds (tuple(int)): Origin process index of each transfer
+            coefficient
+        dest_inds (tuple(int)): Destination process index of each transfer
+            coefficient
+        """
+        assert len(origin_inds) == len(dest_inds)
+
+        self.num_processes = num_processes
+        self.origin_inds = origin_inds
+        self.dest_inds = dest_inds
+
+    def make_node(self, tc_values, input_sums, staf_ccs, stafs_grad):
+        inputs = [
+            T.cast(T.as_tensor_variable(variable), 'float64')
+            for variable in (tc_values, input_sums, staf_ccs, stafs_grad)]
+
+        outputs = [variable.type() for variable in inputs[:3]]
+
+        return theano.Apply(self, inputs, outputs)
+
+    def perform(self, node, inputs, output_storage):
+        _reserve_scenarios(self, inputs[0])
+        grads = _map_scenarios(self.__vjp, inputs)
+
+        for storage, grad in zip(output_storage, grads):
+            storage[0] = grad
+
+    def __vjp(
+            self,
+            tc_values: np.ndarray,
+            input_sums: np.ndarray,
+            staf_ccs: np.ndarray,
+            stafs_grad: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Gradients of a single scenario
+        """
+        num_processes = self.num_processes
+        staf_ccs_grad = np.zeros((num_processes, num_processes))
+
+        factorisation = _factorise(self, tc_values)
+        if factorisation is None:
+            staf_ccs_grad.fill(np.nan)
+            return (
+                np.full_like(tc_values, np.nan),
+                np.full(num_processes, np.nan),
+                staf_ccs_grad)
+
+        throughputs = factorisation.solve(input_sums)
+
+        origin_inds = np.array(self.origin_inds, dtype=np.int64)
+        dest_inds = np.array(self.dest_inds, dtype=np.int64)
+
+        tc_stafs_grad = stafs_grad[origin_inds, dest_inds]
+        tc_staf_ccs = staf_ccs[origin_inds, dest_inds]
+        origin_throughputs = throughputs[origin_inds]
+
+        # Gradient of the throughput of each origin through its stafs
+        throughputs_grad = np.bincount(
+            origin_inds,
+            weights=tc_values * tc_stafs_grad / tc_staf_ccs,
+            minlength=num_processes)
+
+        input_sums_grad = factorisation.solve(throughputs_grad, trans='T')
+
+        # d(I - TC^T)[d, o] = -dTC[o, d], on top of the direct dependence of
+        # each staf on its transfer coefficient
+        tc_values_grad = (
+            origin_throughputs * tc_stafs_grad / tc_staf_ccs
+            + input_sums_grad[dest_inds] * origin_throughputs)
+
+        staf_ccs_grad[origin_inds, dest_inds] = (
+            -tc_values * origin_throughputs * tc_stafs_grad
+            / tc_staf_ccs ** 2)
+
+        return tc_values_grad, input_sums_grad, staf_ccs_grad
+
+    def infer_shape(self, node, input_shapes):
+        return input_shapes[:3]
+
+
+def _reserve_scenarios(op, tc_values: np.ndarray):
+    """
+    Resizes the factorisation cache of an op to hold every scenario of its
+    transfer coefficients
+    """
+    n_scenarios = 1 if tc_values.ndim == 1 else tc_values.shape[0]
+
+    get_factorisation_cache(
+        op.num_processes,
+        op.origin_inds,
+        op.dest_inds).reserve(n_scenarios)
+
+
+def _factorise(op, tc_values: np.ndarray):
+    """
+    Cached factorisation of the system of an op, None if it is singular
+    """
+    try:
+        return get_factorisation_cache(
+            op.num_processes,
+            op.origin_inds,
+            op.dest_inds).factorise(tc_values)
+    except RuntimeError:
+        return None
+
+
+def _solve_throughputs(op, tc_values: np.ndarray, input_sums: np.ndarray):
+    """ Throughputs of the system of an op, None if it is singular """
+    factorisation = _factorise(op, tc_values)
+    if factorisation is None:
+        return None
+
+    return factorisation.solve(input_sums)
+
+
+def _map_scenarios(solve, inputs: list):
+    """
+    Applies a single scenario solve to inputs with or without a leading
+    scenario axis, stacking each of its outputs if it returns a tuple
+    """
+    if inputs[1].ndim == 1:
+        return solve(*inputs)
+
+    scenario_outputs = [
+        solve(*scenario_inputs) for scenario_inputs in zip(*inputs)]
+
+    if isinstance(scenario_outputs[0], tuple):
+        return tuple(np.stack(output) for output in zip(*scenario_outputs))
+
+    return np.stack(scenario_outputs)
+
+
+if __name__ == '__main__':
+    sys.exit(1)
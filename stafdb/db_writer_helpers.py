@@ -59,7 +59,7 @@ def lognormal_uncertainty_string(mean, standard_deviation):
     standard_deviation = float(standard_deviation)
 
     uncert_dict = {
-        'distribution': 'Logormal',
+        'distribution': 'Lognormal',
         'mean': mean,
         'standard_deviation': standard_deviation,
     }
@@ -36,203 +36,204 @@ def write_data():
 
     unknown_0_300 = uniform_uncertainty_string(0, 500)
 
-    dao.insert_data(
-        quantity=120,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='1',
-        stock_type='Flow',
-        uncertainty_json=norm_120_med
-    )
-
-    dao.insert_data(
-        quantity=110,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='2',
-        stock_type='Flow',
-        uncertainty_json=norm_110_med
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='3',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='4',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=110,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='5',
-        stock_type='Flow',
-        uncertainty_json=norm_110
-    )
-
-    dao.insert_data(
-        quantity=5,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='6',
-        stock_type='Flow',
-        uncertainty_json=norm_5
-    )
-
-    dao.insert_data(
-        quantity=5,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='7',
-        stock_type='Net',
-        uncertainty_json=norm_5
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='8',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=19,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='9',
-        stock_type='Flow',
-        uncertainty_json=norm_19_med
-    )
-
-    dao.insert_data(
-        quantity=4,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='10',
-        stock_type='Flow',
-        uncertainty_json=norm_4_med
-    )
-
-    dao.insert_data(
-        quantity=170,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='11',
-        stock_type='Flow',
-        uncertainty_json=norm_170
-    )
-
-    dao.insert_data(
-        quantity=49,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='12',
-        stock_type='Flow',
-        uncertainty_json=norm_49
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='13',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=43,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='14',
-        stock_type='Net',
-        uncertainty_json=norm_43
-    )
-
-    dao.insert_data(
-        quantity=130,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='15',
-        stock_type='Flow',
-        uncertainty_json=norm_130
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='16',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=23,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='17',
-        stock_type='Flow',
-        uncertainty_json=norm_23_med
-    )
-
-    dao.insert_data(
-        quantity=68,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='18',
-        stock_type='Flow',
-        uncertainty_json=norm_68_med
-    )
-
-    dao.insert_data(
-        quantity=22,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='19',
-        stock_type='Flow',
-        uncertainty_json=norm_22
-    )
-
-    dao.insert_data(
-        quantity=6,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='20',
-        stock_type='Flow',
-        uncertainty_json=norm_6
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='21',
-        stock_type='Flow',
-        uncertainty_json=unknown_0_300
-    )
-
-    dao.insert_data(
-        quantity=150,
-        unit='Gg/yr',
-        material_id='1',
-        staf_id='22',
-        stock_type='Net',
-        uncertainty_json=unknown_0_300
-    )
+    with dao.batch():
+        dao.insert_data(
+            quantity=120,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='1',
+            stock_type='Flow',
+            uncertainty_json=norm_120_med
+        )
+
+        dao.insert_data(
+            quantity=110,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='2',
+            stock_type='Flow',
+            uncertainty_json=norm_110_med
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='3',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='4',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=110,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='5',
+            stock_type='Flow',
+            uncertainty_json=norm_110
+        )
+
+        dao.insert_data(
+            quantity=5,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='6',
+            stock_type='Flow',
+            uncertainty_json=norm_5
+        )
+
+        dao.insert_data(
+            quantity=5,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='7',
+            stock_type='Net',
+            uncertainty_json=norm_5
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='8',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=19,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='9',
+            stock_type='Flow',
+            uncertainty_json=norm_19_med
+        )
+
+        dao.insert_data(
+            quantity=4,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='10',
+            stock_type='Flow',
+            uncertainty_json=norm_4_med
+        )
+
+        dao.insert_data(
+            quantity=170,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='11',
+            stock_type='Flow',
+            uncertainty_json=norm_170
+        )
+
+        dao.insert_data(
+            quantity=49,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='12',
+            stock_type='Flow',
+            uncertainty_json=norm_49
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='13',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=43,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='14',
+            stock_type='Net',
+            uncertainty_json=norm_43
+        )
+
+        dao.insert_data(
+            quantity=130,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='15',
+            stock_type='Flow',
+            uncertainty_json=norm_130
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='16',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=23,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='17',
+            stock_type='Flow',
+            uncertainty_json=norm_23_med
+        )
+
+        dao.insert_data(
+            quantity=68,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='18',
+            stock_type='Flow',
+            uncertainty_json=norm_68_med
+        )
+
+        dao.insert_data(
+            quantity=22,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='19',
+            stock_type='Flow',
+            uncertainty_json=norm_22
+        )
+
+        dao.insert_data(
+            quantity=6,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='20',
+            stock_type='Flow',
+            uncertainty_json=norm_6
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='21',
+            stock_type='Flow',
+            uncertainty_json=unknown_0_300
+        )
+
+        dao.insert_data(
+            quantity=150,
+            unit='Gg/yr',
+            material_id='1',
+            staf_id='22',
+            stock_type='Net',
+            uncertainty_json=unknown_0_300
+        )
 
 
 write_data()
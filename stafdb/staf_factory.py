@@ -1,174 +1,285 @@
 """ Factory class to construct a stock or flow object from staf_id """
 
 import json
-from typing import List
+from functools import partial
+from typing import Dict, List, Tuple
+
+import pandas as pd
 
 from bayesumis.umis_data_models import (
     Flow,
-    LognormalUncertainty,
+    LazyFlow,
+    LazyMaterialValues,
+    LazyStock,
+    LazyStockValue,
+    LazyValue,
     Material,
-    NormalUncertainty,
     Space,
     StafReference,
     Stock,
     StockValue,
     Timeframe,
     UmisProcess,
-    UniformUncertainty,
     Value
 )
 
 from stafdb.stafdb_access_objects import (
+    ID_COLUMN,
     DataAccessObject,
     MaterialAccessObject,
     ProcessAccessObject,
     ReferenceSpaceAccessObject,
     ReferenceTimeframeAccessObject,
     StafAccessObject)
+from stafdb.stafdb_columnar import (
+    UNCERTAINTY_CODE_COLUMN,
+    ColumnarDataAccessObject,
+    ColumnarMaterialAccessObject,
+    ColumnarProcessAccessObject,
+    ColumnarReferenceSpaceAccessObject,
+    ColumnarReferenceTimeframeAccessObject,
+    ColumnarStafAccessObject,
+    UNCERTAINTY_PARAM_COLUMNS,
+    uncertainty_from_record)
+from stafdb.stafdb_intern_registry import InternRegistry
+from stafdb.stafdb_session import StafdbSession
+from stafdb.stafdb_sqlite import (
+    SqliteDataAccessObject,
+    SqliteMaterialAccessObject,
+    SqliteProcessAccessObject,
+    SqliteReferenceSpaceAccessObject,
+    SqliteReferenceTimeframeAccessObject,
+    SqliteStafAccessObject)
+from stafdb.stafdb_uncertainty_decoder import (
+    DecodedUncertainties,
+    decode_uncertainty_column,
+    uncertainty_from_dict)
+
+
+CSV_BACKEND = 'csv'
+COLUMNAR_BACKEND = 'columnar'
+SQLITE_BACKEND = 'sqlite'
+
+BACKENDS = (CSV_BACKEND, COLUMNAR_BACKEND, SQLITE_BACKEND)
 
 
 class StafFactory():
 
-    def __init__(self, db_folder):
-        self.dao = DataAccessObject(db_folder)
-        self.mao = MaterialAccessObject(db_folder)
-        self.pao = ProcessAccessObject(db_folder)
-        self.rsao = ReferenceSpaceAccessObject(db_folder)
-        self.tao = ReferenceTimeframeAccessObject(db_folder)
-        self.stao = StafAccessObject(db_folder)
+    def __init__(
+            self,
+            db_folder,
+            session: StafdbSession = None,
+            registry: InternRegistry = None,
+            backend: str = CSV_BACKEND):
+        """
+        Args
+        ----
+        db_folder (str): Folder of the stafdb csvs
+        session (StafdbSession): Session holding the loaded csv tables, a
+            new one if None. Its tables are refreshed at the start of every
+            build, so changes made to the csvs on disk are always seen
+        registry (InternRegistry): Registry of the materials, spaces,
+            timeframes and processes built, a new one if None
+        backend (str): One of BACKENDS, 'columnar' reads the tables written
+            by stafdb_columnar.convert_to_columnar, 'sqlite' the database
+            written by stafdb_sqlite.import_csvs_to_sqlite
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Backend must be one of {}, received {}"
+                             .format(BACKENDS, backend))
+
+        if session is None:
+            session = StafdbSession()
+
+        if registry is None:
+            registry = InternRegistry()
+
+        self.session = session
+        self.registry = registry
+
+        self.backend = backend
+
+        if backend == COLUMNAR_BACKEND:
+            self.dao = ColumnarDataAccessObject(db_folder)
+            self.mao = ColumnarMaterialAccessObject(db_folder)
+            self.pao = ColumnarProcessAccessObject(db_folder)
+            self.rsao = ColumnarReferenceSpaceAccessObject(db_folder)
+            self.tao = ColumnarReferenceTimeframeAccessObject(db_folder)
+            self.stao = ColumnarStafAccessObject(db_folder)
+        elif backend == SQLITE_BACKEND:
+            self.dao = SqliteDataAccessObject(db_folder)
+            self.mao = SqliteMaterialAccessObject(db_folder)
+            self.pao = SqliteProcessAccessObject(db_folder)
+            self.rsao = SqliteReferenceSpaceAccessObject(db_folder)
+            self.tao = SqliteReferenceTimeframeAccessObject(db_folder)
+            self.stao = SqliteStafAccessObject(db_folder)
+        else:
+            self.dao = DataAccessObject(db_folder, session)
+            self.mao = MaterialAccessObject(db_folder, session)
+            self.pao = ProcessAccessObject(db_folder, session)
+            self.rsao = ReferenceSpaceAccessObject(db_folder, session)
+            self.tao = ReferenceTimeframeAccessObject(db_folder, session)
+            self.stao = StafAccessObject(db_folder, session)
+
+    def refresh(self):
+        """
+        Reloads the tables whose csvs changed on disk, dropping the entities
+        built from the old tables if any changed. Called by every build
+        """
+        if len(self.session.refresh()) > 0:
+            self.registry.clear()
 
     def build_staf(self, staf_id: str):
-        staf_record = self.stao.get_staf_by_id(staf_id)
-
-        staf_name = staf_record['name']
-
-        reference_material_id = staf_record['material_id_reference_material']
-        reference_timeframe_id = staf_record['reference_timeframe']
-
-        staf_reference = self.build_staf_reference(
-            reference_material_id, reference_timeframe_id)
-
-        stock_or_flow = staf_record['is_stock_or_is_flow']
-
-        process_id_origin = staf_record['process_id_origin']
-        reference_space_id_origin = staf_record['reference_space_id_origin']
+        return self.build_stafs([staf_id])[0]
 
-        origin_process = self.build_process(
-            process_id_origin, reference_space_id_origin)
-
-        process_id_destination = staf_record['process_id_destination']
-        
-        reference_space_id_destination = \
-            staf_record['reference_space_id_destination']
-
-        destination_process = self.build_process(
-            process_id_destination, reference_space_id_destination)
-
-        if stock_or_flow == 'Flow':
-            material_value_dict = \
-                self.build_material_value_dict(staf_id)
+    def build_stafs(
+            self,
+            staf_ids: List[str],
+            lazy: bool = False,
+            prefetch_reference: bool = True):
+        """
+        Builds the stafs of many staf ids, resolving their records with one
+        merge per referenced table instead of lookups per staf. Processes,
+        spaces, materials and timeframes referenced by several stafs are
+        built once and shared through the registry
+
+        Args
+        ----
+        staf_ids (list(str)): Stafdb ids of the stafs
+        lazy (bool): Builds LazyFlows and LazyStocks, whose material values
+            are looked up by staf id when first asked for
+        prefetch_reference (bool): For lazy stafs, builds the value of the
+            reference material of each staf up front
+
+        Returns
+        -------
+        list(Staf): Stock or flow of each staf id, in the order of staf_ids
+        """
+        staf_ids = [str(staf_id) for staf_id in staf_ids]
+        unique_staf_ids = list(dict.fromkeys(staf_ids))
+
+        if len(unique_staf_ids) == 0:
+            return []
+
+        self.refresh()
+
+        staf_records = self.__get_staf_records(unique_staf_ids)
+
+        if not lazy:
+            data_records, uncertainties = self.__get_data_records(
+                unique_staf_ids)
+        elif prefetch_reference:
+            data_records, uncertainties = self.__get_data_records(
+                unique_staf_ids,
+                {int(staf_id): staf_record['material_id_reference_material']
+                 for staf_id, staf_record
+                 in zip(unique_staf_ids, staf_records)})
+        else:
+            data_records, uncertainties = {}, None
 
-            flow = Flow(
+        stafs = {}
+        for staf_id, staf_record in zip(unique_staf_ids, staf_records):
+            stafs[staf_id] = self.__create_staf(
                 staf_id,
-                staf_name,
-                staf_reference,
-                origin_process,
-                destination_process,
-                material_value_dict)
+                staf_record,
+                data_records.get(int(staf_id), []),
+                uncertainties,
+                lazy,
+                lazy and prefetch_reference)
 
-            return flow
-        else:
-            if stock_or_flow == 'Stock':
-                material_stock_value_dict = \
-                    self.build_material_stock_value_dict(staf_id)
-
-                stock = Stock(
-                    staf_id,
-                    staf_name,
-                    staf_reference,
-                    origin_process,
-                    destination_process,
-                    material_stock_value_dict)
-
-                return stock
-            else:
-                raise ValueError("stock_or_flow value must be either 'Stock'"
-                                 + "or 'Flow', was {} instead"
-                                 .format(stock_or_flow))
+        return [stafs[staf_id] for staf_id in staf_ids]
 
-    def build_stafs(self, staf_ids: List[str]):
-
-        stafs = [self.build_staf(staf_id) for staf_id in staf_ids]
-        return stafs
+    def find_stafs(
+            self,
+            space_id: str = None,
+            timeframe_id: str = None,
+            material_id: str = None,
+            build: bool = True) -> list:
+        """
+        Finds the stafs with an origin space, timeframe and reference
+        material in one indexed query
+
+        Args
+        ----
+        space_id (str): Stafdb id of the origin reference space, None for any
+        timeframe_id (str): Stafdb id of the reference timeframe, None for
+            any
+        material_id (str): Stafdb id of the reference material, None for any
+        build (bool): Whether to build the stafs or only return their ids
+
+        Returns
+        -------
+        list: Stock or flow of each staf found if build, otherwise its id
+        """
+        self.refresh()
+
+        staf_ids = self.stao.find_staf_ids(
+            space_id, timeframe_id, material_id)
+
+        if not build:
+            return staf_ids
+
+        return self.build_stafs(staf_ids)
 
     def build_material(self, material_id: str):
-        material_record = self.mao.get_material_by_id(material_id)
+        self.refresh()
 
-        code = material_record['code']
-        name = material_record['name']
-        parent_name = material_record['material_id_parent']
-        is_separator = bool(material_record['is_separator'])
-
-        material = Material(
-            str(material_id),
-            code,
-            name,
-            parent_name,
-            is_separator)
-
-        return material
+        return self.registry.intern(
+            (Material, str(material_id)),
+            lambda: self.__create_material(
+                material_id, self.mao.get_material_by_id(material_id)))
 
     def build_process(self, process_id: str, space_id: str):
+        self.refresh()
+
         space = self.build_space(space_id)
-        
-        process_record = self.pao.get_process_by_id(process_id)
-        code = process_record['code']
-        name = process_record['name']
-        is_separator = bool(process_record['is_separator'])
-        parent_name = process_record['process_id_parent']
-        process_type = process_record['process_type']
-
-        process = UmisProcess(
-            str(process_id),
-            code,
-            name,
-            space,
-            is_separator,
-            parent_name,
-            process_type)
 
-        return process
+        return self.registry.intern(
+            (UmisProcess, str(process_id), str(space_id)),
+            lambda: self.__create_process(
+                process_id, space, self.pao.get_process_by_id(process_id)))
 
     def build_space(self, space_id: str):
-        space_record = self.rsao.get_space_by_id(space_id)
+        self.refresh()
 
-        space_name = space_record['name']
-        space = Space(str(space_id), space_name)
-        return space
+        return self.registry.intern(
+            (Space, str(space_id)),
+            lambda: self.__create_space(
+                space_id, self.rsao.get_space_by_id(space_id)))
 
     def build_material_stock_value_dict(self, staf_id: str):
+        self.refresh()
+
         data_records = self.dao.get_data_by_stafid(staf_id)
+        uncertainties = self.__decode_uncertainties(
+            pd.DataFrame(data_records))
         material_stock_value_dict = {}
 
-        for data_record in data_records:
+        for row_ind, data_record in enumerate(data_records):
             material_id = data_record['material_id']
             material = self.build_material(material_id)
 
-            stock_value = self.build_stock_value_from_data_record(data_record)
+            stock_value = self.__create_lazy_value(
+                data_record, uncertainties, row_ind, 'Stock')
 
             material_stock_value_dict[material] = stock_value
 
         return material_stock_value_dict
 
     def build_material_value_dict(self, staf_id: str):
+        self.refresh()
+
         data_records = self.dao.get_data_by_stafid(staf_id)
+        uncertainties = self.__decode_uncertainties(
+            pd.DataFrame(data_records))
         material_values_dict = {}
 
-        for data_record in data_records:
+        for row_ind, data_record in enumerate(data_records):
             material_id = data_record['material_id']
             material = self.build_material(material_id)
 
-            value = self.build_value_from_data_record(data_record)
+            value = self.__create_lazy_value(
+                data_record, uncertainties, row_ind, 'Flow')
 
             material_values_dict[material] = value
 
@@ -186,43 +297,36 @@ class StafFactory():
         return staf_reference
 
     def build_timeframe(self, timeframe_id):
-        timeframe_record = self.tao.get_timeframe_by_id(timeframe_id)
+        self.refresh()
 
-        start_time = int(timeframe_record['timeframe_start'])
-        end_time = int(timeframe_record['timeframe_end'])
+        return self.registry.intern(
+            (Timeframe, str(timeframe_id)),
+            lambda: self.__create_timeframe(
+                timeframe_id, self.tao.get_timeframe_by_id(timeframe_id)))
 
-        timeframe = Timeframe(str(timeframe_id), start_time, end_time)
-        return timeframe
+    def build_uncertainty_from_data_record(self, data_record):
+        """
+        Builds the uncertainty of a data record, from its uncertainty json or
+        from its split uncertainty columns if it comes from a columnar table
+        """
+        if UNCERTAINTY_CODE_COLUMN in data_record:
+            return uncertainty_from_record(data_record)
+
+        return self.build_uncertainty_from_string(
+            data_record['uncertainty_json'])
 
     def build_uncertainty_from_string(self, uncertainty_string):
         uncertainty_dict = json.loads(uncertainty_string)
-        if uncertainty_dict['distribution'] == 'Uniform':
-            lower = float(uncertainty_dict['lower'])
-            upper = float(uncertainty_dict['upper'])
-
-            return UniformUncertainty(lower, upper)
+        return self.build_uncertainty_from_dict(uncertainty_dict)
 
-        if uncertainty_dict['distribution'] == 'Normal':
-            mean = float(uncertainty_dict['mean'])
-            standard_deviation = float(uncertainty_dict['standard_deviation'])
+    def build_uncertainty_from_dict(self, uncertainty_dict):
+        return uncertainty_from_dict(uncertainty_dict)
 
-            return NormalUncertainty(mean, standard_deviation)
-
-        if uncertainty_dict['distribution'] == 'Lognormal':
-            mean = float(uncertainty_dict['mean'])
-            standard_deviation = float(uncertainty_dict['standard_deviation'])
-
-            return LognormalUncertainty(mean, standard_deviation)
-
-        raise ValueError("Uncertainty distribution: {} is unknown"
-                         .format(uncertainty_dict['distribution']))
-    
     def build_value_from_data_record(self, data_record):
         stafdb_id = data_record['datum_id']
         quantity = float(data_record['quantity'])
 
-        uncertainty_string = data_record['uncertainty_json']
-        uncertainty = self.build_uncertainty_from_string(uncertainty_string)
+        uncertainty = self.build_uncertainty_from_data_record(data_record)
 
         unit = data_record['unit']
 
@@ -238,8 +342,7 @@ class StafFactory():
         stafdb_id = data_record['datum_id']
         quantity = float(data_record['quantity'])
 
-        uncertainty_string = data_record['uncertainty_json']
-        uncertainty = self.build_uncertainty_from_string(uncertainty_string)
+        uncertainty = self.build_uncertainty_from_data_record(data_record)
 
         unit = data_record['unit']
 
@@ -254,3 +357,312 @@ class StafFactory():
 
         return stock_value
 
+    @staticmethod
+    def __get_id_rows(access_object, ids, prefix: str) -> pd.DataFrame:
+        """
+        Gets the rows of an access object with stafdb ids, with their columns
+        prefixed and a prefixed id column holding the stafdb id of each row
+        """
+        ids = pd.Series(ids).dropna().unique()
+
+        return access_object.get_rows_by_ids(ids).add_prefix(prefix)
+
+    def __get_staf_records(self, staf_ids: List[str]) -> List[dict]:
+        """
+        Gets the record of each staf merged with the records of its
+        processes, spaces, timeframe and reference material, reading only
+        the rows they reference
+        """
+        staf_rows = self.stao.get_rows_by_ids(
+            [int(staf_id) for staf_id in staf_ids])
+
+        if len(staf_rows) < len(staf_ids):
+            raise IndexError("Staf ids {} are not all in the staf table"
+                             .format(staf_ids))
+
+        stafs = pd.DataFrame(
+            {ID_COLUMN: [int(staf_id) for staf_id in staf_ids]}).merge(
+                staf_rows, how='left', on=ID_COLUMN)
+
+        for access_object, id_column, prefix in [
+                (self.pao, 'process_id_origin', 'origin_process_'),
+                (self.pao, 'process_id_destination', 'dest_process_'),
+                (self.rsao, 'reference_space_id_origin', 'origin_space_'),
+                (self.rsao, 'reference_space_id_destination', 'dest_space_'),
+                (self.tao, 'reference_timeframe', 'timeframe_'),
+                (self.mao, 'material_id_reference_material', 'material_')]:
+
+            stafs = stafs.merge(
+                self.__get_id_rows(access_object, stafs[id_column], prefix),
+                how='left',
+                left_on=id_column,
+                right_on=prefix + ID_COLUMN)
+
+            missing = stafs[prefix + ID_COLUMN].isna()
+            if missing.any():
+                raise ValueError("Stafs reference {} ids {} that are unknown"
+                                 .format(id_column,
+                                         list(stafs.loc[missing, id_column])))
+
+        return stafs.to_dict('records')
+
+    def __get_data_records(
+            self,
+            staf_ids: List[str],
+            staf_materials: Dict[int, int] = None) \
+            -> Tuple[Dict[int, List[dict]], DecodedUncertainties]:
+        """
+        Gets the data records of the stafs merged with the records of their
+        materials, keyed by staf id, reading only the rows of the stafs. If
+        staf_materials maps each staf id to a material id, only the records
+        of that material are kept
+
+        The uncertainties of the records are decoded together, each record
+        holds its row of them in 'uncertainty_row'
+        """
+        data = self.dao.get_rows_by_values(
+            'staf_id',
+            [int(staf_id) for staf_id in staf_ids],
+            [column for column in self.dao.columns if column != 'name'])
+        data = data.rename(columns={ID_COLUMN: 'datum_id'})
+
+        if staf_materials is not None:
+            data = data.loc[
+                data['material_id'] == data['staf_id'].map(staf_materials)]
+
+        uncertainties = self.__decode_uncertainties(data)
+        data = data.assign(uncertainty_row=range(len(data)))
+
+        data = data.merge(
+            self.__get_id_rows(
+                self.mao, data['material_id'], 'data_material_'),
+            how='left',
+            left_on='material_id',
+            right_on='data_material_' + ID_COLUMN)
+
+        data_records = {}
+        for data_record in data.to_dict('records'):
+            data_record['datum_id'] = str(data_record['datum_id'])
+            data_records.setdefault(
+                int(data_record['staf_id']), []).append(data_record)
+
+        return data_records, uncertainties
+
+    @staticmethod
+    def __decode_uncertainties(data: pd.DataFrame) -> DecodedUncertainties:
+        """
+        Decodes the uncertainties of data rows, from their uncertainty json
+        or from their split uncertainty columns if they come from a columnar
+        table. Uncertainty objects are only built when indexed
+        """
+        if len(data) == 0 or 'uncertainty_json' in data.columns:
+            return decode_uncertainty_column(
+                data.get('uncertainty_json', []))
+
+        return DecodedUncertainties(
+            data[UNCERTAINTY_CODE_COLUMN].to_numpy(),
+            {param: data[column].to_numpy(dtype=float)
+             for param, column in UNCERTAINTY_PARAM_COLUMNS.items()})
+
+    @staticmethod
+    def __create_lazy_value(
+            data_record: dict,
+            uncertainties: DecodedUncertainties,
+            row_ind: int,
+            stock_or_flow: str) -> LazyValue:
+        """
+        Creates the value of a data record, whose uncertainty is built from
+        its row of uncertainties when first read
+        """
+        if stock_or_flow == 'Flow':
+            return LazyValue(
+                str(data_record['datum_id']),
+                data_record['quantity'],
+                uncertainties,
+                row_ind,
+                data_record['unit'])
+
+        return LazyStockValue(
+            str(data_record['datum_id']),
+            data_record['quantity'],
+            uncertainties,
+            row_ind,
+            data_record['unit'],
+            data_record['stock_type'])
+
+    def __create_staf(
+            self,
+            staf_id: str,
+            staf_record: dict,
+            data_records: List[dict],
+            uncertainties: DecodedUncertainties,
+            lazy: bool = False,
+            prefetch_reference: bool = False):
+        """
+        Creates a staf from its merged records, taking the entities it
+        references from the registry or adding them to it. A lazy staf gets
+        the values of data_records as its prefetched values. The uncertainty
+        of each value is built from uncertainties when first read
+        """
+        material = self.__intern_material(
+            staf_record['material_id_reference_material'],
+            staf_record,
+            'material_')
+
+        timeframe_id = staf_record['reference_timeframe']
+        timeframe = self.registry.intern(
+            (Timeframe, str(timeframe_id)),
+            lambda: self.__create_timeframe(
+                timeframe_id, staf_record, 'timeframe_'))
+
+        staf_reference = StafReference(timeframe, material)
+
+        origin_process = self.__intern_process(
+            staf_record['process_id_origin'],
+            staf_record['reference_space_id_origin'],
+            staf_record,
+            'origin_process_',
+            'origin_space_')
+
+        destination_process = self.__intern_process(
+            staf_record['process_id_destination'],
+            staf_record['reference_space_id_destination'],
+            staf_record,
+            'dest_process_',
+            'dest_space_')
+
+        stock_or_flow = staf_record['is_stock_or_is_flow']
+        if stock_or_flow not in ('Flow', 'Stock'):
+            raise ValueError("stock_or_flow value must be either 'Stock'"
+                             + "or 'Flow', was {} instead"
+                             .format(stock_or_flow))
+
+        material_values_dict = {}
+        for data_record in data_records:
+            data_material = self.__intern_material(
+                data_record['material_id'],
+                data_record,
+                'data_material_')
+
+            value = self.__create_lazy_value(
+                data_record,
+                uncertainties,
+                data_record['uncertainty_row'],
+                stock_or_flow)
+
+            material_values_dict[data_material] = value
+
+        if lazy:
+            if prefetch_reference:
+                material_values_dict.setdefault(material, None)
+
+            if stock_or_flow == 'Flow':
+                loader = partial(self.build_material_value_dict, staf_id)
+                lazy_staf_class = LazyFlow
+            else:
+                loader = partial(
+                    self.build_material_stock_value_dict, staf_id)
+                lazy_staf_class = LazyStock
+
+            return lazy_staf_class(
+                staf_id,
+                staf_record['name'],
+                staf_reference,
+                origin_process,
+                destination_process,
+                LazyMaterialValues(loader, material_values_dict))
+
+        if stock_or_flow == 'Flow':
+            return Flow(
+                staf_id,
+                staf_record['name'],
+                staf_reference,
+                origin_process,
+                destination_process,
+                material_values_dict)
+
+        return Stock(
+            staf_id,
+            staf_record['name'],
+            staf_reference,
+            origin_process,
+            destination_process,
+            material_values_dict)
+
+    def __intern_material(
+            self,
+            material_id,
+            record: dict,
+            prefix: str) -> Material:
+        """ Gets a material, creating it from a merged record if needed """
+        return self.registry.intern(
+            (Material, str(material_id)),
+            lambda: self.__create_material(material_id, record, prefix))
+
+    def __intern_process(
+            self,
+            process_id,
+            space_id,
+            record: dict,
+            process_prefix: str,
+            space_prefix: str) -> UmisProcess:
+        """
+        Gets a process and its space, creating them from a merged record if
+        needed
+        """
+        space = self.registry.intern(
+            (Space, str(space_id)),
+            lambda: self.__create_space(space_id, record, space_prefix))
+
+        return self.registry.intern(
+            (UmisProcess, str(process_id), str(space_id)),
+            lambda: self.__create_process(
+                process_id, space, record, process_prefix))
+
+    @staticmethod
+    def __create_material(
+            material_id,
+            record: dict,
+            prefix: str = '') -> Material:
+        """ Creates a material from the, optionally prefixed, columns """
+        return Material(
+            str(material_id),
+            record[prefix + 'code'],
+            record[prefix + 'name'],
+            record[prefix + 'material_id_parent'],
+            bool(record[prefix + 'is_separator']))
+
+    @staticmethod
+    def __create_timeframe(
+            timeframe_id,
+            record: dict,
+            prefix: str = '') -> Timeframe:
+        """ Creates a timeframe from the, optionally prefixed, columns """
+        return Timeframe(
+            str(timeframe_id),
+            int(record[prefix + 'timeframe_start']),
+            int(record[prefix + 'timeframe_end']))
+
+    @staticmethod
+    def __create_space(
+            space_id,
+            record: dict,
+            prefix: str = '') -> Space:
+        """ Creates a space from the, optionally prefixed, columns """
+        return Space(str(space_id), record[prefix + 'name'])
+
+    @staticmethod
+    def __create_process(
+            process_id,
+            space: Space,
+            record: dict,
+            prefix: str = '') -> UmisProcess:
+        """ Creates a process from the, optionally prefixed, columns """
+        return UmisProcess(
+            str(process_id),
+            record[prefix + 'code'],
+            record[prefix + 'name'],
+            space,
+            bool(record[prefix + 'is_separator']),
+            record[prefix + 'process_id_parent'],
+            record[prefix + 'process_type'])
@@ -1,6 +1,12 @@
 """ Classes to access the prototype stafdb, write and read data from it """
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterable, List
 
+import numpy as np
 import pandas as pd
 
 # import db_writer_helpers as db_helpers
@@ -12,6 +18,15 @@ import pandas as pd
 PATH_TO_MODULE = Path(
     'stafdb')
 
+STAF_QUERY_COLUMNS = (
+    'reference_space_id_origin',
+    'reference_timeframe',
+    'material_id_reference_material')
+""" Columns of the staf table indexed together for finding stafs """
+
+ID_COLUMN = 'id'
+""" Column holding the stafdb id of each row fetched by id or value """
+
 
 # PATH_TO_CSVS = Path(
 #     'csvs')
@@ -23,13 +38,93 @@ class StafdbAccessObject():
             self,
             db_folder,
             columns,
-            table_path):
+            table_path,
+            session=None):
 
         self.columns = columns
         self.table_path = \
             PATH_TO_MODULE.joinpath(db_folder).joinpath(table_path)
+        self.session = session
+
+        self._pending_rows = None
+        """ Rows inserted in the open batch, None outside of a batch """
+
+        self._batch_row_count = 0
+        """ Number of rows in the table when the open batch started """
+
+    def get_table(self) -> pd.DataFrame:
+        """
+        Gets the whole table, from the session if there is one. A table from
+        the session is shared and must not be modified in place
+        """
+        return self._load_table()
+
+    def get_rows_by_ids(
+            self,
+            row_ids: Iterable[int],
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows with stafdb ids, ids not in the table are skipped
+
+        Args
+        ----
+        row_ids (iterable(int)): Stafdb ids of the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        table = self._load_table()
+
+        row_inds = np.unique(np.asarray(list(row_ids), dtype=int)) - 1
+        row_inds = row_inds[(row_inds >= 0) & (row_inds < len(table))]
+
+        return self._get_rows(table, row_inds, columns)
+
+    def get_rows_by_values(
+            self,
+            column: str,
+            values: Iterable,
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows holding one of values in a column
+
+        Args
+        ----
+        column (str): Column the rows are looked up by
+        values (iterable): Values of the column in the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        table = self._load_table()
+
+        row_inds = np.flatnonzero(table[column].isin(list(values)))
+
+        return self._get_rows(table, row_inds, columns)
+
+    @staticmethod
+    def _get_rows(
+            table: pd.DataFrame,
+            row_inds: np.ndarray,
+            columns: List[str] = None) -> pd.DataFrame:
+        """ Copies rows of a table, with their id in ID_COLUMN """
+        if columns is None:
+            columns = list(table.columns)
+
+        rows = table.iloc[row_inds][columns].reset_index(drop=True)
+        rows[ID_COLUMN] = row_inds + 1
+
+        return rows
 
     def _load_table(self):
+        if self.session is not None:
+            return self.session.get_table(self.table_path)
 
         df = pd.read_csv(self.table_path)
         return df
@@ -37,6 +132,74 @@ class StafdbAccessObject():
     def _write_table(self, table: pd.DataFrame):
         table.to_csv(self.table_path, index=False)
 
+        if self.session is not None:
+            self.session.invalidate(self.table_path)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context in which inserts are buffered and written to the table in
+        one append when it exits. The append is made to a copy of the table
+        that replaces it by rename, so a failure never leaves a partly
+        written table. Inserts made in the context are discarded if it
+        exits with an exception. Batches opened in a batch join it
+
+        Yields
+        ------
+        StafdbAccessObject: This access object
+        """
+        if self._pending_rows is not None:
+            yield self
+            return
+
+        self._batch_row_count = len(self._load_table())
+        self._pending_rows = []
+        try:
+            yield self
+            self._commit_rows(self._pending_rows)
+        finally:
+            self._pending_rows = None
+
+    def _insert_row(self, row_params: list) -> str:
+        """
+        Inserts a row, in the open batch if there is one or else on its own
+
+        Returns
+        -------
+        str: Stafdb id of the row
+        """
+        if self._pending_rows is None:
+            with self.batch():
+                return self._insert_row(row_params)
+
+        self._pending_rows.append(row_params)
+
+        return str(self._batch_row_count + len(self._pending_rows))
+
+    def _commit_rows(self, rows: list):
+        """ Appends rows to a copy of the table and renames it over it """
+        if len(rows) == 0:
+            return
+
+        table_dir = os.path.dirname(self.table_path)
+        fd, tmp_path = tempfile.mkstemp(dir=table_dir, suffix='.csv.tmp')
+        os.close(fd)
+        try:
+            # copy2 also copies the permissions, mkstemp makes the copy
+            # readable by its owner only
+            shutil.copy2(self.table_path, tmp_path)
+
+            new_rows = pd.DataFrame(rows, columns=self.columns)
+            new_rows.to_csv(tmp_path, mode='a', header=False, index=False)
+
+            os.replace(tmp_path, self.table_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self.session is not None:
+            self.session.invalidate(self.table_path)
+
     def _reset_table(self):
         new_table = pd.DataFrame([], columns=self.columns)
         self._write_table(new_table)
@@ -46,13 +209,19 @@ class StafdbAccessObject():
         row_df: pd.DataFrame = table.iloc[row_id, :]
         return row_df.to_dict()
 
+    def _get_record_by_id(self, row_id: str):
+        if self.session is not None:
+            return self.session.get_record(self.table_path, row_id)
+
+        return self._get_by_id(row_id, self._load_table())
+
 
 class StafAccessObject(StafdbAccessObject):
     """
     Accesses stafdb_staf.csv, offers operations over it
     """
     
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'name',
             'is_stock_or_is_flow',
@@ -66,7 +235,7 @@ class StafAccessObject(StafdbAccessObject):
         table_path = 'stafdb_staf.csv'
 
         super(StafAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         return super(StafAccessObject, self)._load_table()
@@ -75,8 +244,50 @@ class StafAccessObject(StafdbAccessObject):
         return super(StafAccessObject, self)._write_table(table)
 
     def get_staf_by_id(self, val_id: str):
-        table = self.__load_table()
-        return super(StafAccessObject, self)._get_by_id(val_id, table)
+        return super(
+            StafAccessObject, self)._get_record_by_id(val_id)
+
+    def find_staf_ids(
+            self,
+            space_id: str = None,
+            timeframe_id: str = None,
+            material_id: str = None) -> List[str]:
+        """
+        Finds the stafs with an origin space, timeframe and reference
+        material, through the index of the session over them if there is
+        one. None matches any id
+
+        Returns
+        -------
+        list(str): Stafdb ids of the stafs, in table order
+        """
+        query_values = self._get_query_values(
+            space_id, timeframe_id, material_id)
+
+        if self.session is not None:
+            positions = self.session.get_positions_by_values(
+                self.table_path, STAF_QUERY_COLUMNS, query_values)
+        else:
+            table = self.__load_table()
+
+            matches = pd.Series(True, index=table.index)
+            for column, value in zip(STAF_QUERY_COLUMNS, query_values):
+                if value is not None:
+                    matches &= table[column] == value
+
+            positions = [int(index) for index in table.index[matches]]
+
+        return [str(position + 1) for position in positions]
+
+    @staticmethod
+    def _get_query_values(
+            space_id: str,
+            timeframe_id: str,
+            material_id: str) -> tuple:
+        """ Gets the value of each STAF_QUERY_COLUMNS column, or None """
+        return tuple(
+            None if query_id is None else int(query_id)
+            for query_id in (space_id, timeframe_id, material_id))
 
     def insert_staf(
             self,
@@ -108,11 +319,7 @@ class StafAccessObject(StafdbAccessObject):
             process_id_origin,
             process_id_destination]
 
-        table: pd.DataFrame = self.__load_table()
-
-        row = pd.DataFrame([staf_params], columns=self.columns)
-        table = table.append(row, ignore_index=True, sort=False)
-        self.__write_table(table)
+        return self._insert_row(staf_params)
 
     def reset_table(self):
         return super(StafAccessObject, self)._reset_table()
@@ -123,7 +330,7 @@ class ProcessAccessObject(StafdbAccessObject):
     Accesses stafdb_process.csv, offers operations over it
     """
 
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'name',
             'code',
@@ -135,7 +342,7 @@ class ProcessAccessObject(StafdbAccessObject):
         table_path = 'stafdb_process.csv'
 
         super(ProcessAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         return super(ProcessAccessObject, self)._load_table()
@@ -144,8 +351,8 @@ class ProcessAccessObject(StafdbAccessObject):
         return super(ProcessAccessObject, self)._write_table(table)
 
     def get_process_by_id(self, val_id: str):
-        table = self.__load_table()
-        return super(ProcessAccessObject, self)._get_by_id(val_id, table)
+        return super(
+            ProcessAccessObject, self)._get_record_by_id(val_id)
 
     def insert_process(
             self,
@@ -161,8 +368,6 @@ class ProcessAccessObject(StafdbAccessObject):
                 or process_type == 'Distribution'
                 or process_type == 'Storage')
 
-        table: pd.DataFrame = self.__load_table()
-
         process_params = [
             name,
             code,
@@ -170,9 +375,7 @@ class ProcessAccessObject(StafdbAccessObject):
             is_separator,
             process_type]
 
-        row = pd.DataFrame([process_params], columns=self.columns)
-        table = table.append(row, ignore_index=True, sort=False)
-        self.__write_table(table)
+        return self._insert_row(process_params)
 
     def reset_table(self):
         return super(ProcessAccessObject, self)._reset_table()
@@ -183,7 +386,7 @@ class DataAccessObject(StafdbAccessObject):
     Accesses stafdb_data.csv, offers operations over it
     """
 
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'quantity',
             'unit',
@@ -197,7 +400,7 @@ class DataAccessObject(StafdbAccessObject):
         table_path = 'stafdb_data.csv'
 
         super(DataAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         return super(DataAccessObject, self)._load_table()
@@ -206,6 +409,17 @@ class DataAccessObject(StafdbAccessObject):
         return super(DataAccessObject, self)._write_table(table)
 
     def get_data_by_stafid(self, staf_id: str):
+        if self.session is not None:
+            records = self.session.get_records_by_value(
+                self.table_path, 'staf_id', int(staf_id))
+
+            dict_list = []
+            for index, row_dict in records:
+                row_dict['datum_id'] = str(index+1)
+                dict_list.append(row_dict)
+
+            return dict_list
+
         table = self.__load_table()
         rows = table.loc[table['staf_id'] == int(staf_id), :]
 
@@ -239,11 +453,7 @@ class DataAccessObject(StafdbAccessObject):
             stock_type,
             uncertainty_json]
 
-        table: pd.DataFrame = self.__load_table()
-
-        row = pd.DataFrame([data_params], columns=self.columns)
-        table = table.append(row, ignore_index=True, sort=False)
-        self.__write_table(table)
+        return self._insert_row(data_params)
 
     def reset_table(self):
         return super(DataAccessObject, self)._reset_table()
@@ -254,7 +464,7 @@ class MaterialAccessObject(StafdbAccessObject):
     Accesses stafdb_material.csv, offers operations over it
     """
 
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'name',
             'code',
@@ -265,7 +475,7 @@ class MaterialAccessObject(StafdbAccessObject):
         table_path = 'stafdb_material.csv'
 
         super(MaterialAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         table = super(MaterialAccessObject, self)._load_table()
@@ -275,8 +485,8 @@ class MaterialAccessObject(StafdbAccessObject):
         return super(MaterialAccessObject, self)._write_table(table)
 
     def get_material_by_id(self, val_id: str):
-        table = self.__load_table()
-        return super(MaterialAccessObject, self)._get_by_id(val_id, table)
+        return super(
+            MaterialAccessObject, self)._get_record_by_id(val_id)
 
     def insert_material(
             self,
@@ -293,10 +503,7 @@ class MaterialAccessObject(StafdbAccessObject):
             is_separator
         ]
 
-        table: pd.DataFrame = self.__load_table()
-        row = pd.DataFrame([material_params], columns=self.columns)
-        table = table.append(row, ignore_index=False, sort=False)
-        self.__write_table(table)
+        return self._insert_row(material_params)
 
     def reset_table(self):
         return super(MaterialAccessObject, self)._reset_table()
@@ -307,7 +514,7 @@ class ReferenceSpaceAccessObject(StafdbAccessObject):
     Accesses stafdb_reference_space.csv, offers operations over it
     """
 
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'name',
         ]
@@ -315,7 +522,7 @@ class ReferenceSpaceAccessObject(StafdbAccessObject):
         table_path = 'stafdb_reference_space.csv'
 
         super(ReferenceSpaceAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         table = super(ReferenceSpaceAccessObject, self)._load_table()
@@ -325,10 +532,8 @@ class ReferenceSpaceAccessObject(StafdbAccessObject):
         return super(ReferenceSpaceAccessObject, self)._write_table(table)
 
     def get_space_by_id(self, val_id: str):
-        table = self.__load_table()
-        
         return super(
-            ReferenceSpaceAccessObject, self)._get_by_id(val_id, table)
+            ReferenceSpaceAccessObject, self)._get_record_by_id(val_id)
 
     def insert_space(
             self,
@@ -338,10 +543,7 @@ class ReferenceSpaceAccessObject(StafdbAccessObject):
             name,
         ]
 
-        table: pd.DataFrame = self.__load_table()
-        row = pd.DataFrame([space_params], columns=self.columns)
-        table = table.append(row, ignore_index=False, sort=False)
-        self.__write_table(table)
+        return self._insert_row(space_params)
 
     def reset_table(self):
         return super(ReferenceSpaceAccessObject, self)._reset_table()
@@ -352,7 +554,7 @@ class ReferenceTimeframeAccessObject(StafdbAccessObject):
     Accesses stafdb_reference_timeframe.csv, offers operations over it
     """
 
-    def __init__(self, db_folder):
+    def __init__(self, db_folder, session=None):
         columns = [
             'name',
             'timeframe_start',
@@ -362,7 +564,7 @@ class ReferenceTimeframeAccessObject(StafdbAccessObject):
         table_path = 'stafdb_reference_timeframe.csv'
 
         super(ReferenceTimeframeAccessObject, self).__init__(
-            db_folder, columns, table_path)
+            db_folder, columns, table_path, session)
 
     def __load_table(self):
         table = super(ReferenceTimeframeAccessObject, self)._load_table()
@@ -372,10 +574,8 @@ class ReferenceTimeframeAccessObject(StafdbAccessObject):
         return super(ReferenceTimeframeAccessObject, self)._write_table(table)
 
     def get_timeframe_by_id(self, val_id: str):
-        table = self.__load_table()
-
         return super(
-            ReferenceTimeframeAccessObject, self)._get_by_id(val_id, table)
+            ReferenceTimeframeAccessObject, self)._get_record_by_id(val_id)
 
     def insert_timeframe(
             self,
@@ -389,10 +589,7 @@ class ReferenceTimeframeAccessObject(StafdbAccessObject):
             timeframe_end
         ]
 
-        table: pd.DataFrame = self.__load_table()
-        row = pd.DataFrame([space_params], columns=self.columns)
-        table = table.append(row, ignore_index=False, sort=False)
-        self.__write_table(table)
+        return self._insert_row(space_params)
 
     def reset_table(self):
         return super(ReferenceTimeframeAccessObject, self)._reset_table()
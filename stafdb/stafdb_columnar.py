@@ -0,0 +1,353 @@
+"""
+Columnar binary backend of the stafdb
+
+Each table of a stafdb folder is converted to one numpy file per column in
+the folder 'columnar' next to the csvs. Columns are opened memory mapped, so
+opening a database reads nothing and a look up only touches the columns it
+reads. The uncertainty json of the data table is split into a categorical
+distribution code and float64 columns of its parameters.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from stafdb.stafdb_access_objects import (
+    ID_COLUMN,
+    PATH_TO_MODULE,
+    STAF_QUERY_COLUMNS,
+    DataAccessObject,
+    MaterialAccessObject,
+    ProcessAccessObject,
+    ReferenceSpaceAccessObject,
+    ReferenceTimeframeAccessObject,
+    StafAccessObject)
+from stafdb.stafdb_uncertainty_decoder import (
+    UNCERTAINTY_PARAMS,
+    create_uncertainty,
+    decode_uncertainty_column)
+
+COLUMNAR_FOLDER = 'columnar'
+COLUMNS_FILE = 'columns.json'
+
+UNCERTAINTY_CODE_COLUMN = 'uncertainty_code'
+UNCERTAINTY_PARAM_COLUMNS = {
+    param: 'uncertainty_' + param for param in UNCERTAINTY_PARAMS}
+""" Maps an uncertainty parameter to its column, NaN where not used """
+
+CSV_ACCESS_OBJECTS = [
+    DataAccessObject,
+    MaterialAccessObject,
+    ProcessAccessObject,
+    ReferenceSpaceAccessObject,
+    ReferenceTimeframeAccessObject,
+    StafAccessObject]
+
+
+def convert_to_columnar(db_folder: str) -> Path:
+    """
+    Converts every csv table of a stafdb folder to columnar files, replacing
+    any earlier conversion
+
+    Args
+    ----
+    db_folder (str): Folder of the stafdb csvs
+
+    Returns
+    -------
+    Path: Folder of the columnar tables
+    """
+    columnar_path = PATH_TO_MODULE.joinpath(db_folder, COLUMNAR_FOLDER)
+
+    for access_object_class in CSV_ACCESS_OBJECTS:
+        access_object = access_object_class(db_folder)
+        table = access_object.get_table()
+
+        if 'uncertainty_json' in table.columns:
+            table = split_uncertainty_column(table)
+
+        table_path = columnar_path.joinpath(
+            Path(access_object.table_path).stem)
+        os.makedirs(table_path, exist_ok=True)
+
+        for column in table.columns:
+            _save_atomic(
+                table_path.joinpath(column + '.npy'),
+                _to_column_array(table[column]))
+
+        with open(table_path.joinpath(COLUMNS_FILE), 'w') as columns_file:
+            json.dump(list(table.columns), columns_file)
+
+    return columnar_path
+
+
+def split_uncertainty_column(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces the uncertainty json column of a data table with the code of
+    its distribution and a float column per parameter
+    """
+    uncertainties = decode_uncertainty_column(table['uncertainty_json'])
+
+    table = table.drop(columns='uncertainty_json')
+    table[UNCERTAINTY_CODE_COLUMN] = uncertainties.codes
+    for param, column in UNCERTAINTY_PARAM_COLUMNS.items():
+        table[column] = uncertainties.params[param]
+
+    return table
+
+
+def uncertainty_from_record(record: dict):
+    """ Creates the uncertainty of a record with split uncertainty columns """
+    return create_uncertainty(
+        record[UNCERTAINTY_CODE_COLUMN],
+        {param: record[column]
+         for param, column in UNCERTAINTY_PARAM_COLUMNS.items()})
+
+
+def _to_column_array(column: pd.Series) -> np.ndarray:
+    """ Converts a column to an array that can be memory mapped """
+    if column.dtype == object:
+        return column.astype(str).to_numpy(dtype=np.str_)
+
+    return column.to_numpy()
+
+
+def _save_atomic(path: Path, array: np.ndarray):
+    """ Saves an array to a temporary file and renames it over path """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            np.save(tmp_file, array, allow_pickle=False)
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class ColumnarAccessObject():
+    """
+    Reads a columnar stafdb table, opening each of its columns memory mapped
+    on first use
+    """
+
+    def __init__(self, db_folder, table_name: str):
+        """
+        Args
+        ----
+        db_folder (str): Folder of the stafdb csvs
+        table_name (str): Name of the csv of the table without its suffix
+        """
+        self.table_path = PATH_TO_MODULE.joinpath(
+            db_folder, COLUMNAR_FOLDER, table_name)
+
+        columns_path = self.table_path.joinpath(COLUMNS_FILE)
+        if not columns_path.exists():
+            raise ValueError("Table {} has not been converted, call "
+                             .format(self.table_path)
+                             + "convert_to_columnar('{}')".format(db_folder))
+
+        with open(columns_path) as columns_file:
+            self.columns: List[str] = json.load(columns_file)
+
+        self.__column_arrays: Dict[str, np.ndarray] = {}
+
+    def get_column(self, column: str) -> np.ndarray:
+        """ Gets a read only, memory mapped column """
+        column_array = self.__column_arrays.get(column)
+        if column_array is None:
+            column_array = np.load(
+                self.table_path.joinpath(column + '.npy'), mmap_mode='r')
+            self.__column_arrays[column] = column_array
+
+        return column_array
+
+    def get_table(self) -> pd.DataFrame:
+        """
+        Gets the table as a DataFrame, which copies every column. For
+        conversion and debugging, look ups read rows with get_rows_by_ids
+        and get_rows_by_values
+        """
+        return pd.DataFrame(
+            {column: self.get_column(column) for column in self.columns},
+            columns=self.columns)
+
+    def get_rows_by_ids(
+            self,
+            row_ids: Iterable[int],
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows with stafdb ids, reading only those rows of the
+        columns. Ids not in the table are skipped
+
+        Args
+        ----
+        row_ids (iterable(int)): Stafdb ids of the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        row_inds = np.unique(np.asarray(list(row_ids), dtype=int)) - 1
+        row_inds = row_inds[(row_inds >= 0) & (row_inds < len(self))]
+
+        return self.__get_rows(row_inds, columns)
+
+    def get_rows_by_values(
+            self,
+            column: str,
+            values: Iterable,
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows holding one of values in a column, reading only the
+        column and those rows of the other columns
+
+        Args
+        ----
+        column (str): Column the rows are looked up by
+        values (iterable): Values of the column in the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        row_inds = np.flatnonzero(
+            np.isin(self.get_column(column), list(values)))
+
+        return self.__get_rows(row_inds, columns)
+
+    def __get_rows(
+            self,
+            row_inds: np.ndarray,
+            columns: List[str] = None) -> pd.DataFrame:
+        """ Gathers rows of columns, with their id in ID_COLUMN """
+        if columns is None:
+            columns = self.columns
+
+        rows = pd.DataFrame(
+            {column: self.get_column(column)[row_inds] for column in columns},
+            columns=columns)
+        rows[ID_COLUMN] = row_inds + 1
+
+        return rows
+
+    def invalidate(self):
+        """ Closes the columns so they are mapped again on next access """
+        self.__column_arrays.clear()
+
+    def __len__(self) -> int:
+        return len(self.get_column(self.columns[0]))
+
+    def _get_record_by_id(self, row_id: str) -> dict:
+        row_ind = int(row_id) - 1
+        if not 0 <= row_ind < len(self):
+            raise IndexError("Table {} has no row with id {}"
+                             .format(self.table_path, row_id))
+
+        return {
+            column: self.get_column(column)[row_ind].item()
+            for column in self.columns}
+
+
+class ColumnarStafAccessObject(ColumnarAccessObject):
+    """ Reads the columnar staf table """
+
+    def __init__(self, db_folder):
+        super(ColumnarStafAccessObject, self).__init__(
+            db_folder, 'stafdb_staf')
+
+    def get_staf_by_id(self, val_id: str):
+        return self._get_record_by_id(val_id)
+
+    def find_staf_ids(
+            self,
+            space_id: str = None,
+            timeframe_id: str = None,
+            material_id: str = None) -> List[str]:
+        """
+        Finds the stafs with an origin space, timeframe and reference
+        material, reading only those columns. None matches any id
+        """
+        query_values = StafAccessObject._get_query_values(
+            space_id, timeframe_id, material_id)
+
+        matches = np.ones(len(self), dtype=bool)
+        for column, value in zip(STAF_QUERY_COLUMNS, query_values):
+            if value is not None:
+                matches &= self.get_column(column) == value
+
+        return [str(row_ind + 1) for row_ind in np.flatnonzero(matches)]
+
+
+class ColumnarProcessAccessObject(ColumnarAccessObject):
+    """ Reads the columnar process table """
+
+    def __init__(self, db_folder):
+        super(ColumnarProcessAccessObject, self).__init__(
+            db_folder, 'stafdb_process')
+
+    def get_process_by_id(self, val_id: str):
+        return self._get_record_by_id(val_id)
+
+
+class ColumnarDataAccessObject(ColumnarAccessObject):
+    """
+    Reads the columnar data table, whose records hold split uncertainty
+    columns instead of the uncertainty json
+    """
+
+    def __init__(self, db_folder):
+        super(ColumnarDataAccessObject, self).__init__(
+            db_folder, 'stafdb_data')
+
+    def get_data_by_stafid(self, staf_id: str):
+        row_inds = np.flatnonzero(self.get_column('staf_id') == int(staf_id))
+
+        dict_list = []
+        for row_ind in row_inds:
+            row_dict = self._get_record_by_id(row_ind + 1)
+            row_dict['datum_id'] = str(row_ind + 1)
+            dict_list.append(row_dict)
+
+        return dict_list
+
+
+class ColumnarMaterialAccessObject(ColumnarAccessObject):
+    """ Reads the columnar material table """
+
+    def __init__(self, db_folder):
+        super(ColumnarMaterialAccessObject, self).__init__(
+            db_folder, 'stafdb_material')
+
+    def get_material_by_id(self, val_id: str):
+        return self._get_record_by_id(val_id)
+
+
+class ColumnarReferenceSpaceAccessObject(ColumnarAccessObject):
+    """ Reads the columnar reference space table """
+
+    def __init__(self, db_folder):
+        super(ColumnarReferenceSpaceAccessObject, self).__init__(
+            db_folder, 'stafdb_reference_space')
+
+    def get_space_by_id(self, val_id: str):
+        return self._get_record_by_id(val_id)
+
+
+class ColumnarReferenceTimeframeAccessObject(ColumnarAccessObject):
+    """ Reads the columnar reference timeframe table """
+
+    def __init__(self, db_folder):
+        super(ColumnarReferenceTimeframeAccessObject, self).__init__(
+            db_folder, 'stafdb_reference_timeframe')
+
+    def get_timeframe_by_id(self, val_id: str):
+        return self._get_record_by_id(val_id)
@@ -0,0 +1,64 @@
+""" Registry of canonical instances of the entities built from stafdb """
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class InternRegistry():
+    """
+    Maps the key of an entity, its type and stafdb ids, to the one instance
+    built for it, so every reference to an entity shares that instance.
+    Holds at most max_entries instances, evicting the least recently used.
+    An evicted entity is built again on its next reference
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        """
+        Args
+        ----
+        max_entries (int): Maximum number of instances held
+        """
+        if not isinstance(max_entries, int) or max_entries < 1:
+            raise ValueError("max_entries must be a positive int, received {}"
+                             .format(max_entries))
+
+        self.max_entries = max_entries
+
+        self.__instances = OrderedDict()
+        """ Maps the key of an entity to its instance, least recent first """
+
+    def intern(self, key: Hashable, create: Callable[[], object]):
+        """
+        Gets the instance of an entity, creating it if it is not held
+
+        Args
+        ----
+        key (hashable): Key of the entity, a tuple of its type and stafdb ids
+        create (callable): Builds the entity when it is not held
+
+        Returns
+        -------
+        object: Canonical instance of the entity
+        """
+        instance = self.__instances.get(key)
+        if instance is not None:
+            self.__instances.move_to_end(key)
+            return instance
+
+        instance = create()
+        self.__instances[key] = instance
+
+        if len(self.__instances) > self.max_entries:
+            self.__instances.popitem(last=False)
+
+        return instance
+
+    def clear(self):
+        """ Drops every instance """
+        self.__instances.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__instances
+
+    def __len__(self) -> int:
+        return len(self.__instances)
+
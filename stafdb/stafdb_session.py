@@ -0,0 +1,208 @@
+""" In memory cache of the stafdb csv tables with hash indexes over them """
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+
+class StafdbSession():
+    """
+    Loads each stafdb table once and keeps it in memory with an index from
+    row id to record and indexes from the values of a column to its rows.
+    Tables are only read again once invalidated, either explicitly or by
+    refresh when the modification time or size of their file has changed
+
+    Access objects sharing a session share its tables, writes through them
+    invalidate the table they write
+    """
+
+    def __init__(self):
+        self.__tables: Dict[Path, pd.DataFrame] = {}
+        """ Maps the path of a table to the table """
+
+        self.__file_stats: Dict[Path, Tuple[int, int]] = {}
+        """ Maps the path of a table to the modification time in ns and size
+        of its file when loaded """
+
+        self.__records: Dict[Path, List[dict]] = {}
+        """ Maps the path of a table to the record of each row """
+
+        self.__column_indexes: Dict[Tuple[Path, Tuple[str, ...]], Dict] = {}
+        """ Maps a table path and columns to a dict of values to positions """
+
+    def get_table(self, table_path: Path) -> pd.DataFrame:
+        """
+        Gets a table, loading it if it is not in memory. The table is shared
+        by the session and must not be modified in place
+
+        Args
+        ----
+        table_path (Path): Path to the csv file of the table
+        """
+        table = self.__tables.get(table_path)
+        if table is None:
+            file_stat = self.__get_file_stat(table_path)
+            table = pd.read_csv(table_path)
+
+            self.__tables[table_path] = table
+            self.__file_stats[table_path] = file_stat
+
+        return table
+
+    def get_record(self, table_path: Path, row_id: str) -> dict:
+        """
+        Gets the record of a row by its stafdb id, the position of the row
+        counting from 1
+
+        Args
+        ----
+        table_path (Path): Path to the csv file of the table
+        row_id (str): Stafdb id of the row
+        """
+        records = self.__records.get(table_path)
+        if records is None:
+            records = self.get_table(table_path).to_dict('records')
+            self.__records[table_path] = records
+
+        row_ind = int(row_id) - 1
+        if not 0 <= row_ind < len(records):
+            raise IndexError("Table {} has no row with id {}"
+                             .format(table_path, row_id))
+
+        return dict(records[row_ind])
+
+    def get_records_by_value(
+            self,
+            table_path: Path,
+            column: str,
+            value) -> List[Tuple[int, dict]]:
+        """
+        Gets the records of the rows with a value in a column
+
+        Args
+        ----
+        table_path (Path): Path to the csv file of the table
+        column (str): Name of the indexed column
+        value: Value of the column in the rows
+
+        Returns
+        -------
+        list(tuple(int, dict)): Position in the table and record of each row
+        """
+        positions = self.get_positions_by_values(
+            table_path, (column,), (value,))
+
+        return [
+            (position, self.get_record(table_path, position + 1))
+            for position in positions]
+
+    def get_positions_by_values(
+            self,
+            table_path: Path,
+            columns: Tuple[str, ...],
+            values: tuple) -> List[int]:
+        """
+        Gets the positions of the rows holding values in columns, through an
+        index over the columns. A value of None matches any value, those
+        queries scan the distinct values of the index instead of its rows
+
+        Args
+        ----
+        table_path (Path): Path to the csv file of the table
+        columns (tuple(str)): Names of the indexed columns
+        values (tuple): Value of each column, or None
+
+        Returns
+        -------
+        list(int): Positions of the rows in the table, in table order
+        """
+        columns = tuple(columns)
+        values = tuple(values)
+        if len(columns) != len(values):
+            raise ValueError("Expected a value for each of {}, received {}"
+                             .format(columns, values))
+
+        index_key = (table_path, columns)
+
+        column_index = self.__column_indexes.get(index_key)
+        if column_index is None:
+            table = self.get_table(table_path)
+
+            # Grouping by a single column keys the groups by scalars
+            if len(columns) == 1:
+                column_index = table.groupby(columns[0], sort=False).indices
+            else:
+                column_index = table.groupby(
+                    list(columns), sort=False).indices
+
+            self.__column_indexes[index_key] = column_index
+
+        if None not in values:
+            key = values[0] if len(columns) == 1 else values
+            return [int(position) for position in column_index.get(key, [])]
+
+        positions = []
+        for key, key_positions in column_index.items():
+            if len(columns) == 1:
+                key = (key,)
+
+            if all(value is None or value == key_value
+                   for value, key_value in zip(values, key)):
+                positions.extend(int(position) for position in key_positions)
+
+        return sorted(positions)
+
+    def invalidate(self, table_path: Path = None):
+        """
+        Drops a table and its indexes so it is read again on next access
+
+        Args
+        ----
+        table_path (Path): Path to the csv file of the table, None to drop
+            every table
+        """
+        if table_path is None:
+            self.__tables.clear()
+            self.__file_stats.clear()
+            self.__records.clear()
+            self.__column_indexes.clear()
+            return
+
+        self.__tables.pop(table_path, None)
+        self.__file_stats.pop(table_path, None)
+        self.__records.pop(table_path, None)
+
+        for index_key in list(self.__column_indexes):
+            if index_key[0] == table_path:
+                del self.__column_indexes[index_key]
+
+    def refresh(self) -> List[Path]:
+        """
+        Invalidates every loaded table whose file has changed on disk
+
+        Returns
+        -------
+        list(Path): Paths of the invalidated tables
+        """
+        changed_paths = []
+        for table_path, file_stat in list(self.__file_stats.items()):
+            try:
+                changed = self.__get_file_stat(table_path) != file_stat
+            except FileNotFoundError:
+                changed = True
+
+            if changed:
+                self.invalidate(table_path)
+                changed_paths.append(table_path)
+
+        return changed_paths
+
+    @staticmethod
+    def __get_file_stat(table_path: Path) -> Tuple[int, int]:
+        """
+        Gets the modification time in ns and size of a file, the size catches
+        appends made within the resolution of the modification time
+        """
+        stat = os.stat(table_path)
+        return (stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,521 @@
+"""
+SQLite backend of the stafdb
+
+The csv tables of a stafdb folder are imported once into the database
+stafdb.sqlite in the same folder, with indexes on the columns the stafs and
+their data are looked up by. The SQLite access objects have the api of the
+csv access objects and share a pool of connections per database and
+process, so many worker processes can query one database concurrently.
+Stafs are built from the rows they reference, fetched through the primary
+key and indexes, never by reading whole tables.
+"""
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from stafdb.stafdb_access_objects import (
+    ID_COLUMN,
+    PATH_TO_MODULE,
+    STAF_QUERY_COLUMNS,
+    DataAccessObject,
+    MaterialAccessObject,
+    ProcessAccessObject,
+    ReferenceSpaceAccessObject,
+    ReferenceTimeframeAccessObject,
+    StafAccessObject,
+    StafdbAccessObject)
+
+SQLITE_FILE = 'stafdb.sqlite'
+
+MAX_QUERY_PARAMS = 900
+""" Most values bound to one query, below the SQLite default of 999 """
+
+TABLE_INDEXES: Dict[str, List[Tuple[str, ...]]] = {
+    'stafdb_data': [
+        ('staf_id',),
+        ('material_id',)],
+    'stafdb_staf': [
+        ('reference_timeframe',),
+        ('process_id_origin',),
+        ('process_id_destination',),
+        ('material_id_reference_material',),
+        STAF_QUERY_COLUMNS]}
+""" Columns of each index of a table """
+
+CSV_ACCESS_OBJECTS = [
+    DataAccessObject,
+    MaterialAccessObject,
+    ProcessAccessObject,
+    ReferenceSpaceAccessObject,
+    ReferenceTimeframeAccessObject,
+    StafAccessObject]
+
+
+def import_csvs_to_sqlite(db_folder: str) -> Path:
+    """
+    Imports every csv table of a stafdb folder into a new SQLite database,
+    replacing any earlier import once it is complete
+
+    Args
+    ----
+    db_folder (str): Folder of the stafdb csvs
+
+    Returns
+    -------
+    Path: Path of the database
+    """
+    db_path = PATH_TO_MODULE.joinpath(db_folder, SQLITE_FILE)
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(db_path), suffix='.sqlite.tmp')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            for access_object_class in CSV_ACCESS_OBJECTS:
+                access_object = access_object_class(db_folder)
+                _import_table(connection, access_object)
+
+            connection.commit()
+            connection.execute('PRAGMA journal_mode=WAL')
+        finally:
+            connection.close()
+
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return db_path
+
+
+def _import_table(
+        connection: sqlite3.Connection,
+        access_object: StafdbAccessObject):
+    """ Creates the table of a csv access object, its indexes and rows """
+    table_name = Path(access_object.table_path).stem
+    table = access_object.get_table()[access_object.columns]
+
+    column_defs = ['"{}" INTEGER PRIMARY KEY'.format(ID_COLUMN)] + [
+        '"{}" {}'.format(column, _get_sql_type(table[column].dtype))
+        for column in access_object.columns]
+
+    connection.execute('CREATE TABLE "{}" ({})'.format(
+        table_name, ', '.join(column_defs)))
+
+    for index_columns in TABLE_INDEXES.get(table_name, []):
+        connection.execute('CREATE INDEX "{}" ON "{}" ({})'.format(
+            '_'.join(('ix', table_name) + index_columns),
+            table_name,
+            ', '.join('"{}"'.format(column) for column in index_columns)))
+
+    rows = [
+        (row_ind + 1,) + tuple(_to_sql_value(value) for value in row)
+        for row_ind, row in enumerate(table.itertuples(index=False))]
+
+    connection.executemany(
+        'INSERT INTO "{}" VALUES ({})'.format(
+            table_name, ', '.join('?' * (len(access_object.columns) + 1))),
+        rows)
+
+
+def _get_sql_type(dtype) -> str:
+    """ Gets the SQLite type of a column from its pandas dtype """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'INTEGER'
+
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+
+    return 'TEXT'
+
+
+def _to_sql_value(value):
+    """ Converts a value read by pandas to a value SQLite can store """
+    if isinstance(value, np.generic):
+        value = value.item()
+
+    if isinstance(value, float) and np.isnan(value):
+        return None
+
+    return value
+
+
+class SqliteConnectionPool():
+    """
+    Pool of connections to one SQLite database, handing out at most
+    max_connections at once. Connections are made on first use and reused
+    """
+
+    def __init__(
+            self,
+            db_path: Path,
+            max_connections: int = 4,
+            timeout: float = 30.0):
+        """
+        Args
+        ----
+        db_path (Path): Path of the database
+        max_connections (int): Maximum number of connections in use at once
+        timeout (float): Seconds a connection waits for a lock held by
+            another process
+        """
+        if not Path(db_path).exists():
+            raise ValueError("Database {} does not exist, create it with "
+                             .format(db_path)
+                             + "import_csvs_to_sqlite")
+
+        self.db_path = db_path
+        self.timeout = timeout
+
+        self.__idle_connections = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(max_connections)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context holding a connection of the pool, waiting for one if
+        max_connections are in use
+
+        Yields
+        ------
+        sqlite3.Connection: Connection returning rows as sqlite3.Row
+        """
+        with self.__slots:
+            try:
+                connection = self.__idle_connections.get_nowait()
+            except queue.Empty:
+                connection = self.__connect()
+
+            try:
+                yield connection
+            finally:
+                self.__idle_connections.put(connection)
+
+    def close(self):
+        """ Closes the idle connections """
+        while True:
+            try:
+                self.__idle_connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            str(self.db_path),
+            timeout=self.timeout,
+            check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+
+        return connection
+
+
+_connection_pools: Dict[Tuple[int, str], SqliteConnectionPool] = {}
+""" Maps a process id and database path to the pool of the process """
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(db_path: Path) -> SqliteConnectionPool:
+    """
+    Gets the connection pool of a database for this process, connections are
+    never shared with forked processes
+    """
+    key = (os.getpid(), str(db_path))
+    with _connection_pools_lock:
+        if key not in _connection_pools:
+            _connection_pools[key] = SqliteConnectionPool(db_path)
+
+        return _connection_pools[key]
+
+
+class SqliteAccessObject(StafdbAccessObject):
+    """
+    Storage of a csv access object in the SQLite stafdb. The SQLite access
+    objects derive from the csv access object of their table and from this
+    class, which then takes over reading and writing rows
+    """
+
+    def __init__(self, db_folder, columns, table_path, session=None):
+        super(SqliteAccessObject, self).__init__(
+            db_folder, columns, table_path)
+
+        self.table_name = Path(table_path).stem
+        self.db_path = PATH_TO_MODULE.joinpath(db_folder, SQLITE_FILE)
+        self.pool = get_connection_pool(self.db_path)
+
+        self.__batch_connection = None
+        """ Connection of the open batch, None outside of a batch """
+
+    @contextmanager
+    def batch(self):
+        """
+        Context in which inserts are made in one transaction, committed when
+        it exits and rolled back if it exits with an exception. Batches
+        opened in a batch join it
+
+        Yields
+        ------
+        SqliteAccessObject: This access object
+        """
+        if self.__batch_connection is not None:
+            yield self
+            return
+
+        with self.pool.connection() as connection:
+            with connection:
+                self.__batch_connection = connection
+                try:
+                    yield self
+                finally:
+                    self.__batch_connection = None
+
+    def _insert_row(self, row_params: list) -> str:
+        if self.__batch_connection is None:
+            with self.batch():
+                return self._insert_row(row_params)
+
+        cursor = self.__batch_connection.execute(
+            'INSERT INTO "{}" ({}) VALUES ({})'.format(
+                self.table_name,
+                self.__get_column_list(),
+                ', '.join('?' * len(self.columns))),
+            [_to_sql_value(value) for value in row_params])
+
+        return str(cursor.lastrowid)
+
+    def _load_table(self):
+        with self.pool.connection() as connection:
+            table = pd.read_sql_query(
+                'SELECT {} FROM "{}" ORDER BY "{}"'.format(
+                    self.__get_column_list(), self.table_name, ID_COLUMN),
+                connection)
+
+        return table
+
+    def _write_table(self, table: pd.DataFrame):
+        rows = [
+            (row_ind + 1,) + tuple(_to_sql_value(value) for value in row)
+            for row_ind, row in enumerate(
+                table[self.columns].itertuples(index=False))]
+
+        with self.pool.connection() as connection:
+            with connection:
+                connection.execute(
+                    'DELETE FROM "{}"'.format(self.table_name))
+                connection.executemany(
+                    'INSERT INTO "{}" ("{}", {}) VALUES ({})'.format(
+                        self.table_name,
+                        ID_COLUMN,
+                        self.__get_column_list(),
+                        ', '.join('?' * (len(self.columns) + 1))),
+                    rows)
+
+    def get_rows_by_ids(
+            self,
+            row_ids: Iterable[int],
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows with stafdb ids through the primary key, ids not in
+        the table are skipped
+
+        Args
+        ----
+        row_ids (iterable(int)): Stafdb ids of the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        return self.__query_rows(
+            ID_COLUMN, {int(row_id) for row_id in row_ids}, columns)
+
+    def get_rows_by_values(
+            self,
+            column: str,
+            values: Iterable,
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows holding one of values in a column, through the index
+        of the column if it has one
+
+        Args
+        ----
+        column (str): Column the rows are looked up by
+        values (iterable): Values of the column in the rows
+        columns (list(str)): Columns to get, every column if None
+
+        Returns
+        -------
+        pd.DataFrame: Columns of the rows and their id in ID_COLUMN, in id
+            order
+        """
+        return self.__query_rows(
+            column,
+            {_to_sql_value(value) for value in values} - {None},
+            columns)
+
+    def __query_rows(
+            self,
+            column: str,
+            values: set,
+            columns: List[str] = None) -> pd.DataFrame:
+        """
+        Gets the rows holding one of values in a column, in queries of at
+        most MAX_QUERY_PARAMS values
+        """
+        if columns is None:
+            columns = self.columns
+
+        values = sorted(values)
+
+        frames = []
+        with self.pool.connection() as connection:
+            for start in range(0, len(values), MAX_QUERY_PARAMS):
+                query_values = values[start:start + MAX_QUERY_PARAMS]
+
+                frames.append(pd.read_sql_query(
+                    'SELECT {}, "{}" FROM "{}" WHERE "{}" IN ({})'.format(
+                        self.__get_column_list(columns),
+                        ID_COLUMN,
+                        self.table_name,
+                        column,
+                        ', '.join('?' * len(query_values))),
+                    connection,
+                    params=query_values))
+
+        if len(frames) == 0:
+            return pd.DataFrame(columns=list(columns) + [ID_COLUMN])
+
+        return pd.concat(frames).sort_values(ID_COLUMN).reset_index(
+            drop=True)
+
+    def _get_record_by_id(self, row_id: str):
+        rows = self._query_records(
+            '"{}" = ?'.format(ID_COLUMN), (int(row_id),))
+
+        if len(rows) == 0:
+            raise IndexError("Table {} has no row with id {}"
+                             .format(self.table_name, row_id))
+
+        return rows[0][1]
+
+    def _query_records(
+            self,
+            where_clause: str,
+            params: tuple) -> List[Tuple[int, dict]]:
+        """
+        Gets the records of the rows matching a where clause, in id order
+
+        Returns
+        -------
+        list(tuple(int, dict)): Stafdb id and record of each row
+        """
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                'SELECT "{}", {} FROM "{}" WHERE {} ORDER BY "{}"'.format(
+                    ID_COLUMN,
+                    self.__get_column_list(),
+                    self.table_name,
+                    where_clause,
+                    ID_COLUMN),
+                params).fetchall()
+
+        return [
+            (row[ID_COLUMN], {column: row[column] for column in self.columns})
+            for row in rows]
+
+    def __get_column_list(self, columns: List[str] = None) -> str:
+        if columns is None:
+            columns = self.columns
+
+        return ', '.join('"{}"'.format(column) for column in columns)
+
+
+class SqliteStafAccessObject(StafAccessObject, SqliteAccessObject):
+    """
+    Accesses the staf table of the SQLite stafdb, offers operations over it
+    """
+
+    def find_staf_ids(
+            self,
+            space_id: str = None,
+            timeframe_id: str = None,
+            material_id: str = None) -> List[str]:
+        query_values = self._get_query_values(
+            space_id, timeframe_id, material_id)
+
+        conditions = []
+        params = []
+        for column, value in zip(STAF_QUERY_COLUMNS, query_values):
+            if value is not None:
+                conditions.append('"{}" = ?'.format(column))
+                params.append(value)
+
+        where_clause = ' AND '.join(conditions) if conditions else '1'
+
+        with self.pool.connection() as connection:
+            rows = connection.execute(
+                'SELECT "{}" FROM "{}" WHERE {} ORDER BY "{}"'.format(
+                    ID_COLUMN, self.table_name, where_clause, ID_COLUMN),
+                params).fetchall()
+
+        return [str(row[ID_COLUMN]) for row in rows]
+
+
+class SqliteProcessAccessObject(ProcessAccessObject, SqliteAccessObject):
+    """
+    Accesses the process table of the SQLite stafdb, offers operations over
+    it
+    """
+
+
+class SqliteDataAccessObject(DataAccessObject, SqliteAccessObject):
+    """
+    Accesses the data table of the SQLite stafdb, offers operations over it
+    """
+
+    def get_data_by_stafid(self, staf_id: str):
+        records = self._query_records('"staf_id" = ?', (int(staf_id),))
+
+        dict_list = []
+        for datum_id, row_dict in records:
+            row_dict['datum_id'] = str(datum_id)
+            dict_list.append(row_dict)
+
+        return dict_list
+
+
+class SqliteMaterialAccessObject(MaterialAccessObject, SqliteAccessObject):
+    """
+    Accesses the material table of the SQLite stafdb, offers operations over
+    it
+    """
+
+
+class SqliteReferenceSpaceAccessObject(
+        ReferenceSpaceAccessObject, SqliteAccessObject):
+    """
+    Accesses the reference space table of the SQLite stafdb, offers
+    operations over it
+    """
+
+
+class SqliteReferenceTimeframeAccessObject(
+        ReferenceTimeframeAccessObject, SqliteAccessObject):
+    """
+    Accesses the reference timeframe table of the SQLite stafdb, offers
+    operations over it
+    """
@@ -0,0 +1,139 @@
+"""
+Decodes the uncertainty json column of the stafdb data table
+
+A whole column is parsed in one call to json.loads and turned into a
+distribution code and a float64 array per parameter. Uncertainty objects are
+only built for the rows that are accessed.
+"""
+import json
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+from bayesumis.umis_data_models import (
+    LognormalUncertainty,
+    NormalUncertainty,
+    Uncertainty,
+    UniformUncertainty)
+
+UNCERTAINTY_DISTRIBUTIONS = ('Uniform', 'Normal', 'Lognormal')
+""" Distribution of each uncertainty code """
+
+DISTRIBUTION_ALIASES = {'Logormal': 'Lognormal'}
+""" Misspelt distribution names found in stafdb, written by older versions
+of db_writer_helpers.lognormal_uncertainty_string """
+
+DISTRIBUTION_CODES: Dict[str, int] = dict(
+    [(distribution, code)
+     for code, distribution in enumerate(UNCERTAINTY_DISTRIBUTIONS)]
+    + [(alias, UNCERTAINTY_DISTRIBUTIONS.index(distribution))
+       for alias, distribution in DISTRIBUTION_ALIASES.items()])
+""" Maps a distribution name, or one of its aliases, to its code """
+
+UNCERTAINTY_PARAMS = ('mean', 'standard_deviation', 'lower', 'upper')
+
+
+class DecodedUncertainties():
+    """
+    Uncertainties of the rows of a data table, as typed arrays. Indexing by
+    a row position builds the Uncertainty of the row on first access
+
+    Attributes
+    ----------
+    codes (np.ndarray): Distribution code of each row, int8
+    params (dict(str, np.ndarray)): Maps each of UNCERTAINTY_PARAMS to its
+        float64 value in each row, NaN where the distribution has none
+    """
+
+    def __init__(self, codes: np.ndarray, params: Dict[str, np.ndarray]):
+        self.codes = codes
+        self.params = params
+
+        self.__uncertainties: Dict[int, Uncertainty] = {}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row_ind: int) -> Uncertainty:
+        row_ind = int(row_ind)
+
+        uncertainty = self.__uncertainties.get(row_ind)
+        if uncertainty is None:
+            uncertainty = create_uncertainty(
+                self.codes[row_ind],
+                {param: values[row_ind]
+                 for param, values in self.params.items()})
+            self.__uncertainties[row_ind] = uncertainty
+
+        return uncertainty
+
+
+def decode_uncertainty_column(
+        uncertainty_strings: Iterable[str]) -> DecodedUncertainties:
+    """
+    Decodes every uncertainty json string of a column in one pass
+
+    Args
+    ----
+    uncertainty_strings (iterable(str)): Uncertainty json of each row
+
+    Returns
+    -------
+    DecodedUncertainties: Codes and parameters of each row
+    """
+    uncertainty_strings = list(uncertainty_strings)
+
+    uncertainty_frame = pd.DataFrame.from_records(
+        json.loads('[' + ','.join(uncertainty_strings) + ']'),
+        columns=('distribution',) + UNCERTAINTY_PARAMS)
+
+    codes = uncertainty_frame['distribution'].map(DISTRIBUTION_CODES)
+
+    unknown = codes.isna()
+    if unknown.any():
+        raise ValueError("Uncertainty distribution: {} is unknown".format(
+            uncertainty_frame['distribution'][unknown].iloc[0]))
+
+    params = {
+        param: uncertainty_frame[param].to_numpy(dtype=np.float64)
+        for param in UNCERTAINTY_PARAMS}
+
+    return DecodedUncertainties(codes.to_numpy(dtype=np.int8), params)
+
+
+def get_distribution_code(distribution: str) -> int:
+    """ Gets the code of a distribution name or alias """
+    if distribution not in DISTRIBUTION_CODES:
+        raise ValueError("Uncertainty distribution: {} is unknown"
+                         .format(distribution))
+
+    return DISTRIBUTION_CODES[distribution]
+
+
+def create_uncertainty(code: int, params: Dict[str, float]) -> Uncertainty:
+    """
+    Creates the uncertainty of a distribution code from its parameters
+
+    Args
+    ----
+    code (int): Code of the distribution in UNCERTAINTY_DISTRIBUTIONS
+    params (dict(str, float)): Value of the parameters of the distribution
+    """
+    distribution = UNCERTAINTY_DISTRIBUTIONS[int(code)]
+
+    if distribution == 'Uniform':
+        return UniformUncertainty(params['lower'], params['upper'])
+
+    if distribution == 'Normal':
+        return NormalUncertainty(
+            params['mean'], params['standard_deviation'])
+
+    return LognormalUncertainty(params['mean'], params['standard_deviation'])
+
+
+def uncertainty_from_dict(uncertainty_dict: dict) -> Uncertainty:
+    """ Creates an uncertainty from a decoded uncertainty json """
+    code = get_distribution_code(uncertainty_dict['distribution'])
+
+    return create_uncertainty(code, uncertainty_dict)
@@ -0,0 +1,354 @@
+"""
+Watches the stafdb csvs for changed rows and refreshes only the math models
+of the diagrams whose stafs they affect
+
+Tables are checked by modification time and size, and a changed table is
+compared with its last snapshot by a hash of each row. A table read within
+the modification time resolution of the filesystem of its last change may
+have changed again in the same tick, so it is hashed again on every poll
+until its snapshot is older than that. Changed rows are mapped to the
+stafs they describe or that reference them, and then to the watched diagrams
+containing those stafs. A diagram whose structure is unchanged keeps its
+compiled model and only has its observations updated. Every diagram keeps
+its own observations, which are applied to its compiled model whenever the
+model is handed out, as diagrams of one structure may share a model from the
+model cache.
+"""
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+import numpy as np
+import pandas as pd
+
+from bayesumis.umis_data_models import Material, Timeframe
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_math_model import UmisMathModel
+from bayesumis.umis_model_cache import UmisModelCache
+from stafdb.staf_factory import CSV_BACKEND, StafFactory
+
+STAF_REFERENCE_COLUMNS = {
+    'process': ('process_id_origin', 'process_id_destination'),
+    'space': ('reference_space_id_origin', 'reference_space_id_destination'),
+    'timeframe': ('reference_timeframe',),
+    'material': ('material_id_reference_material',)}
+""" Columns of the staf table referencing the rows of each entity table """
+
+MTIME_RESOLUTION_NS = 2 * 10 ** 9
+""" Coarsest modification time resolution of a filesystem, that of FAT """
+
+
+class TableSnapshot():
+    """
+    Contents of a table when it was last checked
+
+    Attributes
+    ----------
+    file_stat (tuple(int, int)): Modification time in ns and size of the
+        csv when it was read
+    read_time (int): Time in ns the csv was read
+    table (pd.DataFrame): Table as read
+    row_hashes (np.ndarray): Hash of each row of the table
+    """
+
+    def __init__(self, table_path: Path):
+        self.file_stat = get_file_stat(table_path)
+        self.read_time = time.time_ns()
+        self.table = pd.read_csv(table_path)
+        self.row_hashes = pd.util.hash_pandas_object(
+            self.table, index=False).to_numpy()
+
+    def get_changed_positions(self, snapshot: 'TableSnapshot') -> np.ndarray:
+        """
+        Gets the positions of the rows that differ from an earlier snapshot,
+        including rows only in one of them
+        """
+        num_common = min(len(self.row_hashes), len(snapshot.row_hashes))
+
+        changed = np.flatnonzero(
+            self.row_hashes[:num_common]
+            != snapshot.row_hashes[:num_common])
+
+        added_or_removed = np.arange(
+            num_common, max(len(self.row_hashes), len(snapshot.row_hashes)))
+
+        return np.concatenate([changed, added_or_removed])
+
+    def may_be_stale(self, table_path: Path) -> bool:
+        """
+        Whether the csv may have changed since the snapshot, because its
+        modification time or size differ or because it was read within the
+        modification time resolution of its last change
+        """
+        if get_file_stat(table_path) != self.file_stat:
+            return True
+
+        return self.read_time - self.file_stat[0] <= MTIME_RESOLUTION_NS
+
+
+def get_file_stat(table_path: Path) -> tuple:
+    """ Gets the modification time in ns and size of a file """
+    stat = os.stat(table_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class WatchedDiagram():
+    """
+    Diagram refreshed by a StafdbWatcher
+
+    Attributes
+    ----------
+    staf_ids (set(str)): Stafdb ids of every staf of the diagram
+    math_model (UmisMathModel): Compiled math model of the diagram, shared
+        with the diagrams of the same structure if it is from a model cache
+    observation_model (UmisMathModel): Model holding the current
+        observations of the diagram, its pm model is not built
+    """
+
+    def __init__(
+            self,
+            external_inflow_ids: List[str],
+            internal_staf_ids: List[str],
+            external_outflow_ids: List[str],
+            reference_material: Material,
+            reference_time: Timeframe,
+            model_kwargs: dict):
+        self.external_inflow_ids = [str(i) for i in external_inflow_ids]
+        self.internal_staf_ids = [str(i) for i in internal_staf_ids]
+        self.external_outflow_ids = [str(i) for i in external_outflow_ids]
+        self.reference_material = reference_material
+        self.reference_time = reference_time
+        self.model_kwargs = model_kwargs
+
+        self.staf_ids: Set[str] = set(
+            self.external_inflow_ids
+            + self.internal_staf_ids
+            + self.external_outflow_ids)
+
+        self.math_model: UmisMathModel = None
+        self.observation_model: UmisMathModel = None
+
+
+class StafdbWatcher():
+    """
+    Detects changed rows of the stafdb csvs read by a StafFactory and
+    rebuilds the math models of the watched diagrams they affect
+    """
+
+    def __init__(
+            self,
+            staf_factory: StafFactory,
+            model_cache: UmisModelCache = None):
+        """
+        Args
+        ----
+        staf_factory (StafFactory): Factory reading the watched csvs, its
+            session and registry are refreshed on changes
+        model_cache (UmisModelCache): Cache giving the model of a diagram
+            whose structure changed, if None a new model is built. Models
+            from the cache are shared between diagrams of one structure, and
+            hold the observations of the diagram they were last given for
+        """
+        if staf_factory.backend != CSV_BACKEND:
+            raise ValueError("Only the csv backend can be watched, factory "
+                             + "uses {}".format(staf_factory.backend))
+
+        self.staf_factory = staf_factory
+        self.model_cache = model_cache
+
+        self.__table_paths: Dict[str, Path] = {
+            'staf': staf_factory.stao.table_path,
+            'data': staf_factory.dao.table_path,
+            'process': staf_factory.pao.table_path,
+            'space': staf_factory.rsao.table_path,
+            'timeframe': staf_factory.tao.table_path,
+            'material': staf_factory.mao.table_path}
+
+        self.__snapshots: Dict[str, TableSnapshot] = {
+            table: TableSnapshot(table_path)
+            for table, table_path in self.__table_paths.items()}
+
+        self.__diagrams: Dict[str, WatchedDiagram] = {}
+
+    def add_diagram(
+            self,
+            name: str,
+            external_inflow_ids: List[str],
+            internal_staf_ids: List[str],
+            external_outflow_ids: List[str],
+            reference_material: Material,
+            reference_time: Timeframe,
+            **model_kwargs) -> UmisMathModel:
+        """
+        Builds the math model of a diagram and watches it
+
+        Args
+        ----
+        name (str): Name of the diagram
+        external_inflow_ids (list(str)): Staf ids of the external inflows
+        internal_staf_ids (list(str)): Staf ids of the internal stocks and
+            flows
+        external_outflow_ids (list(str)): Staf ids of the external outflows
+        reference_material (Material): The material being balanced
+        reference_time (Timeframe): The timeframe of the diagram
+        model_kwargs (dict): Other keyword arguments of UmisMathModel
+
+        Returns
+        -------
+        UmisMathModel: Math model of the diagram, holding its observations
+            until a model of the same structure is handed out for another
+            diagram
+        """
+        if name in self.__diagrams:
+            raise ValueError("Diagram {} is already watched".format(name))
+
+        diagram = WatchedDiagram(
+            external_inflow_ids,
+            internal_staf_ids,
+            external_outflow_ids,
+            reference_material,
+            reference_time,
+            model_kwargs)
+
+        self.__refresh_diagram(diagram)
+        self.__diagrams[name] = diagram
+
+        return self.get_model(name)
+
+    def get_model(self, name: str) -> UmisMathModel:
+        """
+        Gets the current math model of a watched diagram, with the
+        observations of the diagram applied to it
+        """
+        diagram = self.__diagrams[name]
+        if diagram.math_model is not diagram.observation_model:
+            diagram.math_model.copy_observations(diagram.observation_model)
+
+        return diagram.math_model
+
+    def poll(self) -> Dict[str, Set[str]]:
+        """
+        Checks the csvs for changed rows and refreshes the models of the
+        diagrams with affected stafs
+
+        Returns
+        -------
+        dict(str, set(str)): Maps the name of each refreshed diagram to the
+            ids of its affected stafs
+        """
+        changed_positions = {}
+        old_snapshots = {}
+        for table, table_path in self.__table_paths.items():
+            snapshot = self.__snapshots[table]
+            if not snapshot.may_be_stale(table_path):
+                continue
+
+            new_snapshot = TableSnapshot(table_path)
+            positions = new_snapshot.get_changed_positions(snapshot)
+
+            self.__snapshots[table] = new_snapshot
+            if len(positions) > 0:
+                changed_positions[table] = positions
+                old_snapshots[table] = snapshot
+
+        if len(changed_positions) == 0:
+            return {}
+
+        for table in changed_positions:
+            self.staf_factory.session.invalidate(self.__table_paths[table])
+        self.staf_factory.registry.clear()
+
+        affected_staf_ids = self.__get_affected_staf_ids(
+            changed_positions, old_snapshots)
+
+        refreshed = {}
+        for name, diagram in self.__diagrams.items():
+            diagram_staf_ids = diagram.staf_ids & affected_staf_ids
+            if len(diagram_staf_ids) > 0:
+                self.__refresh_diagram(diagram)
+                refreshed[name] = diagram_staf_ids
+
+        return refreshed
+
+    def __get_affected_staf_ids(
+            self,
+            changed_positions: Dict[str, np.ndarray],
+            old_snapshots: Dict[str, TableSnapshot]) -> Set[str]:
+        """
+        Maps the changed rows of each table to the ids of the stafs they
+        describe or that reference them, before or after the change
+        """
+        staf_table = self.__snapshots['staf'].table
+        data_table = self.__snapshots['data'].table
+
+        affected_staf_ids = set()
+
+        if 'staf' in changed_positions:
+            affected_staf_ids.update(
+                str(position + 1) for position in changed_positions['staf'])
+
+        if 'data' in changed_positions:
+            for table in (data_table, old_snapshots['data'].table):
+                positions = changed_positions['data']
+                positions = positions[positions < len(table)]
+                affected_staf_ids.update(
+                    str(staf_id)
+                    for staf_id in table['staf_id'].iloc[positions])
+
+        for entity, columns in STAF_REFERENCE_COLUMNS.items():
+            if entity not in changed_positions:
+                continue
+
+            entity_ids = changed_positions[entity] + 1
+
+            references = np.zeros(len(staf_table), dtype=bool)
+            for column in columns:
+                references |= staf_table[column].isin(entity_ids).to_numpy()
+
+            affected_staf_ids.update(
+                str(position + 1) for position in np.flatnonzero(references))
+
+            if entity == 'material':
+                data_references = data_table['material_id'].isin(entity_ids)
+                affected_staf_ids.update(
+                    str(staf_id)
+                    for staf_id in data_table.loc[data_references, 'staf_id'])
+
+        return affected_staf_ids
+
+    def __refresh_diagram(self, diagram: WatchedDiagram):
+        """
+        Rebuilds the stafs of a diagram and its observations, and replaces
+        its model if its structure changed
+        """
+        umis_diagram = UmisDiagram(
+            set(self.staf_factory.build_stafs(diagram.external_inflow_ids)),
+            set(self.staf_factory.build_stafs(diagram.internal_staf_ids)),
+            set(self.staf_factory.build_stafs(diagram.external_outflow_ids)))
+
+        model_args = (
+            umis_diagram.get_external_inflows(),
+            umis_diagram.get_process_stafs_dict(),
+            umis_diagram.get_external_outflows(),
+            diagram.reference_material,
+            diagram.reference_time)
+
+        new_model = UmisMathModel(
+            *model_args, build_pm_model=False, **diagram.model_kwargs)
+
+        current_model = diagram.math_model
+        diagram.observation_model = new_model
+
+        # The observations reach the model when it is next handed out
+        if (current_model is not None
+                and current_model.get_structure_fingerprint()
+                == new_model.get_structure_fingerprint()):
+            return
+
+        if self.model_cache is not None:
+            diagram.math_model = self.model_cache.get_model(
+                *model_args, **diagram.model_kwargs)
+        else:
+            new_model.create_pm_model()
+            diagram.math_model = new_model
@@ -0,0 +1,279 @@
+""" Functions to benchmark building, compiling and evaluating math models """
+
+from time import time
+
+import numpy as np
+import pandas as pd
+import pymc3 as pm
+
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import sample_nuts
+from bayesumis.umis_math_model import (
+    CENTERED_PARAMETERISATION,
+    CLAMP_TC_TRANSFORM,
+    LOGIT_TC_TRANSFORM,
+    LOG_PARAMETERISATION,
+    NON_CENTERED_PARAMETERISATION,
+    UmisMathModel)
+from bayesumis.umis_math_model_helper import MATRIX_ASSEMBLIES
+from bayesumis.umis_throughput_solvers import THROUGHPUT_SOLVERS
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+
+REPARAMETERISATION_BUILDERS = (
+    'get_umis_diagram_cycle',
+    'get_umis_diagram_cycle_lognormal',
+    'get_umis_diagram_just_tc',
+    'get_umis_diagram_lognormal_and_normal_test',
+    'get_umis_diagram_stocked')
+""" Builders of umis_builders benchmarked by benchmark_reparameterisation """
+
+REPARAMETERISATIONS = (
+    (CENTERED_PARAMETERISATION, CLAMP_TC_TRANSFORM),
+    (NON_CENTERED_PARAMETERISATION, LOGIT_TC_TRANSFORM),
+    (LOG_PARAMETERISATION, LOGIT_TC_TRANSFORM))
+""" Parameterisation and tc transform of each benchmarked model, the first
+is the model before reparameterisation """
+
+
+def build_subsystems_diagram(n_subsystems):
+    (external_inflows,
+     internal_flows,
+     external_outflows,
+     stocks,
+     _,
+     _) = umis_builders.get_umis_diagram_subsystems_test(n_subsystems)
+
+    internal_stafs = set.union(internal_flows, stocks)
+
+    umis_diagram = UmisDiagram(
+        external_inflows,
+        internal_stafs,
+        external_outflows)
+
+    return umis_diagram
+
+
+def time_logp_dlogp(math_model, n_evals):
+    """
+    Times compiling the model log probability and its gradient, and evaluating
+    them at the model test point
+
+    Returns
+    -------
+    compile_time, eval_time (tuple(float, float)): Seconds taken to compile,
+        mean seconds taken by one evaluation
+    """
+    pm_model = math_model.pm_model
+
+    start_time = time()
+    logp_dlogp = pm_model.logp_dlogp_function()
+    compile_time = time() - start_time
+
+    logp_dlogp.set_extra_values({})
+    point = logp_dlogp.dict_to_array(pm_model.test_point)
+
+    start_time = time()
+    for _ in range(n_evals):
+        logp_dlogp(point)
+    eval_time = (time() - start_time) / n_evals
+
+    return compile_time, eval_time
+
+
+def benchmark_matrix_assembly(n_subsystems_list, n_evals=100):
+    """
+    Compares building the parameter matrices with one scatter against the
+    original chained construction, one set_subtensor per process or
+    observation with its own random variables, on the subsystems test
+    diagrams
+
+    Args
+    ----
+    n_subsystems_list (list(int)): Numbers of subsystems to benchmark
+    n_evals (int): Number of log probability evaluations to time
+
+    Returns
+    -------
+    pd.DataFrame: One row per diagram size and matrix assembly
+    """
+    test_db = DbStub()
+    ref_material = test_db.get_material_by_num(1)
+    ref_time = test_db.get_time_by_num(1)
+
+    results = []
+    for n_subsystems in n_subsystems_list:
+        umis_diagram = build_subsystems_diagram(n_subsystems)
+
+        for matrix_assembly in MATRIX_ASSEMBLIES:
+            start_time = time()
+            math_model = UmisMathModel(
+                umis_diagram.get_external_inflows(),
+                umis_diagram.get_process_stafs_dict(),
+                umis_diagram.get_external_outflows(),
+                ref_material,
+                ref_time,
+                matrix_assembly=matrix_assembly)
+            build_time = time() - start_time
+
+            compile_time, eval_time = time_logp_dlogp(math_model, n_evals)
+
+            results.append({
+                'n_subsystems': n_subsystems,
+                'matrix_assembly': matrix_assembly,
+                'build_time': build_time,
+                'compile_time': compile_time,
+                'eval_time': eval_time})
+
+    return pd.DataFrame(results)
+
+
+def benchmark_throughput_solvers(n_subsystems_list, n_evals=100):
+    """
+    Compares the cost of the log probability and its gradient with each
+    throughput solver on the subsystems test diagrams
+
+    Args
+    ----
+    n_subsystems_list (list(int)): Numbers of subsystems to benchmark
+    n_evals (int): Number of log probability evaluations to time
+
+    Returns
+    -------
+    pd.DataFrame: One row per diagram size and solver
+    """
+    test_db = DbStub()
+    ref_material = test_db.get_material_by_num(1)
+    ref_time = test_db.get_time_by_num(1)
+
+    results = []
+    for n_subsystems in n_subsystems_list:
+        umis_diagram = build_subsystems_diagram(n_subsystems)
+
+        for solver in THROUGHPUT_SOLVERS:
+            math_model = UmisMathModel(
+                umis_diagram.get_external_inflows(),
+                umis_diagram.get_process_stafs_dict(),
+                umis_diagram.get_external_outflows(),
+                ref_material,
+                ref_time,
+                solver=solver)
+
+            compile_time, eval_time = time_logp_dlogp(math_model, n_evals)
+
+            results.append({
+                'n_subsystems': n_subsystems,
+                'solver': solver,
+                'compile_time': compile_time,
+                'eval_time': eval_time})
+
+    return pd.DataFrame(results)
+
+
+def benchmark_reparameterisation(
+        builder_names=REPARAMETERISATION_BUILDERS,
+        draws=500,
+        tune=500,
+        chains=2,
+        random_seed=0):
+    """
+    Compares the effective samples per second of NUTS on the builders of
+    umis_builders with each parameterisation of their priors
+
+    The effective sample size is the smallest over the varying entries of
+    the reconciled stafs, which every parameterisation shares. The 'log'
+    parameterisation truncates normal priors at 0, so its posterior only
+    matches the others on builders whose normal priors are far from 0, as
+    those of REPARAMETERISATION_BUILDERS are
+
+    Args
+    ----
+    builder_names (list(str)): Names of the umis_builders functions to
+        benchmark, each returning the stafs of a diagram, its material
+        reconciliation table and its transfer coefficient observations
+    draws (int): Number of samples per chain
+    tune (int): Number of tuning steps per chain
+    chains (int): Number of chains, at least 2 for the effective sample size
+    random_seed (int): Seed of every sampler run
+
+    Returns
+    -------
+    pd.DataFrame: One row per builder and parameterisation
+    """
+    test_db = DbStub()
+    ref_material = test_db.get_material_by_num(1)
+    ref_time = test_db.get_time_by_num(1)
+
+    results = []
+    for builder_name in builder_names:
+        (external_inflows,
+         internal_flows,
+         external_outflows,
+         stocks,
+         material_reconc_table,
+         tc_observation_table) = getattr(umis_builders, builder_name)()
+
+        umis_diagram = UmisDiagram(
+            external_inflows,
+            set.union(internal_flows, stocks),
+            external_outflows)
+
+        for parameterisation, tc_transform in REPARAMETERISATIONS:
+            math_model = UmisMathModel(
+                umis_diagram.get_external_inflows(),
+                umis_diagram.get_process_stafs_dict(),
+                umis_diagram.get_external_outflows(),
+                ref_material,
+                ref_time,
+                material_reconc_table,
+                tc_observation_table,
+                parameterisation=parameterisation,
+                tc_transform=tc_transform)
+
+            start_time = time()
+            step = math_model.get_nuts_step()
+            compile_time = time() - start_time
+
+            start_time = time()
+            fit_result = sample_nuts(
+                math_model.pm_model,
+                draws,
+                tune,
+                chains,
+                random_seed=random_seed,
+                step=step,
+                progressbar=False)
+            sample_time = time() - start_time
+
+            trace = fit_result.trace
+            min_ess = _get_min_staf_ess(trace)
+
+            results.append({
+                'builder': builder_name,
+                'parameterisation': parameterisation,
+                'tc_transform': tc_transform,
+                'compile_time': compile_time,
+                'sample_time': sample_time,
+                'min_ess': min_ess,
+                'ess_per_second': min_ess / sample_time,
+                'n_divergences': fit_result.diagnostics['n_divergences'],
+                'mean_step_size': float(np.mean(
+                    trace.get_sampler_stats('step_size')))})
+
+    return pd.DataFrame(results)
+
+
+def _get_min_staf_ess(trace) -> float:
+    """
+    Smallest effective sample size of the entries of the reconciled stafs
+    that vary across the samples
+    """
+    staf_samples = trace[UmisMathModel.STAF_VAR_NAME]
+    varying = np.std(staf_samples, axis=0) > 0
+
+    staf_ess = pm.diagnostics.effective_n(
+        trace, varnames=[UmisMathModel.STAF_VAR_NAME])
+
+    return float(np.min(
+        np.asarray(staf_ess[UmisMathModel.STAF_VAR_NAME])[varying]))
@@ -1,5 +1,8 @@
 """ Stub class simulating database for constructing values """
 
+import shutil
+import tempfile
+from pathlib import Path
 from time import time
 from typing import Dict
 
@@ -22,6 +25,20 @@ def end_timer(start_time):
     print("Task finished, time elapsed: {}".format(time_elapsed))
 
 
+def copy_stafdb(db_folder: str = 'csvs_test') -> tempfile.TemporaryDirectory:
+    """
+    Copies a folder of stafdb csvs to a temporary directory, so tests can
+    write to it. The copy is in the folder 'stafdb' of the directory
+    """
+    temp_dir = tempfile.TemporaryDirectory()
+
+    shutil.copytree(
+        Path(__file__).parent.parent.joinpath('stafdb', db_folder),
+        Path(temp_dir.name).joinpath('stafdb'))
+
+    return temp_dir
+
+
 class DbStub():
 
     def __init__(self):
@@ -151,6 +168,10 @@ class DbStub():
             # print("|M1|")
             return Material("M1", "CodeM1", "Iron", "Parent", False)
 
+        if num == 3:
+            # print("|M3|")
+            return Material("M3", "CodeM3", "Copper", "Parent", False)
+
         # print("|M2|")
         return Material("M2", "CodeM2", "Nickel", "Parent", False)
 
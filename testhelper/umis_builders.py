@@ -128,7 +128,7 @@ def get_umis_diagram_add_flows_test(n_flows):
         dict())
 
 
-def get_umis_diagram_subsystems_test(n_subsystems):
+def get_umis_diagram_subsystems_test(n_subsystems, outflow_only=False):
     test_db = DbStub()
 
     ref_origin_space = test_db.get_space_by_num(1)
@@ -213,6 +213,28 @@ def get_umis_diagram_subsystems_test(n_subsystems):
 
     external_outflows = set()
     stocks = set()
+
+    if outflow_only:
+        # A process whose only staf is an external outflow
+        p_outflow_only = test_db.get_umis_process(
+            ref_origin_space,
+            'Transformation',
+            "Outflow Only Process")
+
+        p_output = test_db.get_umis_process(
+            ref_destination_space,
+            'Distribution',
+            "Output Process")
+
+        f_out = test_db.get_flow(
+            reference,
+            {ref_material: value_150_10},
+            p_outflow_only,
+            p_output,
+            'Flow Out')
+
+        external_outflows.add(f_out)
+
     print("Model built Tue 22:18")
 
     return (
@@ -483,6 +505,86 @@ def get_umis_diagram_gaussian_test():
         })
 
 
+def get_umis_diagram_all_normal_test(flow_2_mean=100):
+    test_db = DbStub()
+
+    ref_origin_space = test_db.get_space_by_num(1)
+    ref_destination_space = test_db.get_space_by_num(2)
+    ref_material = test_db.get_material_by_num(1)
+    ref_time = test_db.get_time_by_num(1)
+
+    reference = StafReference(
+        ref_time,
+        ref_material)
+
+    p_input = test_db.get_umis_process(
+        ref_destination_space,
+        'Distribution',
+        "Input Process")
+
+    p1 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 1")
+
+    p2 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 2")
+
+    p3 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 3")
+
+    norm_uncert_150_10 = NormalUncertainty(mean=150, standard_deviation=10)
+    norm_uncert_100_8 = NormalUncertainty(
+        mean=flow_2_mean, standard_deviation=8)
+    norm_uncert_60_6 = NormalUncertainty(mean=60, standard_deviation=6)
+
+    value_150_10 = test_db.get_value(150, norm_uncert_150_10)
+    value_100_8 = test_db.get_value(flow_2_mean, norm_uncert_100_8)
+    value_60_6 = test_db.get_value(60, norm_uncert_60_6)
+
+    f1 = test_db.get_flow(
+        reference,
+        {ref_material: value_150_10},
+        p_input,
+        p1,
+        'Flow 1')
+
+    f2 = test_db.get_flow(
+        reference,
+        {ref_material: value_100_8},
+        p1,
+        p2,
+        'Flow 2')
+
+    f3 = test_db.get_flow(
+        reference,
+        {ref_material: value_60_6},
+        p1,
+        p3,
+        'Flow 3')
+
+    external_inflows = {f1}
+    internal_flows = {f2, f3}
+    external_outflows = set()
+    stocks = set()
+
+    return (
+        external_inflows,
+        internal_flows,
+        external_outflows,
+        stocks,
+        dict(),
+        {
+            p1.diagram_id: {
+                p2.diagram_id: Constant(0.6)
+            },
+        })
+
+
 def get_umis_diagram_lognormal_test():
     test_db = DbStub()
 
@@ -2107,7 +2209,7 @@ def get_umis_diagram_inflows():
         dict())
 
 
-def get_umis_diagram_stocked():
+def get_umis_diagram_stocked(stock_mean=20):
     test_db = DbStub()
 
     ref_origin_space = test_db.get_space_by_num(1)
@@ -2141,12 +2243,13 @@ def get_umis_diagram_stocked():
 
     norm_uncert_100 = NormalUncertainty(mean=100, standard_deviation=1)
     norm_uncert_70 = NormalUncertainty(mean=70, standard_deviation=1)
-    norm_uncert_20 = NormalUncertainty(mean=20, standard_deviation=0.5)
+    norm_uncert_20 = NormalUncertainty(
+        mean=stock_mean, standard_deviation=0.5)
     uniform_uncert_0_150 = UniformUncertainty(lower=0, upper=150)
 
     value_100 = test_db.get_value(100, norm_uncert_100)
     value_70 = test_db.get_value(70, norm_uncert_70)
-    value_20 = test_db.get_value(20, norm_uncert_20)
+    value_20 = test_db.get_value(stock_mean, norm_uncert_20)
     value_unknown = test_db.get_value(75, uniform_uncert_0_150)
 
     f1 = test_db.get_flow(
@@ -2318,3 +2421,181 @@ def get_umis_diagram_stocked_with_tcs():
         stocks,
         transformation_coefficient_obs,
         dict())
+
+
+def get_umis_diagrams_regions_test():
+    """
+    Two regions of the same processes, the transfer coefficient of process
+    1 is observed in region 1 and unobserved in region 2
+    """
+    test_db = DbStub()
+
+    ref_material = test_db.get_material_by_num(1)
+    ref_time = test_db.get_time_by_num(1)
+
+    reference = StafReference(
+        ref_time,
+        ref_material)
+
+    norm_uncert_100_10 = NormalUncertainty(mean=100, standard_deviation=10)
+    norm_uncert_80_4 = NormalUncertainty(mean=80, standard_deviation=4)
+    norm_uncert_20_4 = NormalUncertainty(mean=20, standard_deviation=4)
+    uniform_uncert_0_400 = UniformUncertainty(lower=0, upper=400)
+
+    regional_stafs = {}
+    tc_observation_table = {}
+
+    for region_num in (1, 2):
+        space = test_db.get_space_by_num(region_num)
+
+        p_input, p1, p2, p3 = [
+            UmisProcess(
+                "P{}".format(process_num),
+                "Code{}".format(process_num),
+                "Process {}".format(process_num),
+                space,
+                False,
+                "parent",
+                process_type)
+            for process_num, process_type in enumerate(
+                ['Distribution', 'Transformation', 'Transformation',
+                 'Transformation'])]
+
+        if region_num == 1:
+            f2_uncert = norm_uncert_80_4
+            f3_uncert = norm_uncert_20_4
+
+            tc_observation_table[p1.diagram_id] = {
+                p2.diagram_id: NormalUncertainty(
+                    mean=0.8, standard_deviation=0.02)}
+        else:
+            f2_uncert = uniform_uncert_0_400
+            f3_uncert = uniform_uncert_0_400
+
+        f1 = test_db.get_flow(
+            reference,
+            {ref_material: test_db.get_value(100, norm_uncert_100_10)},
+            p_input,
+            p1,
+            'Flow 1')
+
+        f2 = test_db.get_flow(
+            reference,
+            {ref_material: test_db.get_value(80, f2_uncert)},
+            p1,
+            p2,
+            'Flow 2')
+
+        f3 = test_db.get_flow(
+            reference,
+            {ref_material: test_db.get_value(20, f3_uncert)},
+            p1,
+            p3,
+            'Flow 3')
+
+        regional_stafs["Region {}".format(region_num)] = (
+            {f1},
+            {f2, f3},
+            set(),
+            set())
+
+    return regional_stafs, tc_observation_table
+
+
+def get_umis_diagram_multi_material_test():
+    """
+    Diagram with stafs of materials 1 and 2, flow 2 is only observed in
+    material 3 and is reconciled into each with its own concentration
+    coefficient
+    """
+    test_db = DbStub()
+
+    ref_origin_space = test_db.get_space_by_num(1)
+    ref_destination_space = test_db.get_space_by_num(2)
+    material_1 = test_db.get_material_by_num(1)
+    material_2 = test_db.get_material_by_num(2)
+    comp_material = test_db.get_material_by_num(3)
+    ref_time = test_db.get_time_by_num(1)
+
+    reference = StafReference(
+        ref_time,
+        material_1)
+
+    p_input = test_db.get_umis_process(
+        ref_destination_space,
+        'Distribution',
+        "Input Process")
+
+    p1 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 1")
+
+    p2 = test_db.get_umis_process(
+        ref_origin_space,
+        'Distribution',
+        "Process 2")
+
+    p3 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 3")
+
+    p4 = test_db.get_umis_process(
+        ref_origin_space,
+        'Transformation',
+        "Process 4")
+
+    uniform_uncert_0_200 = UniformUncertainty(lower=0, upper=200)
+
+    f1 = test_db.get_flow(
+        reference,
+        {material_1: test_db.get_value(
+            100, NormalUncertainty(mean=100, standard_deviation=10)),
+         material_2: test_db.get_value(
+            40, NormalUncertainty(mean=40, standard_deviation=4))},
+        p_input,
+        p1,
+        'Flow 1')
+
+    f2 = test_db.get_flow(
+        reference,
+        {comp_material: test_db.get_value(
+            80, NormalUncertainty(mean=80, standard_deviation=8))},
+        p1,
+        p2,
+        'Flow 2')
+
+    f3 = test_db.get_flow(
+        reference,
+        {material_1: test_db.get_value(
+            60, NormalUncertainty(mean=60, standard_deviation=6)),
+         material_2: test_db.get_value(
+            25, NormalUncertainty(mean=25, standard_deviation=2.5))},
+        p2,
+        p3,
+        'Flow 3')
+
+    f4 = test_db.get_flow(
+        reference,
+        {material_1: test_db.get_value(50, uniform_uncert_0_200),
+         material_2: test_db.get_value(50, uniform_uncert_0_200)},
+        p2,
+        p4,
+        'Flow 4')
+
+    material_reconc_tables = {
+        material_1: {
+            comp_material: NormalUncertainty(
+                mean=0.9, standard_deviation=0.05)},
+        material_2: {
+            comp_material: NormalUncertainty(
+                mean=0.4, standard_deviation=0.05)}}
+
+    return (
+        {f1},
+        {f2, f3, f4},
+        set(),
+        set(),
+        material_reconc_tables,
+        dict())
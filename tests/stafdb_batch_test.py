@@ -0,0 +1,84 @@
+""" Tests for batched inserts through the stafdb access objects """
+import os
+import stat
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from stafdb.stafdb_access_objects import StafAccessObject
+from stafdb.stafdb_session import StafdbSession
+from testhelper.test_helper import copy_stafdb
+
+STAF_ROW = ('Flow3', 'Flow', '1', '1', '1', '1', '4', '2')
+
+
+class TestStafdbBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = copy_stafdb()
+        self.db_folder = str(Path(self.db_dir.name).joinpath('stafdb'))
+
+        self.session = StafdbSession()
+        self.stao = StafAccessObject(self.db_folder, self.session)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def read_staf_names(self):
+        return list(pd.read_csv(self.stao.table_path)['name'])
+
+    def test_batch_ids_and_single_append(self):
+        with self.stao.batch():
+            first_id = self.stao.insert_staf(*STAF_ROW)
+
+            # Nested batches join the open one
+            with self.stao.batch():
+                second_id = self.stao.insert_staf('Flow4', *STAF_ROW[1:])
+
+            self.assertEqual(3, len(self.read_staf_names()))
+
+        self.assertEqual(('4', '5'), (first_id, second_id))
+        self.assertEqual(
+            ['Flow1', 'Stock1', 'Flow2', 'Flow3', 'Flow4'],
+            self.read_staf_names())
+
+        # The session sees the appended rows
+        self.assertEqual(5, len(self.stao.get_table()))
+        self.assertEqual('Flow4', self.stao.get_staf_by_id('5')['name'])
+
+    def test_insert_outside_batch_is_written(self):
+        staf_id = self.stao.insert_staf(*STAF_ROW)
+
+        self.assertEqual('4', staf_id)
+        self.assertEqual('Flow3', self.read_staf_names()[-1])
+
+    def test_commit_keeps_table_permissions(self):
+        os.chmod(self.stao.table_path, 0o664)
+
+        with self.stao.batch():
+            self.stao.insert_staf(*STAF_ROW)
+
+        self.assertEqual(
+            0o664, stat.S_IMODE(os.stat(self.stao.table_path).st_mode))
+
+    def test_exception_discards_batch(self):
+        with self.assertRaises(RuntimeError):
+            with self.stao.batch():
+                self.stao.insert_staf(*STAF_ROW)
+                raise RuntimeError("Failed import")
+
+        self.assertEqual(['Flow1', 'Stock1', 'Flow2'],
+                         self.read_staf_names())
+
+        # No temporary copy of the table is left behind
+        self.assertEqual(
+            [], list(Path(self.db_folder).glob('*.tmp')))
+
+        # Ids carry on from the rows in the table
+        with self.stao.batch():
+            self.assertEqual('4', self.stao.insert_staf(*STAF_ROW))
+
+
+if __name__ == '__main__':
+    unittest.main()
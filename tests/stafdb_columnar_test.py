@@ -0,0 +1,114 @@
+""" Tests for converting the stafdb csvs to the columnar backend """
+import json
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from stafdb.staf_factory import COLUMNAR_BACKEND, StafFactory
+from stafdb.stafdb_access_objects import (
+    DataAccessObject,
+    ProcessAccessObject,
+    StafAccessObject)
+from stafdb.stafdb_columnar import (
+    ColumnarAccessObject,
+    ColumnarDataAccessObject,
+    ColumnarProcessAccessObject,
+    ColumnarStafAccessObject,
+    convert_to_columnar,
+    uncertainty_from_record)
+from stafdb.stafdb_uncertainty_decoder import uncertainty_from_dict
+from testhelper.test_helper import copy_stafdb
+
+
+class TestConvertToColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = copy_stafdb()
+        self.db_folder = str(Path(self.db_dir.name).joinpath('stafdb'))
+
+        convert_to_columnar(self.db_folder)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def test_records_round_trip(self):
+        for csv_class, columnar_class, get_by_id, num_rows in [
+                (StafAccessObject, ColumnarStafAccessObject,
+                 'get_staf_by_id', 3),
+                (ProcessAccessObject, ColumnarProcessAccessObject,
+                 'get_process_by_id', 4)]:
+            csv_ao = csv_class(self.db_folder)
+            columnar_ao = columnar_class(self.db_folder)
+
+            self.assertEqual(num_rows, len(columnar_ao))
+
+            for row_id in range(1, num_rows + 1):
+                csv_record = getattr(csv_ao, get_by_id)(str(row_id))
+                columnar_record = getattr(columnar_ao, get_by_id)(
+                    str(row_id))
+
+                self.assertEqual(
+                    {column: str(value)
+                     for column, value in csv_record.items()},
+                    {column: str(value)
+                     for column, value in columnar_record.items()})
+
+    def test_uncertainties_round_trip(self):
+        csv_dao = DataAccessObject(self.db_folder)
+        columnar_dao = ColumnarDataAccessObject(self.db_folder)
+
+        for staf_id in ('1', '2', '3'):
+            csv_records = csv_dao.get_data_by_stafid(staf_id)
+            columnar_records = columnar_dao.get_data_by_stafid(staf_id)
+
+            self.assertEqual(len(csv_records), len(columnar_records))
+
+            for csv_record, columnar_record in \
+                    zip(csv_records, columnar_records):
+                self.assertEqual(
+                    csv_record['datum_id'], columnar_record['datum_id'])
+                self.assertEqual(
+                    csv_record['quantity'], columnar_record['quantity'])
+
+                expected = uncertainty_from_dict(
+                    json.loads(csv_record['uncertainty_json']))
+                uncertainty = uncertainty_from_record(columnar_record)
+
+                self.assertIs(type(expected), type(uncertainty))
+                self.assertEqual(vars(expected), vars(uncertainty))
+
+    def test_find_staf_ids_matches_csv(self):
+        csv_stao = StafAccessObject(self.db_folder)
+        columnar_stao = ColumnarStafAccessObject(self.db_folder)
+
+        for query in [{}, {'space_id': '1'}, {'space_id': '2'},
+                      {'timeframe_id': '1', 'material_id': '1'}]:
+            self.assertEqual(
+                csv_stao.find_staf_ids(**query),
+                columnar_stao.find_staf_ids(**query))
+
+    def test_factory_reads_rows_without_whole_tables(self):
+        csv_stafs = StafFactory(self.db_folder).build_stafs(['1', '2', '3'])
+
+        staf_factory = StafFactory(self.db_folder, backend=COLUMNAR_BACKEND)
+        with mock.patch.object(
+                ColumnarAccessObject,
+                'get_table',
+                side_effect=AssertionError("Whole table read")):
+            stafs = staf_factory.build_stafs(['1', '2', '3'])
+
+        for csv_staf, staf in zip(csv_stafs, stafs):
+            self.assertEqual(csv_staf.name, staf.name)
+            self.assertEqual(csv_staf.origin_process.name,
+                             staf.origin_process.name)
+            self.assertEqual(
+                csv_staf.staf_reference.material.stafdb_id,
+                staf.staf_reference.material.stafdb_id)
+
+            material = csv_staf.staf_reference.material
+            self.assertEqual(csv_staf.get_value(material).quantity,
+                             staf.get_value(material).quantity)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+""" Tests for finding stafs by origin space, timeframe and material """
+import unittest
+from itertools import product
+
+from stafdb.staf_factory import StafFactory
+from stafdb.stafdb_access_objects import StafAccessObject
+from stafdb.stafdb_session import StafdbSession
+
+DB_FOLDER = 'csvs_test'
+
+
+class TestFindStafIds(unittest.TestCase):
+
+    def test_session_and_table_scan_match(self):
+        session_stao = StafAccessObject(DB_FOLDER, StafdbSession())
+        stao = StafAccessObject(DB_FOLDER)
+
+        query_ids = [None, '1', '2', '3']
+        for space_id, timeframe_id, material_id in \
+                product(query_ids, repeat=3):
+            self.assertEqual(
+                stao.find_staf_ids(space_id, timeframe_id, material_id),
+                session_stao.find_staf_ids(
+                    space_id, timeframe_id, material_id))
+
+    def test_staf_ids_by_origin_space(self):
+        stao = StafAccessObject(DB_FOLDER, StafdbSession())
+
+        self.assertEqual(['1', '2', '3'], stao.find_staf_ids())
+        self.assertEqual(['2', '3'], stao.find_staf_ids(space_id='1'))
+        self.assertEqual(['1'], stao.find_staf_ids(space_id='2'))
+        self.assertEqual([], stao.find_staf_ids(material_id='2'))
+
+    def test_factory_finds_stafs(self):
+        staf_factory = StafFactory(DB_FOLDER)
+
+        self.assertEqual(
+            ['2', '3'],
+            staf_factory.find_stafs(space_id='1', build=False))
+
+        stafs = staf_factory.find_stafs(space_id='1')
+        self.assertEqual(['Stock1', 'Flow2'], [staf.name for staf in stafs])
+
+
+if __name__ == '__main__':
+    unittest.main()
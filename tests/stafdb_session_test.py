@@ -0,0 +1,99 @@
+""" Tests for the in memory cache of the stafdb tables """
+import os
+import unittest
+from pathlib import Path
+
+from stafdb.staf_factory import StafFactory
+from stafdb.stafdb_session import StafdbSession
+from testhelper.test_helper import copy_stafdb
+
+
+class TestStafdbSession(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = copy_stafdb()
+        self.staf_path = Path(self.db_dir.name).joinpath(
+            'stafdb', 'stafdb_staf.csv')
+
+        self.session = StafdbSession()
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def append_staf_row(self, touch=True):
+        with open(self.staf_path, 'a') as staf_file:
+            staf_file.write('Flow3,Flow,1,1,1,1,4,2\n')
+
+        if touch:
+            # Later than the load, so the change is always detected
+            stat = os.stat(self.staf_path)
+            os.utime(self.staf_path, (stat.st_atime, stat.st_mtime + 10))
+
+    def test_table_is_loaded_once(self):
+        table = self.session.get_table(self.staf_path)
+
+        self.assertIs(table, self.session.get_table(self.staf_path))
+
+    def test_record_and_positions_by_values(self):
+        record = self.session.get_record(self.staf_path, '2')
+        self.assertEqual('Stock1', record['name'])
+
+        positions = self.session.get_positions_by_values(
+            self.staf_path, ('process_id_destination',), (2,))
+        self.assertEqual([0, 1], positions)
+
+        with self.assertRaises(IndexError):
+            self.session.get_record(self.staf_path, '4')
+
+    def test_invalidate_reloads_table_and_indexes(self):
+        table = self.session.get_table(self.staf_path)
+        self.session.get_positions_by_values(
+            self.staf_path, ('process_id_destination',), (2,))
+
+        self.append_staf_row()
+
+        # Still the table as loaded until it is invalidated
+        self.assertIs(table, self.session.get_table(self.staf_path))
+
+        self.session.invalidate(self.staf_path)
+
+        self.assertEqual(4, len(self.session.get_table(self.staf_path)))
+        self.assertEqual('Flow3',
+                         self.session.get_record(self.staf_path, '4')['name'])
+        self.assertEqual(
+            [0, 1, 3],
+            self.session.get_positions_by_values(
+                self.staf_path, ('process_id_destination',), (2,)))
+
+    def test_refresh_invalidates_changed_tables(self):
+        self.session.get_table(self.staf_path)
+
+        self.assertEqual([], self.session.refresh())
+
+        self.append_staf_row()
+
+        self.assertEqual([self.staf_path], self.session.refresh())
+        self.assertEqual(4, len(self.session.get_table(self.staf_path)))
+
+    def test_refresh_detects_append_with_same_mtime(self):
+        self.session.get_table(self.staf_path)
+        stat = os.stat(self.staf_path)
+
+        self.append_staf_row(touch=False)
+        os.utime(self.staf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertEqual([self.staf_path], self.session.refresh())
+
+    def test_factory_sees_changes_on_disk(self):
+        staf_factory = StafFactory(
+            str(self.staf_path.parent), self.session)
+
+        self.assertEqual('Flow1', staf_factory.build_staf('1').name)
+
+        self.append_staf_row()
+
+        self.assertEqual('Flow3', staf_factory.build_staf('4').name)
+
+
+if __name__ == '__main__':
+    unittest.main()
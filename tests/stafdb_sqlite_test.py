@@ -0,0 +1,104 @@
+""" Tests for importing the stafdb csvs into the SQLite backend """
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from stafdb.staf_factory import SQLITE_BACKEND, StafFactory
+from stafdb.stafdb_access_objects import DataAccessObject, StafAccessObject
+from stafdb.stafdb_sqlite import (
+    SqliteAccessObject,
+    SqliteDataAccessObject,
+    SqliteStafAccessObject,
+    import_csvs_to_sqlite)
+from testhelper.test_helper import copy_stafdb
+
+
+class TestImportCsvsToSqlite(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = copy_stafdb()
+        self.db_folder = str(Path(self.db_dir.name).joinpath('stafdb'))
+
+        self.db_path = import_csvs_to_sqlite(self.db_folder)
+
+        self.csv_stao = StafAccessObject(self.db_folder)
+        self.sqlite_stao = SqliteStafAccessObject(self.db_folder)
+
+    def tearDown(self):
+        self.sqlite_stao.pool.close()
+        self.db_dir.cleanup()
+
+    def test_import_leaves_only_the_database(self):
+        self.assertTrue(self.db_path.exists())
+        self.assertEqual(
+            [], list(Path(self.db_folder).glob('*.sqlite.tmp')))
+
+    def test_staf_records_match_csv(self):
+        for staf_id in ('1', '2', '3'):
+            csv_record = self.csv_stao.get_staf_by_id(staf_id)
+            sqlite_record = self.sqlite_stao.get_staf_by_id(staf_id)
+
+            self.assertEqual(
+                {column: str(value) for column, value in csv_record.items()},
+                {column: str(value)
+                 for column, value in sqlite_record.items()})
+
+        with self.assertRaises(IndexError):
+            self.sqlite_stao.get_staf_by_id('4')
+
+    def test_find_staf_ids_matches_csv(self):
+        for query in [{}, {'space_id': '1'}, {'space_id': '2'},
+                      {'space_id': '1', 'timeframe_id': '1',
+                       'material_id': '1'},
+                      {'material_id': '2'}]:
+            self.assertEqual(
+                self.csv_stao.find_staf_ids(**query),
+                self.sqlite_stao.find_staf_ids(**query))
+
+    def test_data_records_match_csv(self):
+        csv_dao = DataAccessObject(self.db_folder)
+        sqlite_dao = SqliteDataAccessObject(self.db_folder)
+
+        for staf_id in ('1', '2', '3'):
+            csv_records = csv_dao.get_data_by_stafid(staf_id)
+            sqlite_records = sqlite_dao.get_data_by_stafid(staf_id)
+
+            self.assertEqual(
+                [(record['datum_id'], record['uncertainty_json'])
+                 for record in csv_records],
+                [(record['datum_id'], record['uncertainty_json'])
+                 for record in sqlite_records])
+
+    def test_rows_by_ids_and_values(self):
+        rows = self.sqlite_stao.get_rows_by_ids([3, 1, 7], ['name'])
+        self.assertEqual([1, 3], list(rows['id']))
+        self.assertEqual(['Flow1', 'Flow2'], list(rows['name']))
+
+        rows = self.sqlite_stao.get_rows_by_values(
+            'process_id_destination', [2])
+        self.assertEqual([1, 2], list(rows['id']))
+
+        self.assertEqual(
+            0, len(self.sqlite_stao.get_rows_by_ids([])))
+
+    def test_factory_builds_staf_without_reading_tables(self):
+        csv_staf = StafFactory(self.db_folder).build_staf('2')
+
+        staf_factory = StafFactory(self.db_folder, backend=SQLITE_BACKEND)
+        with mock.patch.object(
+                SqliteAccessObject,
+                '_load_table',
+                side_effect=AssertionError("Whole table read")):
+            staf = staf_factory.build_staf('2')
+
+        self.assertEqual(csv_staf.name, staf.name)
+        self.assertEqual(csv_staf.destination_process.name,
+                         staf.destination_process.name)
+
+        material = csv_staf.staf_reference.material
+        self.assertEqual(csv_staf.get_value(material).quantity,
+                         staf.get_value(material).quantity)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+""" Tests for decoding the uncertainty json column of the stafdb """
+import pickle
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from bayesumis.umis_data_models import (
+    LognormalUncertainty,
+    NormalUncertainty,
+    StockValue,
+    UniformUncertainty)
+from stafdb import stafdb_uncertainty_decoder
+from stafdb.staf_factory import StafFactory
+from stafdb.stafdb_uncertainty_decoder import (
+    UNCERTAINTY_DISTRIBUTIONS,
+    decode_uncertainty_column)
+
+UNCERTAINTY_STRINGS = [
+    '{"distribution": "Logormal", "mean": 2.0, "standard_deviation": 0.5}',
+    '{"distribution": "Lognormal", "mean": 3.0, "standard_deviation": 0.25}',
+    '{"distribution": "Normal", "mean": 100.0, "standard_deviation": 10.0}',
+    '{"distribution": "Uniform", "lower": 0.0, "upper": 500.0}']
+
+
+class TestDecodeUncertaintyColumn(unittest.TestCase):
+
+    def test_codes_include_misspelt_lognormal(self):
+        uncertainties = decode_uncertainty_column(UNCERTAINTY_STRINGS)
+
+        lognormal = UNCERTAINTY_DISTRIBUTIONS.index('Lognormal')
+        normal = UNCERTAINTY_DISTRIBUTIONS.index('Normal')
+        uniform = UNCERTAINTY_DISTRIBUTIONS.index('Uniform')
+
+        self.assertEqual(np.int8, uncertainties.codes.dtype)
+        np.testing.assert_array_equal(
+            [lognormal, lognormal, normal, uniform], uncertainties.codes)
+
+    def test_unused_params_are_nan(self):
+        params = decode_uncertainty_column(UNCERTAINTY_STRINGS).params
+
+        np.testing.assert_array_equal(
+            [2.0, 3.0, 100.0, np.nan], params['mean'])
+        np.testing.assert_array_equal(
+            [0.5, 0.25, 10.0, np.nan], params['standard_deviation'])
+        np.testing.assert_array_equal(
+            [np.nan, np.nan, np.nan, 0.0], params['lower'])
+        np.testing.assert_array_equal(
+            [np.nan, np.nan, np.nan, 500.0], params['upper'])
+
+    def test_uncertainty_of_each_row(self):
+        uncertainties = decode_uncertainty_column(UNCERTAINTY_STRINGS)
+
+        self.assertEqual(4, len(uncertainties))
+
+        for row_ind, mean, standard_deviation in [(0, 2.0, 0.5),
+                                                  (1, 3.0, 0.25)]:
+            uncertainty = uncertainties[row_ind]
+            self.assertIsInstance(uncertainty, LognormalUncertainty)
+            self.assertEqual(mean, uncertainty.mean)
+            self.assertEqual(standard_deviation,
+                             uncertainty.standard_deviation)
+
+        normal = uncertainties[2]
+        self.assertIsInstance(normal, NormalUncertainty)
+        self.assertEqual(100.0, normal.mean)
+        self.assertEqual(10.0, normal.standard_deviation)
+
+        uniform = uncertainties[3]
+        self.assertIsInstance(uniform, UniformUncertainty)
+        self.assertEqual(0.0, uniform.lower)
+        self.assertEqual(500.0, uniform.upper)
+
+        # Built once and then reused
+        self.assertIs(normal, uncertainties[2])
+
+    def test_unknown_distribution_raises(self):
+        uncertainty_strings = UNCERTAINTY_STRINGS + [
+            '{"distribution": "Gamma", "mean": 1.0}']
+
+        with self.assertRaises(ValueError):
+            decode_uncertainty_column(uncertainty_strings)
+
+
+class TestFactoryUncertainties(unittest.TestCase):
+
+    def setUp(self):
+        self.create_uncertainty = mock.patch.object(
+            stafdb_uncertainty_decoder,
+            'create_uncertainty',
+            wraps=stafdb_uncertainty_decoder.create_uncertainty).start()
+        self.addCleanup(mock.patch.stopall)
+
+        self.staf_factory = StafFactory('csvs_test')
+
+    def test_uncertainty_is_built_on_access(self):
+        flow = self.staf_factory.build_staf('1')
+        self.assertEqual(0, self.create_uncertainty.call_count)
+
+        value = flow.get_value(flow.staf_reference.material)
+        self.assertEqual(0, self.create_uncertainty.call_count)
+
+        uncertainty = value.uncertainty
+        self.assertIsInstance(uncertainty, NormalUncertainty)
+        self.assertEqual(100.0, uncertainty.mean)
+        self.assertIs(uncertainty, value.uncertainty)
+        self.assertEqual(1, self.create_uncertainty.call_count)
+
+    def test_stock_value_is_pickled_as_plain_value(self):
+        stock = self.staf_factory.build_staf('2')
+        value = stock.get_value(stock.staf_reference.material)
+
+        unpickled = pickle.loads(pickle.dumps(value))
+
+        self.assertIs(StockValue, type(unpickled))
+        self.assertEqual('Net', unpickled.stock_type)
+        self.assertIsInstance(unpickled.uncertainty, UniformUncertainty)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+""" Tests for refreshing watched diagrams from changed stafdb csvs """
+import os
+import tempfile
+import unittest
+
+from bayesumis.umis_model_cache import UmisModelCache
+from stafdb.staf_factory import StafFactory
+from stafdb.stafdb_watcher import StafdbWatcher
+
+STAFDB_CSVS = {
+    'stafdb_material.csv': [
+        'name,code,material_id_parent,is_separator',
+        'Test Material,Tes,None,False'],
+    'stafdb_process.csv': [
+        'name,code,process_id_parent,is_separator,process_type',
+        'TP1: Test Process 1,TP1,None,False,Distribution',
+        'TP2: Test Process 2,TP2,None,False,Transformation',
+        'TP3: Test Process 3,TP3,None,False,Transformation'],
+    'stafdb_reference_space.csv': [
+        'name',
+        'Sp1'],
+    'stafdb_reference_timeframe.csv': [
+        'name,timeframe_start,timeframe_end',
+        'TF1,2000,2000',
+        'TF2,2001,2001'],
+    'stafdb_staf.csv': [
+        'name,is_stock_or_is_flow,reference_space_id_origin,'
+        + 'reference_space_id_destination,reference_timeframe,'
+        + 'material_id_reference_material,process_id_origin,'
+        + 'process_id_destination',
+        'Inflow TF1,Flow,1,1,1,1,1,2',
+        'Outflow TF1,Flow,1,1,1,1,2,3',
+        'Inflow TF2,Flow,1,1,2,1,1,2',
+        'Outflow TF2,Flow,1,1,2,1,2,3']}
+
+
+def get_data_csv(outflow_tf1_mean):
+    """ Data of every staf, the outflow of TF1 with the given mean """
+    means = [100.0, outflow_tf1_mean, 200.0, 150.0]
+
+    return ['quantity,unit,material_id,name,staf_id,stock_type,'
+            + 'uncertainty_json'] + [
+        '{0},g,1,Data_{1},{1},Flow,"{{""distribution"": ""Normal"", '
+        '""mean"": {0}, ""standard_deviation"": 10.0}}"'.format(
+            mean, staf_id)
+        for staf_id, mean in enumerate(means, start=1)]
+
+
+class TestStafdbWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.db_dir = tempfile.TemporaryDirectory()
+
+        for file_name, lines in STAFDB_CSVS.items():
+            self.write_csv(file_name, lines)
+
+        self.write_csv('stafdb_data.csv', get_data_csv(90.0))
+
+        self.staf_factory = StafFactory(self.db_dir.name)
+
+    def tearDown(self):
+        self.db_dir.cleanup()
+
+    def write_csv(self, file_name, lines, touch=True):
+        file_path = os.path.join(self.db_dir.name, file_name)
+
+        with open(file_path, 'w') as csv_file:
+            csv_file.write('\n'.join(lines) + '\n')
+
+        if touch:
+            # Later than any earlier write, so the change is always detected
+            stat = os.stat(file_path)
+            os.utime(file_path, (stat.st_atime, stat.st_mtime + 10))
+
+    def get_staf_means(self, math_model):
+        return {
+            (origin_id, dest_id): uncertainty.mean
+            for origin_id, dest_observations
+            in math_model.get_observations()['staf'].items()
+            for dest_id, uncertainty in dest_observations.items()}
+
+    def test_edit_leaves_diagram_of_same_structure_unchanged(self):
+        watcher = StafdbWatcher(self.staf_factory, UmisModelCache())
+        material = self.staf_factory.build_material('1')
+
+        for name, staf_ids, timeframe_id in [
+                ('TF1', ['1', '2'], '1'),
+                ('TF2', ['3', '4'], '2')]:
+            watcher.add_diagram(
+                name,
+                staf_ids[:1],
+                staf_ids[1:],
+                [],
+                material,
+                self.staf_factory.build_timeframe(timeframe_id))
+
+        tf2_means = self.get_staf_means(watcher.get_model('TF2'))
+
+        self.write_csv('stafdb_data.csv', get_data_csv(60.0))
+        refreshed = watcher.poll()
+
+        self.assertEqual({'TF1': {'2'}}, refreshed)
+        self.assertEqual(
+            [60.0], list(self.get_staf_means(watcher.get_model('TF1'))
+                         .values()))
+        self.assertEqual(
+            tf2_means, self.get_staf_means(watcher.get_model('TF2')))
+        self.assertEqual([150.0], list(tf2_means.values()))
+
+    def test_edit_in_same_mtime_tick_is_detected(self):
+        watcher = StafdbWatcher(self.staf_factory, UmisModelCache())
+
+        watcher.add_diagram(
+            'TF1',
+            ['1'],
+            ['2'],
+            [],
+            self.staf_factory.build_material('1'),
+            self.staf_factory.build_timeframe('1'))
+
+        data_path = os.path.join(self.db_dir.name, 'stafdb_data.csv')
+        stat = os.stat(data_path)
+
+        # Same size and modification time as the snapshot
+        self.write_csv('stafdb_data.csv', get_data_csv(80.0), touch=False)
+        os.utime(data_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        self.assertEqual({'TF1': {'2'}}, watcher.poll())
+        self.assertEqual(
+            [80.0], list(self.get_staf_means(watcher.get_model('TF1'))
+                         .values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+""" Tests for splitting a UmisDiagram into its subsystems """
+import unittest
+
+from bayesumis.umis_diagram import UmisDiagram
+from testhelper import umis_builders
+
+
+class TestUmisDiagramSubsystems(unittest.TestCase):
+
+    def build_subsystems_diagram(self, n_subsystems, outflow_only=False):
+        (external_inflows,
+         internal_flows,
+         external_outflows,
+         stocks,
+         _,
+         _) = umis_builders.get_umis_diagram_subsystems_test(
+             n_subsystems, outflow_only)
+
+        internal_stafs = set.union(internal_flows, stocks)
+
+        return UmisDiagram(external_inflows, internal_stafs, external_outflows)
+
+    def test_disconnected_subsystems_are_split(self):
+        umis_diagram = self.build_subsystems_diagram(3)
+
+        subsystems = umis_diagram.get_subsystems()
+
+        self.assertEqual(3, len(subsystems))
+        for subsystem in subsystems:
+            self.assertEqual(1, len(subsystem.get_external_inflows()))
+            self.assertEqual(4, len(subsystem.get_process_stafs_dict()))
+
+    def test_subsystems_partition_the_diagram(self):
+        umis_diagram = self.build_subsystems_diagram(2)
+
+        subsystems = umis_diagram.get_subsystems()
+
+        inflows = set()
+        processes = set()
+        for subsystem in subsystems:
+            inflows |= subsystem.get_external_inflows()
+            processes |= set(subsystem.get_process_stafs_dict())
+
+        self.assertEqual(umis_diagram.get_external_inflows(), inflows)
+        self.assertEqual(
+            set(umis_diagram.get_process_stafs_dict()), processes)
+
+    def test_connected_diagram_is_one_subsystem(self):
+        umis_diagram = self.build_subsystems_diagram(1)
+
+        subsystems = umis_diagram.get_subsystems()
+
+        self.assertEqual(1, len(subsystems))
+
+    def test_outflow_only_process_is_own_subsystem(self):
+        umis_diagram = self.build_subsystems_diagram(2, outflow_only=True)
+
+        subsystems = umis_diagram.get_subsystems()
+
+        self.assertEqual(3, len(subsystems))
+
+        outflows = set()
+        for subsystem in subsystems:
+            outflows |= subsystem.get_external_outflows()
+
+        self.assertEqual(umis_diagram.get_external_outflows(), outflows)
+
+        outflow_subsystems = [
+            subsystem for subsystem in subsystems
+            if subsystem.get_external_outflows()]
+
+        self.assertEqual(1, len(outflow_subsystems))
+        self.assertEqual(
+            set(), outflow_subsystems[0].get_external_inflows())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+""" Tests for the math model of a diagram over a series of timeframes """
+import unittest
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import Constant, NormalUncertainty
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_dynamic_model import DynamicUmisMathModel
+from bayesumis.umis_math_model import UmisMathModel
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+STOCK_MEANS = [20, 25, 30]
+""" Observed net stock of each year of the series """
+
+
+def build_diagram(builder, *builder_args):
+    (external_inflows,
+     internal_flows,
+     external_outflows,
+     stocks,
+     _,
+     _) = builder(*builder_args)
+
+    return UmisDiagram(
+        external_inflows,
+        set.union(internal_flows, stocks),
+        external_outflows)
+
+
+class TestDynamicUmisMathModel(unittest.TestCase):
+
+    def setUp(self):
+        test_db = DbStub()
+        self.ref_material = test_db.get_material_by_num(1)
+        self.ref_times = [
+            test_db.get_time_by_num(1) for _ in STOCK_MEANS]
+
+        self.year_diagrams = [
+            build_diagram(umis_builders.get_umis_diagram_stocked, stock_mean)
+            for stock_mean in STOCK_MEANS]
+
+    def build_dynamic_model(self, umis_diagrams=None, **model_kwargs):
+        if umis_diagrams is None:
+            umis_diagrams = self.year_diagrams
+
+        return DynamicUmisMathModel(
+            umis_diagrams,
+            self.ref_material,
+            self.ref_times,
+            **model_kwargs)
+
+    def get_staf_means(self, math_model, scenario):
+        return sorted(
+            uncertainty.mean
+            for dest_observations
+            in math_model.get_observations(scenario)['staf'].values()
+            for uncertainty in dest_observations.values())
+
+    def test_stock_levels_accumulate_stock_changes(self):
+        dynamic_model = self.build_dynamic_model(build_pm_model=False)
+        storage_id, = dynamic_model.storage_ids
+
+        dynamic_model = self.build_dynamic_model(
+            initial_stocks={storage_id: Constant(5)})
+
+        pm_model = dynamic_model.pm_model
+        stock_changes, stock_levels = pm_model.fastfn([
+            pm_model[DynamicUmisMathModel.STOCK_CHANGE_VAR_NAME],
+            pm_model[DynamicUmisMathModel.STOCK_LEVEL_VAR_NAME]])(
+                pm_model.test_point)
+
+        self.assertEqual((len(STOCK_MEANS), 1), stock_levels.shape)
+        self.assertFalse(np.allclose(0, stock_changes))
+        np.testing.assert_allclose(
+            5 + np.cumsum(stock_changes, axis=0), stock_levels)
+
+    def test_year_observations_land_in_their_scenario(self):
+        dynamic_model = self.build_dynamic_model(build_pm_model=False)
+
+        for year, stock_mean in enumerate(STOCK_MEANS):
+            staf_means = self.get_staf_means(dynamic_model.math_model, year)
+
+            self.assertIn(stock_mean, staf_means)
+            for other_mean in set(STOCK_MEANS) - {stock_mean}:
+                self.assertNotIn(other_mean, staf_means)
+
+    def test_single_diagram_is_repeated_for_every_year(self):
+        dynamic_model = self.build_dynamic_model(
+            self.year_diagrams[:1], build_pm_model=False)
+
+        for year in range(len(STOCK_MEANS)):
+            self.assertIn(
+                STOCK_MEANS[0],
+                self.get_staf_means(dynamic_model.math_model, year))
+
+    def test_mismatched_structures_are_rejected(self):
+        umis_diagrams = list(self.year_diagrams)
+        umis_diagrams[1] = build_diagram(
+            umis_builders.get_umis_diagram_stocked_with_tcs)
+
+        with self.assertRaises(ValueError):
+            self.build_dynamic_model(umis_diagrams, build_pm_model=False)
+
+    def test_wrong_number_of_diagrams_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.build_dynamic_model(
+                self.year_diagrams[:2], build_pm_model=False)
+
+    def test_out_of_range_years_are_rejected(self):
+        dynamic_model = self.build_dynamic_model(build_pm_model=False)
+        storage_id, = dynamic_model.storage_ids
+
+        for year in (-1, len(STOCK_MEANS)):
+            with self.assertRaises(ValueError):
+                self.build_dynamic_model(
+                    stock_level_observations={
+                        storage_id: {
+                            year: NormalUncertainty(
+                                mean=20, standard_deviation=1)}},
+                    build_pm_model=False)
+
+    def test_year_samples_select_the_year(self):
+        dynamic_model = self.build_dynamic_model()
+
+        with dynamic_model.pm_model:
+            trace = pm.sample(
+                draws=20,
+                tune=20,
+                chains=1,
+                cores=1,
+                random_seed=42,
+                progressbar=False)
+
+        for year in range(len(STOCK_MEANS)):
+            year_samples = dynamic_model.get_year_samples(trace, year)
+
+            for var_name in (UmisMathModel.STAF_VAR_NAME,
+                             DynamicUmisMathModel.STOCK_LEVEL_VAR_NAME):
+                np.testing.assert_array_equal(
+                    trace[var_name][:, year], year_samples[var_name])
+
+        num_processes = len(dynamic_model.math_model.get_process_ids())
+        self.assertEqual(
+            (20, num_processes, num_processes),
+            year_samples[UmisMathModel.STAF_VAR_NAME].shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
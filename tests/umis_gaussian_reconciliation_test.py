@@ -0,0 +1,103 @@
+""" Tests for the closed form reconciliation against NUTS """
+import unittest
+
+import numpy as np
+
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import GAUSSIAN_METHOD, NUTS_METHOD
+from bayesumis.umis_gaussian_reconciliation import (
+    GaussianReconciliationEngine)
+from bayesumis.umis_math_model import LOG_PARAMETERISATION, UmisMathModel
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+
+class TestGaussianReconciliation(unittest.TestCase):
+
+    def build_math_model(self, builder, **model_kwargs):
+        (external_inflows,
+         internal_flows,
+         external_outflows,
+         stocks,
+         material_reconc_table,
+         tc_observation_table) = builder()
+
+        umis_diagram = UmisDiagram(
+            external_inflows,
+            set.union(internal_flows, stocks),
+            external_outflows)
+
+        test_db = DbStub()
+
+        return UmisMathModel(
+            umis_diagram.get_external_inflows(),
+            umis_diagram.get_process_stafs_dict(),
+            umis_diagram.get_external_outflows(),
+            test_db.get_material_by_num(1),
+            test_db.get_time_by_num(1),
+            material_reconc_table,
+            tc_observation_table,
+            build_pm_model=False,
+            **model_kwargs)
+
+    def test_all_normal_diagram_qualifies(self):
+        math_model = self.build_math_model(
+            umis_builders.get_umis_diagram_all_normal_test)
+
+        engine = GaussianReconciliationEngine(math_model)
+
+        self.assertEqual([], engine.get_disqualifications())
+
+    def test_distribution_process_does_not_qualify(self):
+        math_model = self.build_math_model(
+            umis_builders.get_umis_diagram_gaussian_test)
+
+        reasons = GaussianReconciliationEngine(
+            math_model).get_disqualifications()
+
+        self.assertTrue(any("Dirichlet" in reason for reason in reasons))
+
+    def test_log_parameterisation_does_not_qualify(self):
+        math_model = self.build_math_model(
+            umis_builders.get_umis_diagram_all_normal_test,
+            parameterisation=LOG_PARAMETERISATION)
+
+        reasons = GaussianReconciliationEngine(
+            math_model).get_disqualifications()
+
+        self.assertTrue(any("truncated" in reason for reason in reasons))
+
+    def test_gaussian_fit_matches_nuts(self):
+        math_model = self.build_math_model(
+            umis_builders.get_umis_diagram_all_normal_test)
+
+        gaussian_fit = math_model.fit(method=GAUSSIAN_METHOD)
+        nuts_fit = math_model.fit(
+            method=NUTS_METHOD,
+            draws=2000,
+            tune=1000,
+            chains=2,
+            random_seed=42)
+
+        estimates = gaussian_fit.diagnostics['estimates']
+        standard_deviations = gaussian_fit.diagnostics['standard_deviations']
+
+        for varname in (UmisMathModel.INPUT_VAR_NAME,
+                        UmisMathModel.STAF_VAR_NAME):
+            nuts_samples = nuts_fit[varname]
+
+            np.testing.assert_allclose(
+                np.mean(nuts_samples, axis=0),
+                estimates[varname],
+                rtol=0.02,
+                atol=0.5)
+
+            np.testing.assert_allclose(
+                np.std(nuts_samples, axis=0),
+                standard_deviations[varname],
+                rtol=0.15,
+                atol=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+""" Tests for material values loaded on first access """
+import pickle
+import unittest
+
+from bayesumis.umis_data_models import (
+    LazyMaterialValues,
+    Material,
+    NormalUncertainty,
+    Value)
+
+IRON = Material('M1', 'CodeM1', 'Iron', 'Parent', False)
+NICKEL = Material('M2', 'CodeM2', 'Nickel', 'Parent', False)
+ZINC = Material('M3', 'CodeM3', 'Zinc', 'Parent', False)
+
+IRON_VALUE = Value('V1', 100, NormalUncertainty(100, 10), 'g')
+NICKEL_VALUE = Value('V2', 20, NormalUncertainty(20, 2), 'g')
+
+
+class CountingLoader():
+    """ Loads the values of every material, counting its calls """
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def __call__(self):
+        self.n_calls += 1
+        return {IRON: IRON_VALUE, NICKEL: NICKEL_VALUE}
+
+
+class TestLazyMaterialValues(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = CountingLoader()
+        self.values = LazyMaterialValues(self.loader, {IRON: IRON_VALUE})
+
+    def test_prefetched_material_does_not_load(self):
+        self.assertIs(IRON_VALUE, self.values.get(IRON))
+
+        self.assertFalse(self.values.is_loaded)
+        self.assertEqual(0, self.loader.n_calls)
+
+    def test_missing_material_loads_once(self):
+        self.assertIs(NICKEL_VALUE, self.values.get(NICKEL))
+        self.assertIsNone(self.values.get(ZINC))
+        self.assertEqual({IRON, NICKEL}, set(self.values.keys()))
+
+        self.assertTrue(self.values.is_loaded)
+        self.assertEqual(1, self.loader.n_calls)
+
+    def test_material_known_to_have_no_value_does_not_load(self):
+        values = LazyMaterialValues(self.loader, {ZINC: None})
+
+        self.assertIsNone(values.get(ZINC))
+        self.assertEqual(0, self.loader.n_calls)
+
+    def test_pickling_loads_values_and_drops_loader(self):
+        unpickled = pickle.loads(pickle.dumps(self.values))
+
+        self.assertEqual(1, self.loader.n_calls)
+        self.assertTrue(unpickled.is_loaded)
+        self.assertEqual({IRON, NICKEL}, set(unpickled.keys()))
+        self.assertEqual(
+            NICKEL_VALUE.quantity, unpickled.get(NICKEL).quantity)
+        self.assertIsNone(unpickled.get(ZINC))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+""" Tests for reusing compiled math models of diagrams of one structure """
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_math_model import UmisMathModel
+from bayesumis.umis_model_cache import UmisModelCache
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+STALE_PICKLES = {
+    'truncated': b'\x80\x04\x95',
+    'moved_module': b'cno_such_bayesumis_module\nUmisMathModel\n.',
+    'removed_class': b'cbayesumis.umis_math_model\nNoSuchMathModel\n.'}
+""" Pickles written by older versions of the code """
+
+
+class TestUmisModelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+        test_db = DbStub()
+        self.ref_material = test_db.get_material_by_num(1)
+        self.ref_time = test_db.get_time_by_num(1)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def get_model(self, model_cache, builder, *builder_args):
+        (external_inflows,
+         internal_flows,
+         external_outflows,
+         stocks,
+         material_reconc_table,
+         tc_observation_table) = builder(*builder_args)
+
+        umis_diagram = UmisDiagram(
+            external_inflows,
+            set.union(internal_flows, stocks),
+            external_outflows)
+
+        return model_cache.get_model(
+            umis_diagram.get_external_inflows(),
+            umis_diagram.get_process_stafs_dict(),
+            umis_diagram.get_external_outflows(),
+            self.ref_material,
+            self.ref_time,
+            material_reconc_table=material_reconc_table,
+            tc_observation_table=tc_observation_table)
+
+    def get_staf_means(self, math_model):
+        return sorted(
+            uncertainty.mean
+            for dest_observations
+            in math_model.get_observations()['staf'].values()
+            for uncertainty in dest_observations.values())
+
+    def get_cache_files(self):
+        return set(os.listdir(self.cache_dir.name))
+
+    def test_same_structure_reuses_model_with_new_observations(self):
+        model_cache = UmisModelCache()
+
+        math_model = self.get_model(
+            model_cache, umis_builders.get_umis_diagram_all_normal_test, 100)
+        self.assertIn(100, self.get_staf_means(math_model))
+
+        reused_model = self.get_model(
+            model_cache, umis_builders.get_umis_diagram_all_normal_test, 90)
+
+        self.assertIs(math_model, reused_model)
+        self.assertIn(90, self.get_staf_means(reused_model))
+        self.assertNotIn(100, self.get_staf_means(reused_model))
+
+    def test_pickled_model_is_loaded_with_new_observations(self):
+        self.get_model(
+            UmisModelCache(self.cache_dir.name),
+            umis_builders.get_umis_diagram_all_normal_test,
+            100)
+
+        with mock.patch.object(
+                UmisMathModel,
+                'create_pm_model',
+                side_effect=AssertionError("Model rebuilt")):
+            math_model = self.get_model(
+                UmisModelCache(self.cache_dir.name),
+                umis_builders.get_umis_diagram_all_normal_test,
+                90)
+
+        self.assertIsNotNone(math_model.pm_model)
+        self.assertIn(90, self.get_staf_means(math_model))
+
+    def test_least_recently_used_model_is_evicted(self):
+        model_cache = UmisModelCache(self.cache_dir.name, max_entries=2)
+
+        normal_model = self.get_model(
+            model_cache, umis_builders.get_umis_diagram_all_normal_test)
+        gaussian_model = self.get_model(
+            model_cache, umis_builders.get_umis_diagram_gaussian_test)
+
+        # Now more recently used than the gaussian model
+        self.get_model(
+            model_cache, umis_builders.get_umis_diagram_all_normal_test)
+
+        lognormal_model = self.get_model(
+            model_cache, umis_builders.get_umis_diagram_lognormal_test)
+
+        self.assertEqual(
+            {math_model.get_structure_fingerprint()
+             + UmisModelCache.CACHE_FILE_EXTENSION
+             for math_model in (normal_model, lognormal_model)},
+            self.get_cache_files())
+
+        self.assertIs(
+            normal_model,
+            self.get_model(
+                model_cache, umis_builders.get_umis_diagram_all_normal_test))
+        self.assertIsNot(
+            gaussian_model,
+            self.get_model(
+                model_cache, umis_builders.get_umis_diagram_gaussian_test))
+
+    def test_stale_pickles_are_replaced(self):
+        math_model = self.get_model(
+            UmisModelCache(), umis_builders.get_umis_diagram_all_normal_test)
+        cache_file = (math_model.get_structure_fingerprint()
+                      + UmisModelCache.CACHE_FILE_EXTENSION)
+        cache_path = os.path.join(self.cache_dir.name, cache_file)
+
+        for pickle_bytes in STALE_PICKLES.values():
+            with open(cache_path, 'wb') as stale_file:
+                stale_file.write(pickle_bytes)
+
+            math_model = self.get_model(
+                UmisModelCache(self.cache_dir.name),
+                umis_builders.get_umis_diagram_all_normal_test)
+
+            self.assertIsNotNone(math_model.pm_model)
+
+            with open(cache_path, 'rb') as cache_file:
+                self.assertIsInstance(pickle.load(cache_file), UmisMathModel)
+
+
+if __name__ == '__main__':
+    unittest.main()
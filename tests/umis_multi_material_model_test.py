@@ -0,0 +1,119 @@
+""" Tests for balancing several materials of one diagram together """
+import unittest
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import NormalUncertainty
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_math_model import (
+    NO_TC_POOLING,
+    SHARED_TC_POOLING,
+    UmisMathModel)
+from bayesumis.umis_multi_material_model import MultiMaterialUmisMathModel
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+MATERIAL_STAF_MEANS = {1: [60, 80, 100], 2: [25, 40, 80]}
+""" Means of the normal staf observations of each material """
+
+MATERIAL_CC_MEANS = {1: [0.9], 2: [0.4]}
+""" Means of the normal cc observations of each material """
+
+
+class TestMultiMaterialUmisMathModel(unittest.TestCase):
+
+    def setUp(self):
+        test_db = DbStub()
+        self.materials = {
+            material_num: test_db.get_material_by_num(material_num)
+            for material_num in MATERIAL_STAF_MEANS}
+        self.ref_time = test_db.get_time_by_num(1)
+
+    def build_model(self, **model_kwargs):
+        (external_inflows,
+         internal_flows,
+         external_outflows,
+         stocks,
+         material_reconc_tables,
+         tc_observation_table) = \
+            umis_builders.get_umis_diagram_multi_material_test()
+
+        umis_diagram = UmisDiagram(
+            external_inflows,
+            set.union(internal_flows, stocks),
+            external_outflows)
+
+        return MultiMaterialUmisMathModel(
+            umis_diagram,
+            list(self.materials.values()),
+            self.ref_time,
+            material_reconc_tables=material_reconc_tables,
+            tc_observation_table=tc_observation_table,
+            **model_kwargs)
+
+    def sample(self, multi_material_model):
+        with multi_material_model.pm_model:
+            return pm.sample(
+                draws=20,
+                tune=20,
+                chains=1,
+                cores=1,
+                random_seed=42,
+                progressbar=False)
+
+    def get_normal_means(self, observations):
+        return sorted(
+            uncertainty.mean
+            for dest_observations in observations.values()
+            for uncertainty in dest_observations.values()
+            if isinstance(uncertainty, NormalUncertainty))
+
+    def test_material_observations_land_in_their_scenario(self):
+        multi_material_model = self.build_model(build_pm_model=False)
+
+        for material_num, material in self.materials.items():
+            observations = multi_material_model.math_model.get_observations(
+                multi_material_model.get_material_ind(material))
+
+            self.assertEqual(
+                MATERIAL_STAF_MEANS[material_num],
+                self.get_normal_means(observations['staf']))
+            self.assertEqual(
+                MATERIAL_CC_MEANS[material_num],
+                self.get_normal_means(observations['cc']))
+
+    def test_shared_pooling_gives_same_tcs_in_every_material(self):
+        tc_samples = {}
+        for tc_pooling in (NO_TC_POOLING, SHARED_TC_POOLING):
+            trace = self.sample(self.build_model(tc_pooling=tc_pooling))
+            tc_samples[tc_pooling] = trace[UmisMathModel.TC_VAR_NAME]
+
+        shared_tcs = tc_samples[SHARED_TC_POOLING]
+        np.testing.assert_array_equal(shared_tcs[:, 0], shared_tcs[:, 1])
+
+        independent_tcs = tc_samples[NO_TC_POOLING]
+        self.assertFalse(
+            np.allclose(independent_tcs[:, 0], independent_tcs[:, 1]))
+
+    def test_material_samples_select_the_material(self):
+        multi_material_model = self.build_model()
+        trace = self.sample(multi_material_model)
+
+        for material_ind, material in enumerate(self.materials.values()):
+            material_samples = multi_material_model.get_material_samples(
+                trace, material)
+
+            for var_name in (UmisMathModel.STAF_VAR_NAME,
+                             UmisMathModel.TC_VAR_NAME):
+                np.testing.assert_array_equal(
+                    trace[var_name][:, material_ind],
+                    material_samples[var_name])
+
+        with self.assertRaises(ValueError):
+            multi_material_model.get_material_samples(
+                trace, DbStub().get_material_by_num(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+""" Tests for creating the random variables of parameter priors """
+import unittest
+
+import numpy as np
+import pymc3 as pm
+
+from bayesumis.umis_data_models import NormalUncertainty, UniformUncertainty
+from bayesumis.umis_math_model import LOG_PARAMETERISATION, ParamPrior
+
+
+class TestParamPrior(unittest.TestCase):
+
+    def test_unit_interval_uniform_outside_interval_is_rejected(self):
+        param_prior = ParamPrior(
+            'TC', 'P1', 'P2', UniformUncertainty(lower=1.5, upper=2))
+
+        with pm.Model():
+            with self.assertRaises(ValueError):
+                param_prior.create_param_rv(unit_interval=True)
+
+    def test_unit_interval_uniform_update_outside_interval_is_rejected(self):
+        param_prior = ParamPrior(
+            'TC', 'P1', 'P2', UniformUncertainty(lower=0.5, upper=2))
+
+        with pm.Model():
+            param_prior.create_param_rv(unit_interval=True)
+
+        param_prior.set_uncertainty(UniformUncertainty(lower=-2, upper=-1))
+
+        with self.assertRaises(ValueError):
+            param_prior.update_shared_params()
+
+    def test_log_normal_prior_is_renormalised(self):
+        param_prior = ParamPrior(
+            'Staf', 'P1', 'P2',
+            NormalUncertainty(mean=0, standard_deviation=1))
+
+        with pm.Model():
+            param_rv = param_prior.create_param_rv(
+                parameterisation=LOG_PARAMETERISATION)
+
+        # Half of the normal lies above 0, so the truncated density doubles
+        self.assertAlmostEqual(
+            2 * np.exp(pm.Normal.dist(mu=0, sd=1).logp(1.).eval()),
+            np.exp(param_rv.distribution.logp(1.).eval()),
+            places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+""" Tests for pooling transfer coefficients across regions """
+import unittest
+
+import numpy as np
+
+from bayesumis.umis_diagram import UmisDiagram
+from bayesumis.umis_fit import NUTS_METHOD
+from bayesumis.umis_math_model import UmisMathModel
+from bayesumis.umis_regional_model import RegionalUmisMathModel
+from testhelper import umis_builders
+from testhelper.test_helper import DbStub
+
+
+class TestRegionalUmisMathModel(unittest.TestCase):
+
+    def build_regional_model(self, tc_groups):
+        regional_stafs, tc_observation_table = \
+            umis_builders.get_umis_diagrams_regions_test()
+
+        regional_diagrams = {
+            region_name: UmisDiagram(
+                external_inflows,
+                set.union(internal_flows, stocks),
+                external_outflows)
+            for region_name, (external_inflows,
+                              internal_flows,
+                              external_outflows,
+                              stocks) in regional_stafs.items()}
+
+        test_db = DbStub()
+
+        return RegionalUmisMathModel(
+            regional_diagrams,
+            test_db.get_material_by_num(1),
+            test_db.get_time_by_num(1),
+            tc_observation_table=tc_observation_table,
+            tc_groups=tc_groups)
+
+    def get_unobserved_tc_mean(self, tc_groups):
+        """
+        Posterior mean of the coefficient from process 1 to process 2 of
+        the region without observations
+        """
+        regional_model = self.build_regional_model(tc_groups)
+
+        fit = regional_model.fit(
+            method=NUTS_METHOD,
+            draws=1000,
+            tune=1000,
+            chains=2,
+            random_seed=42)
+
+        math_model = regional_model.math_model
+        origin_ind = math_model.get_process_ind('P1_Sp2')
+        dest_ind = math_model.get_process_ind('P2_Sp2')
+
+        return np.mean(
+            fit[UmisMathModel.TC_VAR_NAME][:, origin_ind, dest_ind])
+
+    def test_unpooled_region_keeps_its_prior(self):
+        tc_mean = self.get_unobserved_tc_mean(tc_groups={})
+
+        self.assertAlmostEqual(0.5, tc_mean, delta=0.05)
+
+    def test_pooled_region_borrows_observed_coefficient(self):
+        # Processes are grouped by their stafdb id
+        tc_mean = self.get_unobserved_tc_mean(tc_groups=None)
+
+        self.assertGreater(tc_mean, 0.7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+""" Tests for the fused staf solve against the dense matrix inverse graph """
+import unittest
+from unittest import mock
+
+import numpy as np
+import theano
+import theano.tensor as T
+from theano.tensor.nlinalg import matrix_inverse
+
+from bayesumis import umis_throughput_solvers
+from bayesumis.umis_throughput_solvers import (
+    FactorisationCache,
+    FusedStafSolve,
+    get_factorisation_cache,
+    solve_reconciled_stafs)
+
+
+class TestFusedStafSolve(unittest.TestCase):
+
+    # Cycle between processes 1 and 2, with 3 and 4 leaving the system
+    NUM_PROCESSES = 5
+    ORIGIN_INDS = np.array([0, 1, 1, 2, 2], dtype=np.int64)
+    DEST_INDS = np.array([1, 2, 3, 1, 4], dtype=np.int64)
+
+    def setUp(self):
+        self.rng = np.random.RandomState(42)
+
+    def random_point(self, batch_shape=()):
+        num_processes = self.NUM_PROCESSES
+
+        tc_values = self.rng.uniform(0.2, 0.8, batch_shape + (5,))
+        tc_values[..., 0] = 1.0
+        tc_values[..., 2] = 1.0 - tc_values[..., 1]
+        tc_values[..., 4] = 1.0 - tc_values[..., 3]
+
+        input_sums = self.rng.uniform(
+            1.0, 10.0, batch_shape + (num_processes,))
+        staf_ccs = self.rng.uniform(
+            0.5, 2.0, batch_shape + (num_processes, num_processes))
+
+        return tc_values, input_sums, staf_ccs
+
+    def dense_stafs(self, tc_values, input_sums, staf_ccs):
+        """ Reconciled stafs as built by the dense solver """
+        tc_matrix = T.set_subtensor(
+            T.zeros((self.NUM_PROCESSES, self.NUM_PROCESSES))[
+                self.ORIGIN_INDS, self.DEST_INDS],
+            tc_values)
+
+        throughputs = T.dot(
+            matrix_inverse(T.eye(self.NUM_PROCESSES) - tc_matrix.T),
+            input_sums)
+
+        return tc_matrix * T.shape_padright(throughputs) / staf_ccs
+
+    def fused_stafs(self, tc_values, input_sums, staf_ccs):
+        return solve_reconciled_stafs(
+            self.NUM_PROCESSES,
+            tc_values,
+            input_sums,
+            staf_ccs,
+            self.ORIGIN_INDS,
+            self.DEST_INDS)
+
+    def compile_value_and_grads(self, build_stafs, weights):
+        tc_values = T.dvector('tc_values')
+        input_sums = T.dvector('input_sums')
+        staf_ccs = T.dmatrix('staf_ccs')
+
+        loss = T.sum(weights * build_stafs(tc_values, input_sums, staf_ccs))
+        grads = T.grad(loss, [tc_values, input_sums, staf_ccs])
+
+        return theano.function(
+            [tc_values, input_sums, staf_ccs], [loss] + grads)
+
+    def test_stafs_match_dense_graph(self):
+        point = self.random_point()
+        inputs = [T.constant(value) for value in point]
+
+        fused = self.fused_stafs(*inputs).eval()
+        dense = self.dense_stafs(*inputs).eval()
+
+        np.testing.assert_allclose(fused, dense, rtol=1e-10, atol=1e-12)
+
+    def test_gradients_match_dense_graph(self):
+        point = self.random_point()
+        weights = self.rng.normal(
+            size=(self.NUM_PROCESSES, self.NUM_PROCESSES))
+
+        fused = self.compile_value_and_grads(self.fused_stafs, weights)
+        dense = self.compile_value_and_grads(self.dense_stafs, weights)
+
+        for fused_value, dense_value in zip(fused(*point), dense(*point)):
+            np.testing.assert_allclose(
+                fused_value, dense_value, rtol=1e-8, atol=1e-10)
+
+    def test_gradients_match_numerical_gradients(self):
+        point = self.random_point()
+
+        theano.gradient.verify_grad(
+            self.fused_stafs, list(point), rng=self.rng, eps=1e-6)
+
+    def test_scenario_gradients_match_numerical_gradients(self):
+        point = self.random_point(batch_shape=(3,))
+
+        theano.gradient.verify_grad(
+            self.fused_stafs, list(point), rng=self.rng, eps=1e-6)
+
+    def test_scenarios_are_solved_separately(self):
+        tc_values, input_sums, staf_ccs = self.random_point(batch_shape=(3,))
+
+        batched = self.fused_stafs(tc_values, input_sums, staf_ccs).eval()
+
+        for scenario in range(3):
+            np.testing.assert_allclose(
+                batched[scenario],
+                self.fused_stafs(
+                    tc_values[scenario],
+                    input_sums[scenario],
+                    staf_ccs[scenario]).eval())
+
+    def test_gradient_reuses_factorisation_of_every_scenario(self):
+        # More scenarios than the default size of the factorisation cache
+        n_scenarios = 20
+        point = self.random_point(batch_shape=(n_scenarios,))
+
+        tc_values = T.dmatrix('tc_values')
+        input_sums = T.dmatrix('input_sums')
+        staf_ccs = T.dtensor3('staf_ccs')
+
+        loss = T.sum(self.fused_stafs(tc_values, input_sums, staf_ccs))
+        value_and_grads = theano.function(
+            [tc_values, input_sums, staf_ccs],
+            [loss] + T.grad(loss, [tc_values, input_sums, staf_ccs]))
+
+        with mock.patch.object(
+                umis_throughput_solvers,
+                'splu',
+                wraps=umis_throughput_solvers.splu) as splu:
+            value_and_grads(*point)
+
+        self.assertEqual(n_scenarios, splu.call_count)
+
+    def test_singular_system_gives_nan(self):
+        _, input_sums, staf_ccs = self.random_point()
+
+        # Every outflow of the cycle returns to it, so I - TC^T is singular
+        tc_values = np.array([1.0, 1.0, 0.0, 1.0, 0.0])
+
+        fused_solve = FusedStafSolve(
+            self.NUM_PROCESSES,
+            tuple(int(ind) for ind in self.ORIGIN_INDS),
+            tuple(int(ind) for ind in self.DEST_INDS))
+
+        stafs = fused_solve(tc_values, input_sums, staf_ccs).eval()
+
+        self.assertTrue(np.all(np.isnan(stafs)))
+
+
+class TestFactorisationCache(unittest.TestCase):
+
+    # Chain of processes 1 to 3
+    NUM_PROCESSES = 3
+    ORIGIN_INDS = (0, 1)
+    DEST_INDS = (1, 2)
+
+    def setUp(self):
+        self.rng = np.random.RandomState(42)
+
+    def count_factorisations(self, factorisation_cache, tc_values_list):
+        with mock.patch.object(
+                umis_throughput_solvers,
+                'splu',
+                wraps=umis_throughput_solvers.splu) as splu:
+            for tc_values in tc_values_list:
+                factorisation_cache.factorise(tc_values)
+
+        return splu.call_count
+
+    def test_cache_shrinks_after_solve_with_many_scenarios(self):
+        factorisation_cache = FactorisationCache(
+            self.NUM_PROCESSES,
+            self.ORIGIN_INDS,
+            self.DEST_INDS,
+            max_entries=4)
+
+        scenario_tc_values = list(self.rng.uniform(0.2, 0.8, (20, 2)))
+
+        factorisation_cache.reserve(20)
+        self.count_factorisations(factorisation_cache, scenario_tc_values)
+        self.assertEqual(
+            0,
+            self.count_factorisations(
+                factorisation_cache, scenario_tc_values))
+
+        factorisation_cache.reserve(1)
+        self.assertEqual(4, factorisation_cache.max_entries)
+
+        # Only the most recently used factorisations are still held
+        self.assertEqual(
+            0,
+            self.count_factorisations(
+                factorisation_cache, scenario_tc_values[-4:]))
+        self.assertEqual(
+            1,
+            self.count_factorisations(
+                factorisation_cache, scenario_tc_values[-5:-4]))
+
+    def test_least_recently_used_pattern_is_evicted(self):
+        patterns = [
+            (num_processes, self.ORIGIN_INDS, self.DEST_INDS)
+            for num_processes in range(3, 6)]
+
+        with mock.patch.object(
+                umis_throughput_solvers, 'MAX_FACTORISATION_PATTERNS', 2), \
+                mock.patch.dict(
+                    umis_throughput_solvers._factorisation_caches,
+                    clear=True):
+            first_cache = get_factorisation_cache(*patterns[0])
+            second_cache = get_factorisation_cache(*patterns[1])
+
+            # Now more recently used than the second pattern
+            self.assertIs(first_cache, get_factorisation_cache(*patterns[0]))
+
+            get_factorisation_cache(*patterns[2])
+
+            self.assertEqual(
+                2, len(umis_throughput_solvers._factorisation_caches))
+            self.assertIs(first_cache, get_factorisation_cache(*patterns[0]))
+            self.assertIsNot(
+                second_cache, get_factorisation_cache(*patterns[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()